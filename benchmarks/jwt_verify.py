@@ -0,0 +1,81 @@
+"""Token verifications per second of the auth hot path.
+
+Compares python-jose's jwt.decode, which the app used to call per request, with
+TokenVerifier on tokens it has not seen (pre-keyed HMAC only) and on tokens it has
+(memo hits, the steady state of a logged in user):
+
+    python -m benchmarks.jwt_verify --tokens 1000 --count 200000
+
+Tokens are verified round robin, so --tokens is the number of distinct sessions.
+The exit code is 1 when the memo path is below --target verifications/sec.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+SECRET = "benchmark-secret"
+
+
+def rate(count: int, tokens: list[str], verify) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        verify(tokens[i % len(tokens)])
+    return count / (time.perf_counter() - start)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--target", type=float, default=50000)
+    args = parser.parse_args(argv)
+
+    from jose import jwt
+    from src.app.core.tokens import TokenVerifier
+
+    exp = int(time.time()) + 3600
+    tokens = [
+        jwt.encode(
+            {"id": i, "sub": f"user{i}", "role": "user", "ver": 0, "exp": exp},
+            SECRET,
+            algorithm="HS256",
+        )
+        for i in range(args.tokens)
+    ]
+
+    def jose_decode(token):
+        return jwt.decode(token, SECRET, algorithms=["HS256"])
+
+    cold = TokenVerifier(SECRET, memo_size=0)
+    warm = TokenVerifier(SECRET, memo_size=args.tokens)
+    for token in tokens:
+        if not (jose_decode(token) == cold.decode(token) == warm.decode(token)):
+            print("the verifiers disagree", file=sys.stderr)
+            return 1
+
+    # jwt.decode is far slower, a tenth of the count is plenty to measure it
+    results = {
+        "jose_decode": rate(max(args.count // 10, 1), tokens, jose_decode),
+        "verifier_no_memo": rate(args.count, tokens, cold.decode),
+        "verifier_memo": rate(args.count, tokens, warm.decode),
+    }
+    report = {
+        "tokens": args.tokens,
+        "target_per_second": args.target,
+        "results": {
+            name: {
+                "per_second": round(per_second),
+                "us_per_token": 1e6 / per_second,
+                "speedup": per_second / results["jose_decode"],
+            }
+            for name, per_second in results.items()
+        },
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if results["verifier_memo"] >= args.target else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""Load benchmarks for the auth and money paths.
+
+Runs the app in-process through httpx's ASGI transport, seeds users and accounts
+through the access layers and drives concurrent workloads against them:
+
+    python -m benchmarks.load                      # SQLite in a temp dir
+    BENCH_POSTGRES_URL=postgresql://... python -m benchmarks.load
+    python -m benchmarks.load --save-baseline      # store the numbers
+    python -m benchmarks.load --check --tolerance 0.25
+
+Each backend runs in its own process because the engine is configured from the
+environment at import time. Results are printed as JSON, and the exit code is 1
+when a workload regressed against the baseline. With --check, as in CI, a missing
+baseline file or a workload missing from it fails the run with exit code 2 instead
+of passing unchecked.
+
+benchmarks/baseline.json holds the slowest of three reference runs on SQLite.
+Timings depend on the machine, so refresh it with --save-baseline on the hardware
+that runs the check.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+WORKLOADS = ("login_storm", "users_me", "hot_transfers")
+PASSWORD = "benchmark"
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# environment for the process that imports the app, must be set before the import
+def backend_env(backend: str, workdir: str) -> dict:
+    env = dict(os.environ)
+    if backend == "postgres":
+        env["DATABASE_URL"] = os.environ["BENCH_POSTGRES_URL"]
+    else:
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env.setdefault("JWT_SECRET", "benchmark-secret")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env["RATE_LIMIT_ENABLED"] = "false"
+    env["DB_CREATE_ALL"] = "true"
+    return env
+
+
+class Workload:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.seconds = 0.0
+        self.queries = 0.0
+        self.requests = 0.0
+
+    def result(self) -> dict:
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "throughput_rps": count / self.seconds if self.seconds else 0.0,
+            "p50_ms": percentile(self.latencies, 0.50) * 1000,
+            "p95_ms": percentile(self.latencies, 0.95) * 1000,
+            "p99_ms": percentile(self.latencies, 0.99) * 1000,
+            "queries_per_request": (
+                self.queries / self.requests if self.requests else 0.0
+            ),
+        }
+
+
+def _counter_total(metrics, name: str) -> float:
+    return sum(value for (key, _), value in metrics.counters.items() if key == name)
+
+
+async def _drive(
+    workload: Workload, clients: list, concurrency: int, requests: int, call
+):
+    from src.app.core.metrics import metrics
+
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            client = clients[i % len(clients)]
+            start = time.perf_counter()
+            response = await call(client, i)
+            workload.latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                workload.errors += 1
+
+    queries = _counter_total(metrics, "db_queries_total")
+    served = _counter_total(metrics, "http_requests_total")
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    workload.seconds = time.perf_counter() - start
+    workload.queries = _counter_total(metrics, "db_queries_total") - queries
+    workload.requests = _counter_total(metrics, "http_requests_total") - served
+
+
+async def seed(users: int) -> list[dict]:
+    from src.app.core.auth import create_access_token
+    from src.app.db.access_layers import db_accounts, db_users
+    from src.app.db.database import AsyncSessionLocal
+    from src.app.schemas.user_schema import UserBody
+
+    prefix = f"bench{uuid.uuid4().hex[:8]}"
+    seeded = []
+    async with AsyncSessionLocal() as db:
+        for i in range(users):
+            user = await db_users.create_user(
+                db,
+                UserBody(
+                    username=f"{prefix}_{i}",
+                    first_name="Bench",
+                    last_name=f"User{i}",
+                    password=PASSWORD,
+                ),
+            )
+            account = await db_accounts.create_account(db, user.id)
+            token = create_access_token(
+                data={"id": user.id, "sub": user.username, "role": user.role}
+            )
+            seeded.append(
+                {"username": user.username, "account_id": account.id, "token": token}
+            )
+    return seeded
+
+
+async def run_backend(args) -> dict:
+    import httpx
+    from src.app.main import app
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        seeded = await seed(args.users)
+        # the first accounts receive every transfer, the others send them
+        hot = [user["account_id"] for user in seeded[: args.hot_accounts]]
+        # an exception in the app is a 500 for the errors count, not a crashed run
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        clients = [
+            httpx.AsyncClient(
+                transport=transport,
+                base_url="http://bench",
+                cookies={"access_token": user["token"]},
+            )
+            for user in seeded
+        ]
+        try:
+
+            async def login(client, i):
+                user = seeded[i % len(seeded)]
+                return await client.post(
+                    "/api/v1/auth_with_cookie/login",
+                    data={"username": user["username"], "password": PASSWORD},
+                )
+
+            async def users_me(client, i):
+                return await client.get("/api/v1/users/me")
+
+            async def transfer(client, i):
+                return await client.patch(
+                    "/api/v1/accounts/transfer_money",
+                    json={"amount": 1, "to_account_id": hot[i % len(hot)]},
+                )
+
+            senders = clients[args.hot_accounts :] or clients
+            calls = {
+                "login_storm": (clients, args.logins, login),
+                "users_me": (clients, args.requests, users_me),
+                "hot_transfers": (senders, args.requests, transfer),
+            }
+            for name in args.workloads:
+                targets, requests, call = calls[name]
+                workload = Workload(name)
+                await _drive(workload, targets, args.concurrency, requests, call)
+                results[name] = workload.result()
+        finally:
+            for client in clients:
+                await client.aclose()
+    return results
+
+
+# workloads of the current run that the baseline has no numbers for
+def missing_from(baseline: dict, current: dict) -> list[str]:
+    return [
+        f"{backend}/{name}"
+        for backend, workloads in current.items()
+        for name in workloads
+        if name not in baseline.get(backend, {})
+    ]
+
+
+# regressions of the current run against the baseline, as readable messages
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    failures = []
+    for backend, workloads in current.items():
+        for name, result in workloads.items():
+            base = baseline.get(backend, {}).get(name)
+            if base is None:
+                continue
+            label = f"{backend}/{name}"
+            if result["errors"] > base["errors"]:
+                failures.append(f"{label}: {result['errors']} errors")
+            if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+                failures.append(
+                    f"{label}: throughput {result['throughput_rps']:.1f} rps,"
+                    f" baseline {base['throughput_rps']:.1f} rps"
+                )
+            if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                failures.append(
+                    f"{label}: p95 {result['p95_ms']:.2f} ms,"
+                    f" baseline {base['p95_ms']:.2f} ms"
+                )
+            # query counts are deterministic, any increase is a regression
+            if result["queries_per_request"] > base["queries_per_request"] + 0.01:
+                failures.append(
+                    f"{label}: {result['queries_per_request']:.2f} queries per request,"
+                    f" baseline {base['queries_per_request']:.2f}"
+                )
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--hot-accounts", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument(
+        "--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS)
+    )
+    parser.add_argument("--backends", nargs="+", choices=("sqlite", "postgres"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="fail when there is no baseline to compare every workload with",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the results to this file")
+    # internal, runs a single backend in this process and prints its results
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.worker:
+        print(json.dumps(asyncio.run(run_backend(args))))
+        return 0
+    # before the run, a check without a baseline would never fail
+    if args.check and not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"NO BASELINE {args.baseline}, run --save-baseline", file=sys.stderr)
+        return 2
+
+    backends = args.backends or (
+        ["sqlite", "postgres"] if os.getenv("BENCH_POSTGRES_URL") else ["sqlite"]
+    )
+    forwarded = list(argv if argv is not None else sys.argv[1:])
+    results = {}
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as workdir:
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.load", *forwarded]
+                + ["--worker", backend],
+                env=backend_env(backend, workdir),
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+        # the app may log to stdout as well, the results are the last line
+        output = completed.stdout.decode().strip().splitlines()
+        results[backend] = json.loads(output[-1])
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(report)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        missing = missing_from(baseline, results) if args.check else []
+        for label in missing:
+            print(f"NO BASELINE {label}", file=sys.stderr)
+        failures = compare(baseline, results, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        if failures:
+            return 1
+        return 2 if missing else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Per-row cost of serializing a /users/get_users page.
+
+Compares the old path (ORM objects validated into UserResponse and encoded with the
+stdlib json module), the same with orjson, and the row tuple path the route uses
+now (column rows dumped by a TypeAdapter without building ORM objects):
+
+    python -m benchmarks.serialization --rows 5000 --repeat 20
+
+Times include loading the rows from an in-memory SQLite database, since skipping
+ORM hydration is part of the difference.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+def best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import orjson
+    from typing import List
+    from pydantic import TypeAdapter
+    from sqlalchemy import create_engine, insert, select
+    from sqlalchemy.orm import Session
+    from src.app.db.access_layers.db_users import user_columns
+    from src.app.models.models import DBUsers
+    from src.app.schemas.user_schema import UserResponse, user_list_json
+
+    engine = create_engine("sqlite://")
+    DBUsers.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(DBUsers),
+            [
+                {
+                    "username": f"user{i}",
+                    "first_name": f"First{i}",
+                    "last_name": f"Last{i}",
+                    "hashed_password": "x" * 60,
+                    "role": "user",
+                }
+                for i in range(args.rows)
+            ],
+        )
+
+    # what FastAPI does with response_model for a list of ORM objects
+    response_list = TypeAdapter(List[UserResponse])
+
+    def orm_objects():
+        with Session(engine) as db:
+            return db.execute(select(DBUsers)).scalars().all()
+
+    def orm_stdlib_json():
+        users = response_list.validate_python(orm_objects(), from_attributes=True)
+        return json.dumps(response_list.dump_python(users, mode="json")).encode()
+
+    def orm_orjson():
+        users = response_list.validate_python(orm_objects(), from_attributes=True)
+        return orjson.dumps(response_list.dump_python(users, mode="json"))
+
+    def rows_type_adapter():
+        with Session(engine) as db:
+            rows = db.execute(select(*user_columns)).all()
+        return user_list_json.dump_json([row._asdict() for row in rows])
+
+    paths = {
+        "orm_stdlib_json": orm_stdlib_json,
+        "orm_orjson": orm_orjson,
+        "rows_type_adapter": rows_type_adapter,
+    }
+    outputs = {name: json.loads(fn()) for name, fn in paths.items()}
+    if len({json.dumps(output) for output in outputs.values()}) != 1:
+        print("the serialization paths disagree", file=sys.stderr)
+        return 1
+
+    results = {}
+    for name, fn in paths.items():
+        seconds = best_of(args.repeat, fn)
+        results[name] = {
+            "seconds": seconds,
+            "us_per_row": seconds / args.rows * 1e6,
+        }
+    baseline = results["orm_stdlib_json"]["seconds"]
+    for result in results.values():
+        result["speedup"] = baseline / result["seconds"]
+    print(json.dumps({"rows": args.rows, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,28 @@
 from typing import Annotated
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from src.app.core.auth import get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.app.core.auth import (
+    Principal,
+    get_current_principal,
+    get_current_read_user,
+    get_current_user,
+    get_read_db,
+)
+from src.app.core.idempotency import Idempotency, get_idempotency
 from src.app.db.database import get_db
+from src.app.db.access_layers.db_users import UserRow
+from src.app.models.models import DBUsers
 
 
 login_dependency = Annotated[
     OAuth2PasswordRequestForm, Depends()
 ]  # NOTE: The Depends() does not need any params
-db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[Session, Depends(get_current_user)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+user_dependency = Annotated[DBUsers, Depends(get_current_user)]
+# for read-only routes, served by a replica when DATABASE_REPLICA_URLS is set
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+read_user_dependency = Annotated[UserRow, Depends(get_current_read_user)]
+# only the id, username and role from the token, for routes that need no user row
+principal_dependency = Annotated[Principal, Depends(get_current_principal)]
+idempotency_dependency = Annotated[Idempotency, Depends(get_idempotency)]
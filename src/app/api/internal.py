@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends, status
+from src.app.core.auth import get_current_admin
+from src.app.db.database import async_engine, replica_router
+from src.app.db.pool import pool_status
+
+# Operational endpoints, meant to be reachable from inside the deployment only and
+# restricted to admins in case they are not
+router = APIRouter(
+    prefix="/internal", tags=["internal"], dependencies=[Depends(get_current_admin)]
+)
+
+
+# Connection pool usage and checkout wait times of this worker and its replicas
+@router.get("/pool", status_code=status.HTTP_200_OK)
+async def get_pool_status() -> dict:
+    pool = pool_status(async_engine)
+    pool["replicas"] = [
+        dict(replica.status(), pool=pool_status(replica.engine))
+        for replica in replica_router.replicas
+    ]
+    return pool
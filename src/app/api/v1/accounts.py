@@ -1,22 +1,52 @@
-import httpx
+import csv
+import io
+import logging
 import asyncio
-from fastapi import APIRouter, status
-from src.app.schemas.accounts_schema import AccountsResponse, TransferRequest
-from src.app.db.access_layers import db_accounts
-from src.app.api.dependencies import db_dependency, user_dependency
+from typing import Literal, Optional
+import orjson
+from fastapi import APIRouter, Query, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from src.app.schemas.accounts_schema import (
+    AccountsResponse,
+    StatementResponse,
+    TransferBatchRequest,
+    TransferBatchResponse,
+    TransferRequest,
+    statement_json,
+)
+from src.app.core.http_client import http_client
+from src.app.core.query_budget import query_budget
+from src.app.db.access_layers import db_accounts, db_users
+from src.app.api.dependencies import (
+    db_dependency,
+    idempotency_dependency,
+    principal_dependency,
+    read_db_dependency,
+    user_dependency,
+)
 
 router = APIRouter(prefix="/accounts", tags=["accounts"])
+logger = logging.getLogger(__name__)
+
+TODOS_CACHE_TTL = 10
 
 
-# Get the account of the user
+# Get the account of the user, the balance comes from the balance cache and the
+# user row from the user cache, so with both warm it runs no query at all
 @router.get(
     "/get_account",
     status_code=status.HTTP_200_OK,
     response_model=AccountsResponse,
 )
-async def get_account(db: db_dependency, user: user_dependency) -> AccountsResponse:
-    account = await db_accounts.get_account(db, user.id)
-    return account
+@query_budget(2)
+async def get_account(
+    db: read_db_dependency, principal: principal_dependency
+) -> AccountsResponse:
+    balance = await db_accounts.get_cached_balance(db, principal.id)
+    if balance is None:
+        raise db_accounts.account_not_found
+    user = await db_users.get_cached_user_row(db, principal.username)
+    return AccountsResponse.model_validate(dict(balance, user=user))
 
 
 # Create a new account for the user
@@ -25,31 +55,152 @@ async def get_account(db: db_dependency, user: user_dependency) -> AccountsRespo
     status_code=status.HTTP_201_CREATED,
     response_model=AccountsResponse,
 )
+@query_budget(6)
 async def create_account(db: db_dependency, user: user_dependency) -> AccountsResponse:
     account = await db_accounts.create_account(db, user.id)
     return account
 
 
 # Transfer money from one account id to another account id
+# The money moving routes accept an Idempotency-Key header, a retry with the same key
+# gets the original response back instead of moving the money again. Their budgets
+# include the two statements of IDEMPOTENCY_BACKEND=db, claiming and completing a key
 @router.patch("/transfer_money", status_code=status.HTTP_204_NO_CONTENT)
+@query_budget(8)
 async def transfer_money(
     db: db_dependency,
     user: user_dependency,
+    idempotency: idempotency_dependency,
     transfer: TransferRequest,
 ):
-    await db_accounts.transfer_money(db, user, transfer)
+    async def handler():
+        result = await db_accounts.transfer_money(db, user, transfer)
+        logger.info(
+            "Transferred %s from account %s to account %s",
+            result.amount,
+            result.from_account_id,
+            result.to_account_id,
+        )
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return await idempotency.run(user.id, handler)
+
+
+# Transfer money from the users account to many accounts in one transaction
+@router.post(
+    "/transfer_batch",
+    status_code=status.HTTP_200_OK,
+    response_model=TransferBatchResponse,
+)
+@query_budget(7)
+async def transfer_batch(
+    db: db_dependency,
+    user: user_dependency,
+    idempotency: idempotency_dependency,
+    batch: TransferBatchRequest,
+) -> TransferBatchResponse:
+    async def handler():
+        result = await db_accounts.transfer_batch(db, user, batch)
+        return JSONResponse(result.model_dump(mode="json"))
+
+    return await idempotency.run(user.id, handler)
 
 
 # Withdraw money from the users account
 @router.patch("/withdraw_money", status_code=status.HTTP_204_NO_CONTENT)
-async def withdraw_money(db: db_dependency, user: user_dependency, amount: int):
-    await db_accounts.withdraw_money(db, user.id, amount)
+@query_budget(6)
+async def withdraw_money(
+    db: db_dependency,
+    principal: principal_dependency,
+    idempotency: idempotency_dependency,
+    amount: int,
+):
+    async def handler():
+        await db_accounts.withdraw_money(db, principal.id, amount)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return await idempotency.run(principal.id, handler)
 
 
 # Deposit money to the users account
 @router.patch("/deposit_money", status_code=status.HTTP_204_NO_CONTENT)
-async def deposit_money(db: db_dependency, user: user_dependency, amount: int):
-    await db_accounts.deposit_money(db, user.id, amount)
+@query_budget(5)
+async def deposit_money(
+    db: db_dependency,
+    principal: principal_dependency,
+    idempotency: idempotency_dependency,
+    amount: int,
+):
+    async def handler():
+        await db_accounts.deposit_money(db, principal.id, amount)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return await idempotency.run(principal.id, handler)
+
+
+# Get one page of the users account statement, newest transactions first. The rows
+# are dumped to JSON directly, response_model only documents the shape
+@router.get(
+    "/statement",
+    status_code=status.HTTP_200_OK,
+    response_model=StatementResponse,
+)
+@query_budget(3)
+async def get_statement(
+    db: db_dependency,
+    user: user_dependency,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+) -> StatementResponse:
+    account = await db_accounts.get_account(db, user.id)
+    if account is None:
+        raise db_accounts.account_not_found
+    rows, next_cursor = await db_accounts.get_statement_page(
+        db, account.id, limit, cursor
+    )
+    statement = {
+        "account_id": account.id,
+        "transactions": [row._asdict() for row in rows],
+        "next_cursor": next_cursor,
+    }
+    return Response(statement_json.dump_json(statement), media_type="application/json")
+
+
+# Export the full account statement as NDJSON or CSV, streamed so memory stays flat
+@router.get("/statement/export", status_code=status.HTTP_200_OK)
+@query_budget(3)
+async def export_statement(
+    db: db_dependency,
+    user: user_dependency,
+    format: Literal["ndjson", "csv"] = "ndjson",
+) -> StreamingResponse:
+    account = await db_accounts.get_account(db, user.id)
+    if account is None:
+        raise db_accounts.account_not_found
+    fields = [column.key for column in db_accounts.statement_columns]
+
+    async def ndjson_rows():
+        async for rows in db_accounts.stream_statement(account.id):
+            yield b"".join(orjson.dumps(row._asdict()) + b"\n" for row in rows)
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        async for rows in db_accounts.stream_statement(account.id):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"statement-{account.id}.{format}"
+    return StreamingResponse(
+        ndjson_rows() if format == "ndjson" else csv_rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 # Note this is not a part of accounts endpoints but it is a separate test endpoint
@@ -59,10 +210,11 @@ async def deposit_money(db: db_dependency, user: user_dependency, amount: int):
     status_code=status.HTTP_200_OK,
     description="Note this is not a part of accounts endpoints but it is a separate test endpoint",
 )
+@query_budget(0)
 async def get_random_todos():
     urls = ["https://sum-server.100xdevs.com/todos"] * 10
-    async with httpx.AsyncClient() as client:
-        tasks = [client.get(url) for url in urls]
-        responses = await asyncio.gather(*tasks)
+    # the shared client turns the identical urls into a single fetch
+    tasks = [http_client.get(url, cache_ttl=TODOS_CACHE_TTL) for url in urls]
+    responses = await asyncio.gather(*tasks)
     todos = [response.json() for response in responses]
     return todos
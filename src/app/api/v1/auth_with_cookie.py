@@ -1,11 +1,14 @@
+import logging
 from fastapi import APIRouter, HTTPException, status, Response
 from src.app.core.auth import create_access_token
-from src.app.core.hash import verify_password
+from src.app.core.hash import verify_password_async
 from src.app.schemas.user_schema import UserBody
+from src.app.core.query_budget import query_budget
 from src.app.db.access_layers import db_users
 from src.app.api.dependencies import db_dependency, login_dependency
 
 router = APIRouter(prefix="/auth_with_cookie", tags=["auth_with_cookie"])
+logger = logging.getLogger(__name__)
 
 invalid_credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -15,23 +18,23 @@ invalid_credentials_exception = HTTPException(
 
 
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
+@query_budget(4)
 async def create_user(db: db_dependency, create_user_request: UserBody):
-    try:
-        user_already_exists = await db_users.get_user(db, create_user_request.username)
-        if user_already_exists:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Username already exists",
-            )
-    except Exception as e:
-        if e.status_code == status.HTTP_404_NOT_FOUND:
-            # This is desired behavior, the user does not exist
-            pass
-        else:
-            raise e
+    if await db_users.username_exists(db, create_user_request.username):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username already exists",
+        )
+    # roles are granted in the database, a signup can't pick its own
+    create_user_request.role = "user"
     user = await db_users.create_user(db, create_user_request)
     token = create_access_token(
-        data={"id": user.id, "sub": user.username, "role": user.role},
+        data={
+            "id": user.id,
+            "sub": user.username,
+            "role": user.role,
+            "ver": user.token_version,
+        },
     )
     response = Response(status_code=status.HTTP_201_CREATED)
     response.set_cookie(key="access_token", value=token, httponly=True, samesite="Lax")
@@ -39,13 +42,23 @@ async def create_user(db: db_dependency, create_user_request: UserBody):
 
 
 @router.post("/login", status_code=status.HTTP_200_OK)
+@query_budget(1)
 async def login(db: db_dependency, login_data: login_dependency):
-    user = await db_users.get_user(db, login_data.username)
-    is_password_matching = verify_password(login_data.password, user.hashed_password)
+    user = await db_users.get_user_credentials(db, login_data.username)
+    is_password_matching = await verify_password_async(
+        login_data.password, user.hashed_password
+    )
     if not is_password_matching:
+        logger.warning("Failed login for user %s", user.id)
         raise invalid_credentials_exception
+    logger.info("User %s logged in", user.id)
     token = create_access_token(
-        data={"id": user.id, "sub": user.username, "role": user.role}
+        data={
+            "id": user.id,
+            "sub": user.username,
+            "role": user.role,
+            "ver": user.token_version,
+        }
     )
     response = Response(status_code=status.HTTP_200_OK)
     response.set_cookie(key="access_token", value=token, httponly=True, samesite="Lax")
@@ -53,9 +66,12 @@ async def login(db: db_dependency, login_data: login_dependency):
 
 
 @router.delete("/remove_user", status_code=status.HTTP_204_NO_CONTENT)
+@query_budget(6)
 async def remove_user(db: db_dependency, login_data: login_dependency):
     user = await db_users.get_user(db, login_data.username)
-    is_password_matching = verify_password(login_data.password, user.hashed_password)
+    is_password_matching = await verify_password_async(
+        login_data.password, user.hashed_password
+    )
     if not is_password_matching:
         raise invalid_credentials_exception
     await db_users.delete_user(db, user)
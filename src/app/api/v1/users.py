@@ -1,26 +1,41 @@
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
 
-from src.app.core.hash import get_password_hash, verify_password
-from src.app.schemas.user_schema import ChangePasswordBody, PatchUserBody, UserResponse
+from src.app.core.auth import create_access_token
+from src.app.core.hash import get_password_hash_async, verify_password_async
+from src.app.schemas.user_schema import (
+    ChangePasswordBody,
+    PatchUserBody,
+    UserResponse,
+    user_list_json,
+)
+from src.app.core.query_budget import query_budget
 from src.app.db.access_layers import db_users
-from src.app.api.dependencies import db_dependency, user_dependency
+from src.app.api.dependencies import (
+    db_dependency,
+    read_db_dependency,
+    read_user_dependency,
+    user_dependency,
+)
 
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.get("/me", status_code=status.HTTP_200_OK, response_model=UserResponse)
-async def read_users_me(user: user_dependency) -> UserResponse:
+@query_budget(1)
+async def read_users_me(user: read_user_dependency) -> UserResponse:
     return user
 
 
-# change password of current user
+# change password of current user, this logs out every other session of the user
+# and the response carries a new token for this one
 @router.patch("/me/change_password", status_code=status.HTTP_204_NO_CONTENT)
+@query_budget(4)
 async def change_password(
     db: db_dependency, user: user_dependency, password_change: ChangePasswordBody
 ):
-    is_password_correct = verify_password(
+    is_password_correct = await verify_password_async(
         password_change.password, user.hashed_password
     )
     if not is_password_correct:
@@ -29,13 +44,24 @@ async def change_password(
             detail="Incorrect previous password",
         )
 
-    hashed_password = get_password_hash(password_change.new_password)
-    user.hashed_password = hashed_password
-    await db_users.update_user(db, user)
+    hashed_password = await get_password_hash_async(password_change.new_password)
+    token_version = await db_users.change_password(db, user, hashed_password)
+    token = create_access_token(
+        data={
+            "id": user.id,
+            "sub": user.username,
+            "role": user.role,
+            "ver": token_version,
+        }
+    )
+    response = Response(status_code=status.HTTP_204_NO_CONTENT)
+    response.set_cookie(key="access_token", value=token, httponly=True, samesite="Lax")
+    return response
 
 
 # Patch user
 @router.patch("/patch_user", status_code=status.HTTP_204_NO_CONTENT)
+@query_budget(4)
 async def patch_user(
     db: db_dependency, user: user_dependency, user_update: PatchUserBody
 ):
@@ -43,15 +69,28 @@ async def patch_user(
 
 
 # A route to get users from the backend, filterable via first_name, last_name
+# The cursor of the next page is returned in the X-Next-Cursor header. The rows are
+# dumped to JSON directly, response_model only documents the shape
 @router.get(
     "/get_users",
     status_code=status.HTTP_200_OK,
     response_model=List[UserResponse],
 )
+@query_budget(2)
 async def get_users(
-    db: db_dependency,
-    user: user_dependency,
+    db: read_db_dependency,
+    user: read_user_dependency,
     search_filter: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
 ):
-    users = await db_users.get_filtered_users(db, search_filter)
-    return users
+    rows, next_cursor = await db_users.get_filtered_users(
+        db, search_filter, limit, cursor
+    )
+    response = Response(
+        user_list_json.dump_json([row._asdict() for row in rows]),
+        media_type="application/json",
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
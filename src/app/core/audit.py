@@ -0,0 +1,19 @@
+import json
+import logging
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.app.core.jobs import enqueue, job
+
+audit_logger = logging.getLogger("audit")
+
+
+# Record a signup or a balance change, off the request path. Staged in the caller's
+# transaction, so an event exists exactly when its change was committed.
+def audit(db: AsyncSession, event: str, user_id: int, **details) -> None:
+    enqueue(db, "audit_event", event=event, user_id=user_id, **details)
+
+
+@job("audit_event")
+async def record_audit_event(event: str, user_id: int, **details) -> None:
+    audit_logger.info(
+        "%s by user %s %s", event, user_id, json.dumps(details, sort_keys=True)
+    )
@@ -1,11 +1,16 @@
 import os
 from datetime import datetime, timedelta
+from typing import NamedTuple
 from fastapi import Request
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from src.app.db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.app.core.logger import log_context
+from src.app.core.revocations import TOKEN_LIFETIME, token_revocations
+from src.app.core.tokens import TokenVerifier
+from src.app.db.database import get_db, replica_router
+from src.app.db.replicas import LAST_WRITE_COOKIE
 from src.app.db.access_layers import db_users
 
 
@@ -14,8 +19,30 @@ ALGORITHM = "HS256"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# keyed with JWT_SECRET once, tokens are still encoded by python-jose
+token_verifier = TokenVerifier(JWT_SECRET)
 
-def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=48)):
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Invalid authentication credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+forbidden_exception = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail="Not enough permissions",
+)
+
+
+# The user as described by a verified token, for routes that only need the id
+class Principal(NamedTuple):
+    id: int
+    username: str
+    role: str
+
+
+# data holds the id, sub, role and ver claims
+def create_access_token(data: dict, expires_delta: timedelta = TOKEN_LIFETIME):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -27,7 +54,7 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=4
 
 
 # async def get_current_user(
-#     token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+#     token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 # ):
 #     credentials_exception = HTTPException(
 #         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,25 +77,82 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=4
 #         raise credentials_exception
 
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid authentication credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+# decode and verify a token, tokens verified before are answered from the memo
+def decode_access_token(token: str) -> dict:
+    return token_verifier.decode(token)
+
+
+# Read-only routes run on a replica, unless the user wrote within the staleness
+# window, on this worker or as told by the last_write cookie. The token is only
+# decoded to find the user, it is verified again by get_current_read_user.
+async def get_read_db(request: Request):
+    user_id = None
+    token = request.cookies.get("access_token")
+    if token is not None:
+        try:
+            user_id = decode_access_token(token).get("id")
+        except JWTError:
+            pass
+    last_write = request.cookies.get(LAST_WRITE_COOKIE)
+    async with replica_router.session(user_id, last_write) as db:
+        yield db
+
+
+# The claims of the access_token cookie. Tokens issued before a password change or
+# a deletion of their user are rejected by their "ver" claim.
+def verified_claims(request: Request) -> dict:
     token = request.cookies.get("access_token")
     if token is None:
         raise credentials_exception
     try:
-        payload = jwt.decode(
-            token,
-            JWT_SECRET,
-            algorithms=[ALGORITHM],
-        )
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        user = await db_users.get_user(db, username)
-        return user
+        payload = decode_access_token(token)
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None or payload.get("id") is None:
+        raise credentials_exception
+    if token_revocations.is_revoked(payload["id"], payload.get("ver", 0)):
+        raise credentials_exception
+    return payload
+
+
+def _set_log_user(user_id: int) -> None:
+    context = log_context.get()
+    if context is not None:
+        context["user_id"] = user_id
+
+
+# read_only returns a UserRow instead of a DBUsers attached to the session
+async def authenticate(request: Request, db: AsyncSession, read_only: bool = False):
+    username = verified_claims(request)["sub"]
+    if read_only:
+        user = await db_users.get_cached_user_row(db, username)
+    else:
+        user = await db_users.get_cached_user(db, username)
+    _set_log_user(user.id)
+    return user
+
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):
+    return await authenticate(request, db)
+
+
+async def get_current_read_user(
+    request: Request, db: AsyncSession = Depends(get_read_db)
+):
+    return await authenticate(request, db, read_only=True)
+
+
+# no database lookup at all, the claims are trusted once the token is verified
+async def get_current_principal(request: Request) -> Principal:
+    payload = verified_claims(request)
+    _set_log_user(payload["id"])
+    return Principal(payload["id"], payload["sub"], payload.get("role", "user"))
+
+
+# the principal of an admin, any other role is refused
+async def get_current_admin(
+    principal: Principal = Depends(get_current_principal),
+) -> Principal:
+    if principal.role != "admin":
+        raise forbidden_exception
+    return principal
@@ -0,0 +1,164 @@
+import itertools
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+from src.app.core.cache import TTLCache
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+# "memory" is per worker and relies on the ttl across workers, "redis" is shared
+# by all workers so a write is seen everywhere immediately, "none" disables it
+BALANCE_CACHE_BACKEND = os.getenv("BALANCE_CACHE_BACKEND", "memory")
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", 10))
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", 100000))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class BalanceCache(ABC):
+    """Account id and balance of each user's account, keyed by user id.
+
+    Values are plain dicts like ``{"id": 1, "account_balance": 100}``. Every write
+    to a balance invalidates the owner's entry after its commit, which also bumps
+    the user's generation. A reader takes the generation before it loads the
+    balance and ``set`` drops the value if it changed in between, otherwise a read
+    overtaken by a write would cache the balance from before the write.
+    """
+
+    @abstractmethod
+    async def get(self, user_id: int) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def generation(self, user_id: int) -> int:
+        pass
+
+    @abstractmethod
+    async def set(self, user_id: int, value: dict, generation: int) -> None:
+        pass
+
+    @abstractmethod
+    async def invalidate(self, *user_ids: int) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class NullBalanceCache(BalanceCache):
+    async def get(self, user_id: int) -> Optional[dict]:
+        return None
+
+    async def generation(self, user_id: int) -> int:
+        return 0
+
+    async def set(self, user_id: int, value: dict, generation: int) -> None:
+        pass
+
+    async def invalidate(self, *user_ids: int) -> None:
+        pass
+
+
+class MemoryBalanceCache(BalanceCache):
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        # generations come from one counter so an evicted one is never handed out
+        # again, a reader that saw it always fails the check
+        self.generations = TTLCache(maxsize=maxsize, ttl=max(ttl, 60))
+        self._counter = itertools.count(1)
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        return self.entries.get(user_id)
+
+    async def generation(self, user_id: int) -> int:
+        return self.generations.get(user_id, 0)
+
+    async def set(self, user_id: int, value: dict, generation: int) -> None:
+        if self.generations.get(user_id, 0) == generation:
+            self.entries.set(user_id, value)
+
+    async def invalidate(self, *user_ids: int) -> None:
+        for user_id in user_ids:
+            self.entries.pop(user_id)
+            self.generations.set(user_id, next(self._counter))
+
+
+# sets the balance only if the generation is still the one the reader saw
+REDIS_SET_IF_GENERATION = """
+if tonumber(redis.call("GET", KEYS[2]) or "0") == tonumber(ARGV[2]) then
+    redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[3])
+end
+"""
+# generations outlive any read that could have seen them
+REDIS_GENERATION_TTL = 24 * 60 * 60
+
+
+class RedisBalanceCache(BalanceCache):
+    def __init__(self, url: str, ttl: float):
+        if redis is None:
+            raise RuntimeError("BALANCE_CACHE_BACKEND=redis needs the redis package")
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.set_if_generation = self.client.register_script(REDIS_SET_IF_GENERATION)
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"balance:{user_id}"
+
+    @staticmethod
+    def generation_key(user_id: int) -> str:
+        return f"balance_generation:{user_id}"
+
+    # an unreachable redis is treated as a cache miss, reads fall back to the db
+    async def get(self, user_id: int) -> Optional[dict]:
+        try:
+            value = await self.client.get(self.key(user_id))
+        except redis.RedisError:
+            return None
+        return None if value is None else json.loads(value)
+
+    # an unreachable redis gives a generation no set will match
+    async def generation(self, user_id: int) -> int:
+        try:
+            value = await self.client.get(self.generation_key(user_id))
+        except redis.RedisError:
+            return -1
+        return int(value or 0)
+
+    async def set(self, user_id: int, value: dict, generation: int) -> None:
+        try:
+            await self.set_if_generation(
+                keys=[self.key(user_id), self.generation_key(user_id)],
+                args=[json.dumps(value), generation, int(self.ttl * 1000)],
+            )
+        except redis.RedisError:
+            pass
+
+    async def invalidate(self, *user_ids: int) -> None:
+        if not user_ids:
+            return
+        async with self.client.pipeline(transaction=True) as pipeline:
+            for user_id in user_ids:
+                pipeline.incr(self.generation_key(user_id))
+                pipeline.expire(self.generation_key(user_id), REDIS_GENERATION_TTL)
+            pipeline.delete(*(self.key(user_id) for user_id in user_ids))
+            await pipeline.execute()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_balance_cache(backend: str) -> BalanceCache:
+    if backend == "memory":
+        return MemoryBalanceCache(BALANCE_CACHE_SIZE, BALANCE_CACHE_TTL)
+    if backend == "redis":
+        return RedisBalanceCache(REDIS_URL, BALANCE_CACHE_TTL)
+    if backend == "none":
+        return NullBalanceCache()
+    raise ValueError(f"Unknown balance cache backend: {backend}")
+
+
+balance_cache = create_balance_cache(BALANCE_CACHE_BACKEND)
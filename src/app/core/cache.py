@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """In-process LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
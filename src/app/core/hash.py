@@ -1,8 +1,27 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from src.app.core.metrics import metrics
 
 
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt releases the GIL so threads are usually enough, "process" is there for
+# deployments where the hashing cost has to be kept off the worker's interpreter
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", min(4, os.cpu_count() or 1)))
+# how many hashes may be running or waiting for the pool before we answer 429
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 64))
+
+too_many_hash_requests = HTTPException(
+    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+    detail="Too many requests, try again later",
+    headers={"Retry-After": "1"},
+)
+
 
 def get_password_hash(password):
     return bcrypt_context.hash(password)
@@ -10,3 +29,115 @@ def get_password_hash(password):
 
 def verify_password(plain_password, hashed_password):
     return bcrypt_context.verify(plain_password, hashed_password)
+
+
+# runs inside the pool so the measured time is the hash itself, without queueing
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class HashingService:
+    """Runs bcrypt on a bounded worker pool instead of the event loop."""
+
+    def __init__(self, kind: str = "thread", size: int = 4, queue_limit: int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown hash pool kind: {kind}")
+        self.kind = kind
+        self.size = size
+        self.queue_limit = queue_limit
+        self._executor: Executor | None = None
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.size)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix="hash"
+                )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise too_many_hash_requests
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, elapsed = await loop.run_in_executor(
+                self.executor, _timed, fn, *args
+            )
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.hash_seconds += elapsed
+        self.wait_seconds += time.perf_counter() - start - elapsed
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "pool_kind": self.kind,
+            "pool_size": self.size,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.pending,
+            "queue_depth": max(0, self.pending - self.size),
+            "max_in_flight": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "hash_seconds_total": self.hash_seconds,
+            "wait_seconds_total": self.wait_seconds,
+        }
+
+    def metric_samples(self):
+        stats = self.stats()
+        yield "password_hash_in_flight", {}, stats["in_flight"]
+        yield "password_hash_queue_depth", {}, stats["queue_depth"]
+        yield "password_hash_completed_total", {}, stats["completed"]
+        yield "password_hash_rejected_total", {}, stats["rejected"]
+        yield "password_hash_seconds_total", {}, stats["hash_seconds_total"]
+        yield "password_hash_wait_seconds_total", {}, stats["wait_seconds_total"]
+
+    # passlib picks the bcrypt backend on the first hash, do it before serving traffic
+    def warm_up(self):
+        bcrypt_context.handler().get_backend()
+        self.executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_service = HashingService(HASH_POOL_KIND, HASH_POOL_SIZE, HASH_QUEUE_LIMIT)
+metrics.gauge("password_hash_in_flight", "Password hashes running or queued")
+metrics.gauge("password_hash_queue_depth", "Password hashes waiting for a worker")
+metrics.counter("password_hash_completed_total", "Password hashes completed")
+metrics.counter("password_hash_rejected_total", "Password hashes rejected with 429")
+metrics.counter("password_hash_seconds_total", "Time spent hashing passwords")
+metrics.counter("password_hash_wait_seconds_total", "Time hashes waited for a worker")
+metrics.register_collector(hashing_service.metric_samples)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hashing_service.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_service.verify(plain_password, hashed_password)
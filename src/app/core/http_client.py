@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Optional
+from urllib.parse import urlsplit
+import httpx
+from src.app.core.cache import TTLCache
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_CLIENT_TIMEOUT = float(os.getenv("HTTP_CLIENT_TIMEOUT", 5))
+HTTP_CLIENT_CONNECT_TIMEOUT = float(os.getenv("HTTP_CLIENT_CONNECT_TIMEOUT", 2))
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", 100))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", 20))
+# requests in flight to a single host, the rest wait for a slot
+HTTP_CLIENT_PER_HOST_LIMIT = int(os.getenv("HTTP_CLIENT_PER_HOST_LIMIT", 10))
+HTTP_CLIENT_RETRIES = int(os.getenv("HTTP_CLIENT_RETRIES", 2))
+HTTP_CLIENT_BACKOFF = float(os.getenv("HTTP_CLIENT_BACKOFF", 0.1))
+HTTP_CLIENT_CACHE_SIZE = int(os.getenv("HTTP_CLIENT_CACHE_SIZE", 1024))
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundHTTPClient:
+    """One pooled httpx client for all outbound calls of the worker.
+
+    GETs to the same url that are in flight at the same time share one request, and
+    successful responses can be cached for ``cache_ttl`` seconds. Opened and closed
+    by the app lifespan, tests can pass an ``httpx.MockTransport`` to ``start``.
+    """
+
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self.host_limits: dict[str, asyncio.Semaphore] = {}
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.cache = TTLCache(maxsize=HTTP_CLIENT_CACHE_SIZE)
+
+    async def start(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE and transport is None,
+            transport=transport,
+            timeout=httpx.Timeout(
+                HTTP_CLIENT_TIMEOUT, connect=HTTP_CLIENT_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE,
+            ),
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        self.cache.clear()
+
+    async def get(self, url: str, cache_ttl: float = 0) -> httpx.Response:
+        if cache_ttl:
+            cached = self.cache.get(url)
+            if cached is not None:
+                return cached
+
+        in_flight = self.in_flight.get(url)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        task = asyncio.ensure_future(self.request("GET", url))
+        self.in_flight[url] = task
+        try:
+            response = await asyncio.shield(task)
+        finally:
+            if self.in_flight.get(url) is task:
+                del self.in_flight[url]
+        if cache_ttl and response.is_success:
+            self.cache.set(url, response, ttl=cache_ttl)
+        return response
+
+    # retry connection errors, timeouts and overload responses with jittered backoff
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self.client is None:
+            raise RuntimeError("The outbound http client has not been started")
+        host = urlsplit(url).netloc
+        limit = self.host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(HTTP_CLIENT_PER_HOST_LIMIT)
+            self.host_limits[host] = limit
+
+        for attempt in range(HTTP_CLIENT_RETRIES + 1):
+            last_attempt = attempt == HTTP_CLIENT_RETRIES
+            try:
+                async with limit:
+                    response = await self.client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+            delay = random.uniform(0, HTTP_CLIENT_BACKOFF * 2**attempt)
+            logger.info("Retrying %s %s in %.3fs", method, url, delay)
+            await asyncio.sleep(delay)
+
+
+http_client = OutboundHTTPClient()
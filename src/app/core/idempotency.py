@@ -0,0 +1,207 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from fastapi import Header, HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from src.app.core.cache import TTLCache
+from src.app.db.database import AsyncSessionLocal
+from src.app.models.models import DBIdempotencyKeys
+
+# "memory" works for a single worker, "db" shares the keys between all workers
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 100000))
+
+key_in_progress = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="A request with this Idempotency-Key is still being processed",
+)
+key_reused = HTTPException(
+    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    detail="Idempotency-Key was already used for a different request",
+)
+
+
+@dataclass
+class IdempotencyRecord:
+    fingerprint: str
+    # None while the first request is still being processed
+    status_code: Optional[int] = None
+    media_type: Optional[str] = None
+    body: bytes = b""
+
+
+class IdempotencyStore(ABC):
+    """Remembers the response sent for each key so a retry can be answered from it."""
+
+    # claim the key, returns the existing record instead if the key was already claimed
+    @abstractmethod
+    async def reserve(self, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        pass
+
+    @abstractmethod
+    async def complete(self, key: str, record: IdempotencyRecord) -> None:
+        pass
+
+    # forget the key so that the request can be retried
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        pass
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, maxsize: int, ttl: float):
+        self.records = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def reserve(self, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        record = self.records.get(key)
+        if record is None:
+            self.records.set(key, IdempotencyRecord(fingerprint=fingerprint))
+        return record
+
+    async def complete(self, key: str, record: IdempotencyRecord) -> None:
+        self.records.set(key, record)
+
+    async def release(self, key: str) -> None:
+        self.records.pop(key)
+
+
+class DBIdempotencyStore(IdempotencyStore):
+    # The unique index on key decides which of two concurrent requests gets to run.
+    # Each call commits on its own session, independent of the request's transaction.
+    def __init__(self, ttl: float):
+        self.ttl = timedelta(seconds=ttl)
+
+    async def reserve(self, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        async with AsyncSessionLocal() as db:
+            for _ in range(2):
+                db.add(DBIdempotencyKeys(key=key, fingerprint=fingerprint))
+                try:
+                    await db.commit()
+                    return None
+                except IntegrityError:
+                    await db.rollback()
+                row = (
+                    await db.execute(
+                        select(DBIdempotencyKeys).where(DBIdempotencyKeys.key == key)
+                    )
+                ).scalar_one_or_none()
+                if row is not None and row.created_at > datetime.utcnow() - self.ttl:
+                    return IdempotencyRecord(
+                        fingerprint=row.fingerprint,
+                        status_code=row.status_code,
+                        media_type=row.media_type,
+                        body=row.body or b"",
+                    )
+                # expired (or released in the meantime), claim it again
+                await db.execute(
+                    delete(DBIdempotencyKeys).where(DBIdempotencyKeys.key == key)
+                )
+                await db.commit()
+            raise key_in_progress
+
+    async def complete(self, key: str, record: IdempotencyRecord) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(DBIdempotencyKeys)
+                .where(DBIdempotencyKeys.key == key)
+                .values(
+                    status_code=record.status_code,
+                    media_type=record.media_type,
+                    body=record.body,
+                )
+            )
+            await db.commit()
+
+    async def release(self, key: str) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(DBIdempotencyKeys).where(DBIdempotencyKeys.key == key)
+            )
+            await db.commit()
+
+
+def create_store(backend: str) -> IdempotencyStore:
+    if backend == "db":
+        return DBIdempotencyStore(IDEMPOTENCY_TTL)
+    if backend == "memory":
+        return MemoryIdempotencyStore(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+    raise ValueError(f"Unknown idempotency backend: {backend}")
+
+
+store = create_store(IDEMPOTENCY_BACKEND)
+
+
+class Idempotency:
+    """Runs a money moving handler at most once per (user, Idempotency-Key)."""
+
+    def __init__(self, request: Request, key: Optional[str]):
+        self.request = request
+        self.key = key
+
+    async def _fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.request.method.encode())
+        digest.update(self.request.url.path.encode())
+        digest.update(self.request.url.query.encode())
+        digest.update(await self.request.body())
+        return digest.hexdigest()
+
+    async def run(
+        self, user_id: int, handler: Callable[[], Awaitable[Response]]
+    ) -> Response:
+        if self.key is None:
+            return await handler()
+
+        key = f"{user_id}:{self.key}"
+        fingerprint = await self._fingerprint()
+        record = await store.reserve(key, fingerprint)
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                raise key_reused
+            if record.status_code is None:
+                raise key_in_progress
+            return Response(
+                content=record.body,
+                status_code=record.status_code,
+                media_type=record.media_type,
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        try:
+            response = await handler()
+        except HTTPException as e:
+            # client errors are final and replayed, anything else may be retried
+            retryable = e.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+            if retryable or e.status_code >= 500:
+                await store.release(key)
+                raise
+            error = JSONResponse({"detail": e.detail}, status_code=e.status_code)
+            await store.complete(key, _record(fingerprint, error))
+            raise
+        except BaseException:
+            await store.release(key)
+            raise
+        await store.complete(key, _record(fingerprint, response))
+        return response
+
+
+def _record(fingerprint: str, response: Response) -> IdempotencyRecord:
+    return IdempotencyRecord(
+        fingerprint=fingerprint,
+        status_code=response.status_code,
+        media_type=response.media_type,
+        body=bytes(response.body),
+    )
+
+
+async def get_idempotency(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+) -> Idempotency:
+    return Idempotency(request, idempotency_key)
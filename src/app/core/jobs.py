@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, NamedTuple, Optional
+from sqlalchemy import delete, event, inspect, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+from src.app.core.metrics import metrics
+from src.app.models.models import DBOutbox
+
+# jobs waiting for a worker in memory, the rest wait in the outbox table until the
+# poller finds room, so a full queue never blocks or fails a request
+JOBS_QUEUE_SIZE = int(os.getenv("JOBS_QUEUE_SIZE", 1000))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", 4))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", 5))
+# first retry delay in seconds, doubled on every further attempt
+JOBS_BACKOFF = float(os.getenv("JOBS_BACKOFF", 1))
+JOBS_TIMEOUT = float(os.getenv("JOBS_TIMEOUT", 30))
+# how often the outbox is polled for jobs that are due, retries and jobs left
+# behind by a full queue or a restart
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", 1))
+# how long a worker may hold a job before another worker may take it over
+JOBS_LEASE = timedelta(seconds=JOBS_TIMEOUT * 2)
+# how long shutdown waits for the queued jobs, the rest run after the restart
+JOBS_DRAIN_SECONDS = float(os.getenv("JOBS_DRAIN_SECONDS", 5))
+
+logger = logging.getLogger(__name__)
+
+metrics.counter("jobs_completed_total", "Background jobs that succeeded")
+metrics.counter("jobs_retried_total", "Background job attempts that will be retried")
+metrics.counter("jobs_failed_total", "Background jobs that ran out of attempts")
+
+Handler = Callable[..., Awaitable[None]]
+registry: dict[str, Handler] = {}
+
+
+class Job(NamedTuple):
+    id: int
+    name: str
+    payload: dict
+    attempts: int
+    # the row is leased to this worker already
+    claimed: bool = False
+
+
+# Register a handler for a job name, it is called with the payload as keyword
+# arguments. Jobs run at least once, so handlers must be safe to run twice:
+#
+#     @job("audit_event")
+#     async def record_audit_event(event: str, user_id: int, **details): ...
+def job(name: str) -> Callable[[Handler], Handler]:
+    def decorator(handler: Handler) -> Handler:
+        registry[name] = handler
+        return handler
+
+    return decorator
+
+
+# Stage a job in the session's transaction. It is written by the caller's commit
+# together with the change it belongs to, and handed to the workers right after
+# that commit. The row starts out leased to this worker so running it needs no
+# claim. The payload must be JSON serializable.
+def enqueue(db: AsyncSession, name: str, **payload) -> None:
+    lease = datetime.utcnow() + JOBS_LEASE if job_queue.running else None
+    row = DBOutbox(job=name, payload=payload, locked_until=lease)
+    db.add(row)
+    db.sync_session.info.setdefault("outbox", []).append((row, name, payload))
+
+
+class JobQueue:
+    """In-process worker pool over the outbox table.
+
+    Committed jobs go straight to a bounded in-memory queue, the poller loads the
+    rest from the table: jobs that did not fit, retries that are due and everything
+    still pending from before a restart. Rows are leased to one worker at a time so
+    a job runs once even when several workers poll, and deleted on success. A failed
+    job is retried with exponential backoff up to ``JOBS_MAX_ATTEMPTS``. Jobs of a
+    worker that died are taken over when their lease runs out.
+    """
+
+    def __init__(self, size: int, workers: int):
+        self.queue: asyncio.Queue[Job] = asyncio.Queue(size)
+        self.workers = workers
+        self.sessionmaker: Optional[async_sessionmaker] = None
+        # ids in the memory queue or running, so the poller does not add them twice
+        self.queued: set[int] = set()
+        # leased rows that did not fit in the queue, the poller picks them up first
+        self.overflow: set[int] = set()
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def submit(self, job: Job) -> bool:
+        if not self.running or job.id in self.queued:
+            return False
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return False
+        self.queued.add(job.id)
+        return True
+
+    async def poll(self) -> int:
+        room = self.queue.maxsize - self.queue.qsize()
+        if room <= 0:
+            return 0
+        now = datetime.utcnow()
+        overflow = list(self.overflow)[:room]
+        async with self.sessionmaker() as db:
+            result = await db.execute(
+                select(DBOutbox.id, DBOutbox.job, DBOutbox.payload, DBOutbox.attempts)
+                .where(
+                    DBOutbox.status == "pending",
+                    DBOutbox.run_after <= now,
+                    or_(
+                        DBOutbox.locked_until.is_(None),
+                        DBOutbox.locked_until < now,
+                        DBOutbox.id.in_(overflow),
+                    ),
+                )
+                .order_by(DBOutbox.id.in_(overflow).desc(), DBOutbox.id)
+                .limit(room)
+            )
+            rows = result.all()
+        submitted = 0
+        for row in rows:
+            if self.submit(Job(*row, claimed=row.id in self.overflow)):
+                self.overflow.discard(row.id)
+                submitted += 1
+        return submitted
+
+    async def claim(self, db: AsyncSession, job: Job) -> bool:
+        now = datetime.utcnow()
+        claimed = await db.execute(
+            update(DBOutbox)
+            .where(
+                DBOutbox.id == job.id,
+                DBOutbox.status == "pending",
+                or_(DBOutbox.locked_until.is_(None), DBOutbox.locked_until < now),
+            )
+            .values(locked_until=now + JOBS_LEASE)
+        )
+        await db.commit()
+        return claimed.rowcount == 1
+
+    async def run(self, job: Job) -> None:
+        async with self.sessionmaker() as db:
+            if not job.claimed and not await self.claim(db, job):
+                return
+
+            handler = registry.get(job.name)
+            try:
+                if handler is None:
+                    raise LookupError(f"No job registered as {job.name}")
+                await asyncio.wait_for(handler(**job.payload), JOBS_TIMEOUT)
+            except Exception as e:
+                attempts = job.attempts + 1
+                values = {"attempts": attempts, "locked_until": None}
+                values["last_error"] = repr(e)[:1000]
+                if attempts >= JOBS_MAX_ATTEMPTS or handler is None:
+                    values["status"] = "failed"
+                    metrics.inc("jobs_failed_total", (("job", job.name),))
+                    logger.error("Job %s %s failed: %r", job.name, job.id, e)
+                else:
+                    delay = JOBS_BACKOFF * 2 ** (attempts - 1)
+                    values["run_after"] = datetime.utcnow() + timedelta(
+                        seconds=delay * random.uniform(0.5, 1.5)
+                    )
+                    metrics.inc("jobs_retried_total", (("job", job.name),))
+                    logger.warning("Job %s %s will be retried: %r", job.name, job.id, e)
+                await db.execute(
+                    update(DBOutbox).where(DBOutbox.id == job.id).values(**values)
+                )
+            else:
+                await db.execute(delete(DBOutbox).where(DBOutbox.id == job.id))
+                metrics.inc("jobs_completed_total", (("job", job.name),))
+            await db.commit()
+
+    async def _work(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run(job)
+            except Exception:
+                if asyncio.current_task().cancelling():
+                    raise
+                logger.exception("Job %s %s could not be run", job.name, job.id)
+            finally:
+                self.queued.discard(job.id)
+                self.queue.task_done()
+
+    async def _poll_forever(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                # a cancel landing while the session closes comes out as a
+                # database error, it still means stop
+                if asyncio.current_task().cancelling():
+                    raise
+                logger.exception("Failed to poll the outbox")
+            await asyncio.sleep(JOBS_POLL_INTERVAL)
+
+    # start the workers and the poller, whose first poll picks up the jobs that
+    # were pending when the app last stopped. Called by the app lifespan
+    async def start(self, sessionmaker: async_sessionmaker) -> None:
+        self.sessionmaker = sessionmaker
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll_forever()))
+
+    async def close(self) -> None:
+        if not self.running:
+            return
+        # stop polling, give the queued jobs a moment, then stop the workers
+        self._tasks[-1].cancel()
+        try:
+            await asyncio.wait_for(self.queue.join(), JOBS_DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("%s jobs left for the next start", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # give back the leases of the jobs that never ran, for the next start
+        unstarted = list(self.overflow)
+        while not self.queue.empty():
+            unstarted.append(self.queue.get_nowait().id)
+        if unstarted:
+            async with self.sessionmaker() as db:
+                await db.execute(
+                    update(DBOutbox)
+                    .where(DBOutbox.id.in_(unstarted))
+                    .values(locked_until=None)
+                )
+                await db.commit()
+        self.queue = asyncio.Queue(self.queue.maxsize)
+        self.queued.clear()
+        self.overflow.clear()
+
+
+job_queue = JobQueue(JOBS_QUEUE_SIZE, JOBS_WORKERS)
+
+
+# hand the jobs staged by enqueue to the workers once their transaction committed
+@event.listens_for(Session, "after_commit")
+def _dispatch_outbox(session):
+    for row, name, payload in session.info.pop("outbox", ()):
+        identity = inspect(row).identity
+        if identity is None:
+            continue
+        job = Job(identity[0], name, payload, 0, claimed=True)
+        if not job_queue.submit(job) and job_queue.running:
+            job_queue.overflow.add(job.id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_outbox(session):
+    session.info.pop("outbox", None)
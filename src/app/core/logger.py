@@ -1,20 +1,118 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+from src.app.core.metrics import metrics
 
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-
 LOG_FILE_PATH = os.path.join(LOG_DIR, "app.log")
 
-LOGGING_LEVEL = logging.INFO
-LOGGING_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOGGING_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# records waiting for the writer thread, further records are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# fraction of INFO and lower records that are kept, warnings and errors always are
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", 1.0))
+# loggers whose records are all kept whatever the sample rate, like the audit trail.
+# Other records opt out with extra={"sampled": False}
+LOG_UNSAMPLED_LOGGERS = ("audit",)
+
+# request_id, user_id and the ASGI scope of the request being served
+log_context: ContextVar[Optional[dict]] = ContextVar("log_context", default=None)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the request context captured at the call site."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "user_id": getattr(record, "user_id", None),
+            "route": getattr(record, "route", None),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float, unsampled_loggers: tuple = LOG_UNSAMPLED_LOGGERS):
+        super().__init__()
+        self.rate = rate
+        self.unsampled_loggers = unsampled_loggers
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not getattr(record, "sampled", True):
+            return True
+        if record.name.split(".", 1)[0] in self.unsampled_loggers:
+            return True
+        return random.random() < self.rate
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to the writer thread without ever blocking the caller."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Only the context is captured here, formatting and I/O happen on the writer thread
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        context = log_context.get()
+        if context is not None:
+            scope = context.get("scope") or {}
+            route = scope.get("route")
+            record.request_id = context.get("request_id")
+            record.user_id = context.get("user_id")
+            record.route = getattr(route, "path", None) or scope.get("path")
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    os.makedirs(LOG_DIR, exist_ok=True)
+    formatter = JSONFormatter()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=10485760, backupCount=5)
+    file_handler.setFormatter(formatter)
+
+    queue_handler = BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if LOG_INFO_SAMPLE_RATE < 1:
+        queue_handler.addFilter(SamplingFilter(LOG_INFO_SAMPLE_RATE))
 
-logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
+    root = logging.getLogger("")
+    root.handlers = [queue_handler]
+    root.setLevel(LOGGING_LEVEL)
 
-file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=10485760, backupCount=5)
-file_handler.setLevel(LOGGING_LEVEL)
-file_handler.setFormatter(logging.Formatter(LOGGING_FORMAT))
+    listener = QueueListener(
+        queue_handler.queue, stream_handler, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
 
-logging.getLogger("").addHandler(file_handler)
+    metrics.counter("log_records_dropped_total", "Log records dropped on a full queue")
+    metrics.register_collector(
+        lambda: [("log_records_dropped_total", {}, queue_handler.dropped)]
+    )
+    return listener
@@ -0,0 +1,240 @@
+import glob
+import json
+import math
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Iterable, Optional
+
+# When set, every worker writes its snapshot to this directory and /metrics merges
+# the snapshots of all workers, like prometheus_client's multiprocess mode
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+LATENCY_BUCKETS += (1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+Labels = tuple[tuple[str, str], ...]
+# a collector returns (name, labels, value) gauge samples at scrape time
+Collector = Callable[[], Iterable[tuple[str, dict, float]]]
+
+# statements executed in the current request, see count_db_query
+db_query_count: ContextVar[Optional[list[int]]] = ContextVar(
+    "db_query_count", default=None
+)
+
+
+def count_db_query(*args) -> None:
+    counter = db_query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class Metrics:
+    """Per-worker counters, gauges and histograms rendered in Prometheus text format.
+
+    Everything is updated from the event loop thread only, so plain dict updates are
+    enough and no locks are taken on the request path.
+    """
+
+    def __init__(self):
+        self.kinds: dict[str, tuple[str, str]] = {}
+        self.gauge_modes: dict[str, str] = {}
+        self.buckets: dict[str, tuple[float, ...]] = {}
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.gauges: dict[tuple[str, Labels], float] = {}
+        # bucket counts (not cumulative) followed by the sum and the count
+        self.histograms: dict[tuple[str, Labels], list[float]] = {}
+        self.collectors: list[Collector] = []
+        self.last_flush = 0.0
+
+    def counter(self, name: str, documentation: str) -> None:
+        self.kinds[name] = ("counter", documentation)
+
+    # mode is how the workers' values are merged, "sum" for shares of a total like
+    # the requests in flight, "max" for values every worker has on its own
+    def gauge(self, name: str, documentation: str, mode: str = "sum") -> None:
+        if mode not in ("sum", "max"):
+            raise ValueError(f"Unknown gauge mode: {mode}")
+        self.kinds[name] = ("gauge", documentation)
+        self.gauge_modes[name] = mode
+
+    def histogram(self, name: str, documentation: str, buckets: tuple) -> None:
+        self.kinds[name] = ("histogram", documentation)
+        self.buckets[name] = tuple(buckets)
+
+    def register_collector(self, collector: Collector) -> None:
+        self.collectors.append(collector)
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        key = (name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def set(self, name: str, labels: Labels = (), value: float = 0) -> None:
+        self.gauges[(name, labels)] = value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        buckets = self.buckets[name]
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(buckets) + 3)
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def snapshot(self) -> dict:
+        gauges = dict(self.gauges)
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                gauges[(name, tuple(sorted(labels.items())))] = value
+        return {
+            "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+            "gauges": [[n, list(l), v] for (n, l), v in gauges.items()],
+            "histograms": [[n, list(l), v] for (n, l), v in self.histograms.items()],
+        }
+
+    # write this worker's snapshot where the other workers can merge it, the snapshot
+    # is taken by the caller on the event loop so the write can happen on a thread
+    def write_snapshot(self, snapshot: dict) -> None:
+        path = _snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path + ".tmp", path)
+
+    # called on shutdown, so a stopped worker is not merged into later scrapes
+    def remove_snapshot(self) -> None:
+        if not METRICS_MULTIPROC_DIR:
+            return
+        try:
+            os.remove(_snapshot_path(os.getpid()))
+        except FileNotFoundError:
+            pass
+
+    def flush(self) -> Optional[dict]:
+        if not METRICS_MULTIPROC_DIR:
+            return None
+        self.last_flush = time.monotonic()
+        return self.snapshot()
+
+    def flush_due(self) -> bool:
+        return bool(METRICS_MULTIPROC_DIR) and (
+            time.monotonic() - self.last_flush >= METRICS_FLUSH_INTERVAL
+        )
+
+    def collect(self) -> list[dict]:
+        if not METRICS_MULTIPROC_DIR:
+            return [self.snapshot()]
+        self.write_snapshot(self.flush())
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, "*.json")):
+            # left behind by a worker that was killed before it could remove it
+            pid = os.path.basename(path)[: -len(".json")]
+            if not pid.isdigit() or not _is_running(int(pid)):
+                continue
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # a worker is replacing its file or went away mid scrape
+                continue
+        return snapshots
+
+    # merge the snapshots of all workers, counters and histograms are summed and
+    # gauges are merged by their mode
+    def render(self, snapshots: list[dict]) -> str:
+        merged: dict[str, dict[Labels, object]] = {}
+        for snapshot in snapshots:
+            for kind in ("counters", "gauges"):
+                for name, labels, value in snapshot[kind]:
+                    samples = merged.setdefault(name, {})
+                    labels = tuple(tuple(pair) for pair in labels)
+                    current = samples.get(labels)
+                    if current is None:
+                        samples[labels] = value
+                    elif kind == "gauges" and self.gauge_modes.get(name) == "max":
+                        samples[labels] = max(current, value)
+                    else:
+                        samples[labels] = current + value
+            for name, labels, value in snapshot["histograms"]:
+                samples = merged.setdefault(name, {})
+                labels = tuple(tuple(pair) for pair in labels)
+                current = samples.get(labels)
+                if current is None:
+                    samples[labels] = list(value)
+                else:
+                    samples[labels] = [a + b for a, b in zip(current, value)]
+
+        lines = []
+        for name in sorted(merged):
+            kind, documentation = self.kinds.get(name, ("gauge", name))
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(merged[name].items()):
+                if kind != "histogram":
+                    lines.append(_sample(name, labels, value))
+                    continue
+                cumulative = 0
+                bounds = [*self.buckets[name], math.inf]
+                for bound, count in zip(bounds, value[: len(bounds)]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else _format_value(bound)
+                    bucket_labels = labels + (("le", le),)
+                    lines.append(_sample(f"{name}_bucket", bucket_labels, cumulative))
+                lines.append(_sample(f"{name}_sum", labels, value[-2]))
+                lines.append(_sample(f"{name}_count", labels, value[-1]))
+        return "\n".join(lines) + "\n"
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_MULTIPROC_DIR, f"{pid}.json")
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, as another user
+        return True
+    return True
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(name: str, labels: Labels, value: float) -> str:
+    if not labels:
+        return f"{name} {_format_value(value)}"
+    formatted = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+    return f"{name}{{{formatted}}} {_format_value(value)}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+metrics = Metrics()
+metrics.counter("http_requests_total", "HTTP requests by method, route and status")
+metrics.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by method and route",
+    LATENCY_BUCKETS,
+)
+metrics.gauge("http_requests_in_flight", "HTTP requests currently being served")
+metrics.counter("db_queries_total", "Database statements executed by route")
+metrics.histogram(
+    "db_queries_per_request",
+    "Database statements executed per request by route",
+    QUERY_COUNT_BUCKETS,
+)
@@ -0,0 +1,38 @@
+import logging
+from typing import Callable, Optional
+from src.app.db.database import env_flag
+
+# raise instead of only logging when a route runs more statements than its budget,
+# meant for tests and local debugging
+QUERY_BUDGET_STRICT = env_flag("QUERY_BUDGET_STRICT", False)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+# Declare the most statements a route may run per request, checked by the metrics
+# middleware. Goes below the router decorator:
+#
+#     @router.get("/me")
+#     @query_budget(1)
+#     async def read_users_me(...): ...
+def query_budget(limit: int) -> Callable:
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.__query_budget__ = limit
+        return endpoint
+
+    return decorator
+
+
+def get_query_budget(endpoint: Optional[Callable]) -> Optional[int]:
+    return getattr(endpoint, "__query_budget__", None)
+
+
+def report_over_budget(route_path: str, count: int, budget: int) -> None:
+    message = f"{route_path} ran {count} statements, its query budget is {budget}"
+    if QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
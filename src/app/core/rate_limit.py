@@ -0,0 +1,112 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+from src.app.db.database import env_flag
+
+RATE_LIMIT_ENABLED = env_flag("RATE_LIMIT_ENABLED", True)
+# token buckets, tokens per second and bucket size
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", 50))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", 100))
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", 20))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", 40))
+# per route limits for each client as "METHOD /path=limit/window_seconds", comma
+# separated
+RATE_LIMIT_ROUTES = os.getenv(
+    "RATE_LIMIT_ROUTES",
+    "POST /api/v1/auth_with_cookie/login=10/60,"
+    "POST /api/v1/auth_with_cookie/signup=5/60,"
+    "PATCH /api/v1/accounts/transfer_money=30/1",
+)
+# requests served at once by this worker before new ones get a 503, 0 disables the gate
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 0))
+# use the first X-Forwarded-For address as client ip, only behind a trusted proxy
+RATE_LIMIT_TRUST_FORWARDED = env_flag("RATE_LIMIT_TRUST_FORWARDED", False)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+
+def parse_route_limits(spec: str) -> dict[tuple[str, str], tuple[int, float]]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, limit = item.rsplit("=", 1)
+        method, path = route.split(" ", 1)
+        count, window = limit.split("/")
+        limits[(method.upper(), path.strip())] = (int(count), float(window))
+    return limits
+
+
+class MemoryRateLimitBackend:
+    """Token buckets and sliding window counters kept in this worker's memory.
+
+    Both checks are O(1) per request. The least recently used keys are evicted once
+    there are more than ``max_keys`` of them, so memory stays bounded under floods
+    of distinct clients.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> [tokens, last refill]
+        self.buckets: OrderedDict[str, list[float]] = OrderedDict()
+        # key -> [window number, count in that window, count in the previous window]
+        self.windows: OrderedDict[str, list[float]] = OrderedDict()
+
+    def _touch(self, store: OrderedDict, key: str) -> None:
+        store.move_to_end(key)
+        if len(store) > self.max_keys:
+            store.popitem(last=False)
+
+    # take one token, returns 0 when allowed or the seconds until a token is available
+    def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        self._touch(self.buckets, key)
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+
+    # Sliding window counter: the previous fixed window's count is weighted by how much
+    # of it still overlaps the sliding window. Returns 0 when allowed, else retry after.
+    def hit(self, key: str, limit: int, window: float) -> float:
+        now = time.time()
+        current = int(now // window)
+        counter = self.windows.get(key)
+        if counter is None or counter[0] < current - 1:
+            counter = self.windows[key] = [current, 0, 0]
+        elif counter[0] == current - 1:
+            counter[:] = [current, 0, counter[1]]
+        self._touch(self.windows, key)
+        elapsed = now / window - current
+        if counter[2] * (1 - elapsed) + counter[1] >= limit:
+            return (1 - elapsed) * window
+        counter[1] += 1
+        return 0.0
+
+
+class AdmissionState:
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    def try_enter(self) -> bool:
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return False
+        self.in_flight += 1
+        return True
+
+    def leave(self) -> None:
+        self.in_flight -= 1
+
+
+def client_ip(scope: dict) -> Optional[str]:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else None
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+from src.app.models.models import DBTokenRevocations
+
+# how often each worker reloads the revocations written by the other workers, a
+# token revoked on another worker keeps working for up to this long
+TOKEN_REVOCATION_REFRESH = float(os.getenv("TOKEN_REVOCATION_REFRESH", 5))
+# lifetime of access tokens, revocations older than this only cover expired tokens
+TOKEN_LIFETIME = timedelta(hours=48)
+# token version of deleted users, none of their tokens pass
+REVOKED = 2**31 - 1
+# overlap between refreshes, so rows committed late with an earlier revoked_at
+# are still picked up
+REFRESH_OVERLAP = timedelta(seconds=60)
+PRUNE_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRevocations:
+    """In-memory copy of the token_revocations table.
+
+    Tokens carry the user's token version in the "ver" claim. A password change
+    bumps the version and a deletion sets it to ``REVOKED``, both write a row that
+    every worker loads on its next refresh, so tokens are checked without a query.
+    """
+
+    def __init__(self):
+        # user id -> (lowest accepted version, when the entry can be dropped)
+        self.min_versions: dict[int, tuple[int, datetime]] = {}
+        self.loaded_at: Optional[datetime] = None
+        self.pruned_at = 0.0
+        self.sessionmaker: Optional[async_sessionmaker] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_revoked(self, user_id: int, version: int) -> bool:
+        entry = self.min_versions.get(user_id)
+        return entry is not None and version < entry[0]
+
+    def note(self, user_id: int, version: int, revoked_at: datetime) -> None:
+        entry = self.min_versions.get(user_id)
+        if entry is None or version > entry[0]:
+            self.min_versions[user_id] = (version, revoked_at + TOKEN_LIFETIME)
+
+    # Add the row to the session, it is written by the caller's commit. The local
+    # table is updated once that commit succeeded, the other workers see it on their
+    # next refresh.
+    def revoke(self, db: AsyncSession, user_id: int, version: int) -> None:
+        revoked_at = datetime.utcnow()
+        db.add(
+            DBTokenRevocations(
+                user_id=user_id, token_version=version, revoked_at=revoked_at
+            )
+        )
+        revocations = db.sync_session.info.setdefault("revocations", [])
+        revocations.append((user_id, version, revoked_at))
+
+    async def refresh(self, db: AsyncSession) -> None:
+        now = datetime.utcnow()
+        since = now - TOKEN_LIFETIME
+        if self.loaded_at is not None:
+            since = max(since, self.loaded_at - REFRESH_OVERLAP)
+        result = await db.execute(
+            select(
+                DBTokenRevocations.user_id,
+                DBTokenRevocations.token_version,
+                DBTokenRevocations.revoked_at,
+            ).where(DBTokenRevocations.revoked_at > since)
+        )
+        for user_id, version, revoked_at in result:
+            self.note(user_id, version, revoked_at)
+        self.loaded_at = now
+        self.min_versions = {
+            user_id: entry
+            for user_id, entry in self.min_versions.items()
+            if entry[1] > now
+        }
+        if time.monotonic() - self.pruned_at > PRUNE_INTERVAL:
+            await db.execute(
+                delete(DBTokenRevocations).where(
+                    DBTokenRevocations.revoked_at < now - TOKEN_LIFETIME
+                )
+            )
+            await db.commit()
+            self.pruned_at = time.monotonic()
+
+    async def _refresh_forever(self) -> None:
+        while True:
+            await asyncio.sleep(TOKEN_REVOCATION_REFRESH)
+            try:
+                async with self.sessionmaker() as db:
+                    await self.refresh(db)
+            except Exception:
+                # a cancel landing while the session closes comes out as a
+                # database error, it still means stop
+                if asyncio.current_task().cancelling():
+                    raise
+                logger.exception("Failed to refresh token revocations")
+
+    # load the table and keep refreshing it, called by the app lifespan
+    async def start(self, sessionmaker: async_sessionmaker) -> None:
+        self.sessionmaker = sessionmaker
+        async with sessionmaker() as db:
+            await self.refresh(db)
+        self._task = asyncio.create_task(self._refresh_forever())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+token_revocations = TokenRevocations()
+
+
+# apply the revocations staged by revoke once their transaction committed
+@event.listens_for(Session, "after_commit")
+def _note_revocations(session):
+    for user_id, version, revoked_at in session.info.pop("revocations", ()):
+        token_revocations.note(user_id, version, revoked_at)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_revocations(session):
+    session.info.pop("revocations", None)
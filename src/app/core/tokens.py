@@ -0,0 +1,95 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Optional
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+from src.app.core.cache import TTLCache
+
+# recently verified tokens kept by the verifier, each entry expires with its token
+TOKEN_MEMO_SIZE = int(os.getenv("TOKEN_MEMO_SIZE", 10000))
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class TokenVerifier:
+    """Verifies the HS256 tokens issued by create_access_token.
+
+    A drop-in for ``jwt.decode(token, secret, algorithms=["HS256"])`` on the hot
+    path. The HMAC is keyed once and copied per token instead of being rebuilt from
+    the secret, and tokens seen before are answered from a memo keyed by their
+    signature, which only holds a payload until its ``exp``. Raises the same
+    ``JWTError`` subclasses as python-jose.
+    """
+
+    def __init__(self, secret: Optional[str], memo_size: int = TOKEN_MEMO_SIZE):
+        self._mac = None
+        if secret is not None:
+            self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+        # signature -> (signing input, payload)
+        self.memo = TTLCache(maxsize=memo_size)
+        # the few distinct headers in use, already checked to be HS256
+        self._headers: set[str] = set()
+
+    def decode(self, token: str) -> dict:
+        try:
+            signing_input, signature = token.rsplit(".", 1)
+            header, claims = signing_input.split(".")
+        except ValueError:
+            raise JWTError("Not enough segments")
+
+        entry = self.memo.get(signature)
+        if entry is not None and entry[0] == signing_input:
+            payload = entry[1]
+            # the memo ttl is monotonic, exp is checked again against the clock
+            if payload["exp"] < time.time():
+                raise ExpiredSignatureError("Signature has expired.")
+            return payload
+
+        if self._mac is None:
+            raise JWTError("JWT_SECRET is not set")
+        if header not in self._headers:
+            self._check_header(header)
+        mac = self._mac.copy()
+        mac.update(signing_input.encode())
+        if not hmac.compare_digest(_b64encode(mac.digest()), signature.encode()):
+            raise JWTError("Signature verification failed.")
+
+        try:
+            payload = json.loads(_b64decode(claims))
+        except ValueError:
+            raise JWTError("Invalid payload string")
+        if not isinstance(payload, dict):
+            raise JWTError("Invalid payload string: must be a json object")
+        now = time.time()
+        if "nbf" in payload:
+            if not isinstance(payload["nbf"], (int, float)):
+                raise JWTClaimsError("Not Before claim (nbf) must be an integer.")
+            if payload["nbf"] > now:
+                raise JWTClaimsError("The token is not yet valid (nbf)")
+        if "exp" in payload:
+            if not isinstance(payload["exp"], (int, float)):
+                raise JWTClaimsError("Expiration Time claim (exp) must be an integer.")
+            if payload["exp"] < now:
+                raise ExpiredSignatureError("Signature has expired.")
+            # only tokens that expire are remembered
+            self.memo.set(signature, (signing_input, payload), ttl=payload["exp"] - now)
+        return payload
+
+    def _check_header(self, header: str) -> None:
+        try:
+            parsed = json.loads(_b64decode(header))
+        except ValueError:
+            raise JWTError("Error decoding token headers.")
+        if not isinstance(parsed, dict) or parsed.get("alg") != "HS256":
+            raise JWTError("The specified alg value is not allowed")
+        if len(self._headers) < 16:
+            self._headers.add(header)
@@ -1,10 +1,28 @@
+import asyncio
+import base64
+import binascii
+import logging
+import os
+from datetime import datetime
 from random import randint
-from typing import Optional
+from typing import AsyncIterator, Optional
 from fastapi import HTTPException, status
-from sqlalchemy.orm.session import Session
-from src.app.schemas.accounts_schema import TransferRequest
-from src.app.models.models import DBAccounts, DBUsers
+from sqlalchemy import Row, case, insert, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from src.app.schemas.accounts_schema import (
+    TransferBatchItemResult,
+    TransferBatchRequest,
+    TransferBatchResponse,
+    TransferRequest,
+    TransferResult,
+)
+from src.app.core.audit import audit
+from src.app.core.balance_cache import balance_cache
+from src.app.db.database import AsyncSessionLocal, env_flag, replica_router
+from src.app.models.models import DBAccounts, DBTransactions, DBUsers
 
+logger = logging.getLogger(__name__)
 
 account_not_found = HTTPException(
     status.HTTP_400_BAD_REQUEST, detail="Account not found"
@@ -12,6 +30,13 @@ account_not_found = HTTPException(
 infufficient_funds = HTTPException(
     status.HTTP_400_BAD_REQUEST, detail="Insufficient funds"
 )
+same_account_transfer = HTTPException(
+    status.HTTP_400_BAD_REQUEST, detail="Cannot transfer money to the same account"
+)
+invalid_cursor = HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+invalid_amount = HTTPException(
+    status.HTTP_400_BAD_REQUEST, detail="Amount must be greater than 0"
+)
 
 
 class TransferError(Exception):
@@ -22,31 +47,70 @@ class TransferError(Exception):
         super().__init__(self.message)
 
 
+# Opt-in write coalescing for hot deposit accounts, see DepositCoalescer
+DEPOSIT_COALESCING = env_flag("DEPOSIT_COALESCING", False)
+DEPOSIT_COALESCE_WINDOW_MS = float(os.getenv("DEPOSIT_COALESCE_WINDOW_MS", 2))
+DEPOSIT_COALESCE_MAX_BATCH = int(os.getenv("DEPOSIT_COALESCE_MAX_BATCH", 100))
+
+
 # find account by user_id or account id
 async def get_account(
-    db: Session, user_id: Optional[int] = None, account_id: Optional[int] = None
+    db: AsyncSession, user_id: Optional[int] = None, account_id: Optional[int] = None
 ) -> DBAccounts:
     if user_id is None and account_id is None:
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST, detail="User ID or account ID is required"
         )
 
+    # the user is loaded with the account since AccountsResponse needs it and
+    # lazy loading is not available on an AsyncSession
+    query = select(DBAccounts).options(joinedload(DBAccounts.user))
     if user_id is not None:
-        account = (
-            db.query(DBAccounts).filter(DBAccounts.user_id == user_id).one_or_none()
-        )
-        return account
+        result = await db.execute(query.where(DBAccounts.user_id == user_id))
+        return result.scalars().one_or_none()
     elif account_id is not None:
-        account = db.query(DBAccounts).filter(DBAccounts.id == account_id).one_or_none()
-        return account
+        result = await db.execute(query.where(DBAccounts.id == account_id))
+        return result.scalars().one_or_none()
     else:
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST, detail="User ID or account ID is required"
         )
 
 
+# Account id and balance of the user's account, served from the balance cache when
+# possible so that polling the balance does not touch the database
+async def get_cached_balance(db: AsyncSession, user_id: int) -> Optional[dict]:
+    balance = await balance_cache.get(user_id)
+    if balance is None:
+        # taken before the SELECT, so a write committed meanwhile keeps it out
+        generation = await balance_cache.generation(user_id)
+        result = await db.execute(
+            select(DBAccounts.id, DBAccounts.account_balance).where(
+                DBAccounts.user_id == user_id
+            )
+        )
+        row = result.one_or_none()
+        if row is None:
+            return None
+        balance = row._asdict()
+        await balance_cache.set(user_id, balance, generation)
+    return balance
+
+
+# Called after every committed balance change. The users also read from the primary
+# for the replica staleness window, so the next read does not cache a stale balance.
+# The change is committed already, so a failing cache must not fail the request.
+async def invalidate_balances(*user_ids: int) -> None:
+    try:
+        await balance_cache.invalidate(*user_ids)
+    except Exception:
+        logger.exception("Could not invalidate the balances of users %s", user_ids)
+    for user_id in user_ids:
+        replica_router.note_write(user_id)
+
+
 # create account for user if user_id is already in the database throw an error
-async def create_account(db: Session, user_id: int) -> DBAccounts:
+async def create_account(db: AsyncSession, user_id: int) -> DBAccounts:
     account = await get_account(db, user_id=user_id)
     if account is not None:
         raise HTTPException(
@@ -57,77 +121,511 @@ async def create_account(db: Session, user_id: int) -> DBAccounts:
     account = DBAccounts(user_id=user_id, account_balance=randint(100, 1000))
     # account = DBAccounts(user_id=user_id)
     db.add(account)
-    db.commit()
-    return account
+    await db.flush()
+    await record_transactions(
+        db,
+        [
+            {
+                "account_id": account.id,
+                "kind": "opening",
+                "amount": account.account_balance,
+                "balance_after": account.account_balance,
+            }
+        ],
+    )
+    await db.commit()
+    await invalidate_balances(user_id)
+    return await get_account(db, user_id=user_id)
+
+
+# append entries to the transactions ledger, part of the caller's db transaction
+async def record_transactions(db: AsyncSession, entries: list[dict]) -> None:
+    now = datetime.utcnow()
+    for entry in entries:
+        entry.setdefault("counterparty_account_id", None)
+        entry.setdefault("created_at", now)
+    await db.execute(insert(DBTransactions), entries)
 
 
 # transfer money from one account to another
-# Note: This function should be a transaction and should properly deduct the amount from the from_account and add it to the to_account
-# This function should also check for sufficient funds in the from_account
+# Both rows are locked in ascending id order so that two opposite transfers can not
+# deadlock, then the debit is a conditional UPDATE that only succeeds when the balance
+# covers the amount, so concurrent transfers can never overdraw or lose an update.
 async def transfer_money(
-    db: Session, user: DBUsers, transfer: TransferRequest
-) -> DBAccounts:
-    from_account = await get_account(db, user_id=user.id)
-    to_account = await get_account(db, account_id=transfer.to_account_id)
+    db: AsyncSession, user: DBUsers, transfer: TransferRequest
+) -> TransferResult:
+    try:
+        rows = await db.execute(
+            select(DBAccounts.id, DBAccounts.user_id)
+            .where(
+                or_(
+                    DBAccounts.user_id == user.id,
+                    DBAccounts.id == transfer.to_account_id,
+                )
+            )
+            .order_by(DBAccounts.id)
+            .with_for_update()
+        )
+        owners = {account_id: user_id for account_id, user_id in rows.all()}
+        from_account_id = next(
+            (
+                account_id
+                for account_id, user_id in owners.items()
+                if user_id == user.id
+            ),
+            None,
+        )
+        if from_account_id is None or transfer.to_account_id not in owners:
+            raise account_not_found
+        if from_account_id == transfer.to_account_id:
+            raise same_account_transfer
+
+        debited = await _apply_balance_change(
+            db, DBAccounts.id == from_account_id, -transfer.amount
+        )
+        if debited is None:
+            raise infufficient_funds
+        from_balance = debited.account_balance
+        to_balance = (
+            await _apply_balance_change(
+                db, DBAccounts.id == transfer.to_account_id, transfer.amount
+            )
+        ).account_balance
+        await record_transactions(
+            db,
+            _transfer_entries(
+                from_account_id,
+                transfer.to_account_id,
+                transfer.amount,
+                from_balance,
+                to_balance,
+            ),
+        )
+        audit(
+            db,
+            "transfer",
+            user.id,
+            from_account_id=from_account_id,
+            to_account_id=transfer.to_account_id,
+            amount=transfer.amount,
+        )
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise TransferError(str(e))
+    await invalidate_balances(*owners.values())
 
-    if from_account is None or to_account is None:
-        raise account_not_found
+    return TransferResult(
+        from_account_id=from_account_id,
+        to_account_id=transfer.to_account_id,
+        amount=transfer.amount,
+        from_balance=from_balance,
+        to_balance=to_balance,
+    )
 
-    if from_account.account_balance < transfer.amount:
-        raise infufficient_funds
 
+# transfer money to many accounts at once, e.g. for payouts
+# All involved accounts are loaded and locked with one query, the transfers are applied
+# in memory in order and the net change per account is written with one conditional
+# UPDATE, so the whole batch costs a handful of round trips and a single commit. The
+# UPDATE is rejected when the balances read no longer cover it, e.g. on SQLite where
+# the rows are not locked, and the batch is rolled back as a whole.
+async def transfer_batch(
+    db: AsyncSession, user: DBUsers, batch: TransferBatchRequest
+) -> TransferBatchResponse:
+    all_or_nothing = batch.mode == "all_or_nothing"
+    to_account_ids = {transfer.to_account_id for transfer in batch.transfers}
     try:
-        # Lock the source account to prevent concurrent transfers
-        db.query(DBAccounts).filter(
-            DBAccounts.id == from_account.id
-        ).with_for_update().one()
-
-        from_account.account_balance -= transfer.amount
-        to_account.account_balance += transfer.amount
-        db.add(from_account)
-        db.add(to_account)
-        db.commit()
+        rows = await db.execute(
+            select(DBAccounts.id, DBAccounts.user_id, DBAccounts.account_balance)
+            .where(
+                or_(DBAccounts.user_id == user.id, DBAccounts.id.in_(to_account_ids))
+            )
+            .order_by(DBAccounts.id)
+            .with_for_update()
+        )
+        balances = {}
+        owners = {}
+        from_account_id = None
+        for account_id, user_id, balance in rows.all():
+            balances[account_id] = balance
+            owners[account_id] = user_id
+            if user_id == user.id:
+                from_account_id = account_id
+
+        results = []
+        entries = []
+        deltas = {}
+        aborted = False
+        for index, transfer in enumerate(batch.transfers):
+            item = TransferBatchItemResult(
+                index=index,
+                to_account_id=transfer.to_account_id,
+                amount=transfer.amount,
+                success=False,
+            )
+            results.append(item)
+            if aborted:
+                item.detail = "Not applied, an earlier transfer in the batch failed"
+                continue
+            if from_account_id is None or transfer.to_account_id not in balances:
+                item.detail = account_not_found.detail
+            elif transfer.to_account_id == from_account_id:
+                item.detail = same_account_transfer.detail
+            elif balances[from_account_id] < transfer.amount:
+                item.detail = infufficient_funds.detail
+            else:
+                item.success = True
+                balances[from_account_id] -= transfer.amount
+                balances[transfer.to_account_id] += transfer.amount
+                entries.extend(
+                    _transfer_entries(
+                        from_account_id,
+                        transfer.to_account_id,
+                        transfer.amount,
+                        balances[from_account_id],
+                        balances[transfer.to_account_id],
+                    )
+                )
+                deltas[from_account_id] = (
+                    deltas.get(from_account_id, 0) - transfer.amount
+                )
+                deltas[transfer.to_account_id] = (
+                    deltas.get(transfer.to_account_id, 0) + transfer.amount
+                )
+            if not item.success and all_or_nothing:
+                aborted = True
+
+        committed = not aborted and bool(deltas)
+        overdrawn = False
+        if committed:
+            new_balances = await _apply_balance_changes(db, deltas)
+            overdrawn = len(new_balances) != len(deltas)
+            committed = not overdrawn
+        if committed:
+            # the ledger gets the balances written, which differ from the ones read
+            # when a deposit came in between
+            drift = {
+                account_id: new_balances[account_id] - balances[account_id]
+                for account_id in deltas
+            }
+            for entry in entries:
+                entry["balance_after"] += drift[entry["account_id"]]
+            await record_transactions(db, entries)
+            audit(
+                db,
+                "transfer_batch",
+                user.id,
+                from_account_id=from_account_id,
+                transfers=[
+                    {"to_account_id": item.to_account_id, "amount": item.amount}
+                    for item in results
+                    if item.success
+                ],
+            )
+            await db.commit()
+        else:
+            await db.rollback()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise TransferError(str(e))
+    if committed:
+        await invalidate_balances(*(owners[account_id] for account_id in deltas))
 
-    return from_account
+    if aborted or overdrawn:
+        for item in results:
+            if item.success:
+                item.success = False
+                item.detail = (
+                    "Rolled back, another transfer in the batch failed"
+                    if aborted
+                    else infufficient_funds.detail
+                )
+    succeeded = sum(item.success for item in results)
+    return TransferBatchResponse(
+        mode=batch.mode,
+        committed=committed,
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=results,
+    )
 
 
-# withdraw money from the user account
-async def withdraw_money(db: Session, user_id: int, amount: int) -> DBAccounts:
-    account = await get_account(db, user_id=user_id)
-    if account is None:
-        raise account_not_found
+def _transfer_entries(
+    from_account_id: int,
+    to_account_id: int,
+    amount: int,
+    from_balance: int,
+    to_balance: int,
+) -> list[dict]:
+    return [
+        {
+            "account_id": from_account_id,
+            "counterparty_account_id": to_account_id,
+            "kind": "transfer_out",
+            "amount": -amount,
+            "balance_after": from_balance,
+        },
+        {
+            "account_id": to_account_id,
+            "counterparty_account_id": from_account_id,
+            "kind": "transfer_in",
+            "amount": amount,
+            "balance_after": to_balance,
+        },
+    ]
+
+
+# add delta to the balance of the matching account in a single statement, a debit only
+# applies when the balance covers it. Returns the (id, new balance) row or None if
+# nothing matched
+async def _apply_balance_change(db: AsyncSession, where, delta: int) -> Optional[Row]:
+    query = (
+        update(DBAccounts)
+        .where(where)
+        .values(account_balance=DBAccounts.account_balance + delta)
+        .returning(DBAccounts.id, DBAccounts.account_balance)
+        .execution_options(synchronize_session=False)
+    )
+    if delta < 0:
+        query = query.where(DBAccounts.account_balance >= -delta)
+    result = await db.execute(query)
+    return result.one_or_none()
+
+
+# add the deltas to the balances of their accounts in a single statement, a debit only
+# applies when the balance covers it. Returns {account id: new balance} of the accounts
+# it applied to, the caller rolls back when one is missing
+async def _apply_balance_changes(db: AsyncSession, deltas: dict[int, int]) -> dict:
+    delta = case(deltas, value=DBAccounts.id)
+    result = await db.execute(
+        update(DBAccounts)
+        .where(
+            DBAccounts.id.in_(deltas),
+            or_(delta >= 0, DBAccounts.account_balance + delta >= 0),
+        )
+        .values(account_balance=DBAccounts.account_balance + delta)
+        .returning(DBAccounts.id, DBAccounts.account_balance)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
 
-    if account.account_balance < amount:
-        raise infufficient_funds
 
+# withdraw money from the user account, returns the new balance
+async def withdraw_money(db: AsyncSession, user_id: int, amount: int) -> int:
+    if amount <= 0:
+        raise invalid_amount
     try:
-        # Lock the source account to prevent concurrent transfers
-        db.query(DBAccounts).filter(DBAccounts.id == account.id).with_for_update().one()
+        account = await _apply_balance_change(
+            db, DBAccounts.user_id == user_id, -amount
+        )
+        if account is None:
+            exists = await get_account(db, user_id=user_id)
+            raise account_not_found if exists is None else infufficient_funds
+        await record_transactions(
+            db,
+            [
+                {
+                    "account_id": account.id,
+                    "kind": "withdrawal",
+                    "amount": -amount,
+                    "balance_after": account.account_balance,
+                }
+            ],
+        )
+        audit(db, "withdrawal", user_id, account_id=account.id, amount=amount)
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise TransferError(str(e))
+    await invalidate_balances(user_id)
+    return account.account_balance
 
-        account.account_balance -= amount
-        db.add(account)
-        db.commit()
+
+# deposit money to the user account, returns the new balance
+async def deposit_money(db: AsyncSession, user_id: int, amount: int) -> int:
+    if amount <= 0:
+        raise invalid_amount
+    if DEPOSIT_COALESCING:
+        balance = await deposit_coalescer.deposit(user_id, amount)
+        # the batch was applied in the task of its first deposit, whose request
+        # got the last_write cookie, this one needs it too
+        replica_router.note_write(user_id)
+        return balance
+    try:
+        account = await _apply_balance_change(db, DBAccounts.user_id == user_id, amount)
+        if account is None:
+            raise account_not_found
+        await record_transactions(
+            db,
+            [
+                {
+                    "account_id": account.id,
+                    "kind": "deposit",
+                    "amount": amount,
+                    "balance_after": account.account_balance,
+                }
+            ],
+        )
+        audit(db, "deposit", user_id, account_id=account.id, amount=amount)
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise TransferError(str(e))
+    await invalidate_balances(user_id)
+    return account.account_balance
 
 
-# deposit money to the user account
-async def deposit_money(db: Session, user_id: int, amount: int) -> DBAccounts:
-    account = await get_account(db, user_id=user_id)
-    if account is None:
-        raise account_not_found
+class DepositCoalescer:
+    """Groups concurrent deposits to the same account into one UPDATE and one commit.
+
+    Deposits wait at most ``window`` seconds (or until ``max_batch`` are queued) for
+    others to the same account, then the batch is applied as a single
+    ``balance = balance + sum`` with one ledger row per deposit. Every caller still
+    gets the balance right after its own deposit, or the batch's error.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: dict[int, list[tuple[int, asyncio.Future]]] = {}
+        self.timers: dict[int, asyncio.TimerHandle] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def deposit(self, user_id: int, amount: int) -> int:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.setdefault(user_id, [])
+        batch.append((amount, future))
+        if len(batch) >= self.max_batch:
+            self._flush(user_id)
+        elif len(batch) == 1:
+            self.timers[user_id] = loop.call_later(self.window, self._flush, user_id)
+        return await future
+
+    def _flush(self, user_id: int) -> None:
+        timer = self.timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(user_id)
+        task = asyncio.create_task(self._apply(user_id, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _apply(self, user_id: int, batch: list[tuple[int, asyncio.Future]]):
+        total = sum(amount for amount, _ in batch)
+        try:
+            async with AsyncSessionLocal() as db:
+                account = await _apply_balance_change(
+                    db, DBAccounts.user_id == user_id, total
+                )
+                if account is None:
+                    raise account_not_found
+                balance = account.account_balance - total
+                entries, balances = [], []
+                for amount, _ in batch:
+                    balance += amount
+                    balances.append(balance)
+                    entries.append(
+                        {
+                            "account_id": account.id,
+                            "kind": "deposit",
+                            "amount": amount,
+                            "balance_after": balance,
+                        }
+                    )
+                    audit(db, "deposit", user_id, account_id=account.id, amount=amount)
+                await record_transactions(db, entries)
+                await db.commit()
+            await invalidate_balances(user_id)
+        except Exception as e:
+            error = e if isinstance(e, HTTPException) else TransferError(str(e))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), balance in zip(batch, balances):
+            if not future.done():
+                future.set_result(balance)
+
+
+deposit_coalescer = DepositCoalescer(
+    DEPOSIT_COALESCE_WINDOW_MS / 1000, DEPOSIT_COALESCE_MAX_BATCH
+)
 
+
+# Statements are read newest first with keyset pagination on (created_at, id), which
+# the ix_transactions_account_id_created_at index serves directly, so every page costs
+# the same no matter how deep into the history it is.
+statement_columns = (
+    DBTransactions.id,
+    DBTransactions.kind,
+    DBTransactions.amount,
+    DBTransactions.balance_after,
+    DBTransactions.counterparty_account_id,
+    DBTransactions.created_at,
+)
+
+
+def encode_statement_cursor(created_at: datetime, transaction_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{transaction_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_statement_cursor(cursor: str) -> tuple[datetime, int]:
     try:
-        # Lock the source account to prevent concurrent transfers
-        db.query(DBAccounts).filter(DBAccounts.id == account.id).with_for_update().one()
+        created_at, transaction_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        )
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise invalid_cursor
 
-        account.account_balance += amount
-        db.add(account)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise TransferError(str(e))
+
+def _statement_query(account_id: int, cursor: Optional[str] = None):
+    query = (
+        select(*statement_columns)
+        .where(DBTransactions.account_id == account_id)
+        .order_by(DBTransactions.created_at.desc(), DBTransactions.id.desc())
+    )
+    if cursor is not None:
+        query = query.where(
+            tuple_(DBTransactions.created_at, DBTransactions.id)
+            < decode_statement_cursor(cursor)
+        )
+    return query
+
+
+# one page of the account statement and the cursor of the next page
+async def get_statement_page(
+    db: AsyncSession, account_id: int, limit: int, cursor: Optional[str] = None
+) -> tuple[list[Row], Optional[str]]:
+    result = await db.execute(_statement_query(account_id, cursor).limit(limit + 1))
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_statement_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+# Stream the whole statement from a server side cursor in batches of rows. It opens its
+# own session since it keeps running after the request's session has been closed.
+async def stream_statement(
+    account_id: int, batch_size: int = 1000
+) -> AsyncIterator[list[Row]]:
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            _statement_query(account_id).execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield rows
@@ -1,8 +1,17 @@
-from typing import Optional
+import base64
+import binascii
+import os
+from typing import NamedTuple, Optional
 from fastapi import HTTPException, status
-from sqlalchemy.orm.session import Session
-from sqlalchemy import or_
-from src.app.core.hash import get_password_hash
+from sqlalchemy import inspect, literal, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from src.app.core.cache import TTLCache
+from src.app.core.audit import audit
+from src.app.core.hash import get_password_hash_async
+from src.app.core.revocations import REVOKED, token_revocations
+from src.app.db import search
+from src.app.db.database import replica_router
 from src.app.models.models import DBUsers
 from src.app.schemas.user_schema import UserBody, PatchUserBody
 
@@ -10,12 +19,64 @@ user_not_found = HTTPException(
     status_code=status.HTTP_404_NOT_FOUND,
     detail="User not found",
 )
+invalid_cursor = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="Invalid cursor",
+)
+
+# Column values of recently authenticated users keyed by username. Every write
+# path below invalidates its entry, the ttl bounds staleness across workers.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 30))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# UserRows for the read-only routes, without the password hash and token version
+user_row_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# users loaded into the cache on startup, the most recently created first
+USER_CACHE_PRELOAD = int(os.getenv("USER_CACHE_PRELOAD", 0))
+
+
+def _user_snapshot(user: DBUsers) -> dict:
+    return {attr.key: getattr(user, attr.key) for attr in inspect(DBUsers).column_attrs}
+
+
+def _forget_user(username: str) -> None:
+    user_cache.pop(username)
+    user_row_cache.pop(username)
+
+
+# The read-only queries below select just these columns into UserRow tuples. They
+# run on the session's connection, so no ORM objects are built and nothing goes
+# into the identity map, and the password hash is never fetched.
+user_columns = (
+    DBUsers.id,
+    DBUsers.username,
+    DBUsers.first_name,
+    DBUsers.last_name,
+    DBUsers.role,
+)
+
+
+class UserRow(NamedTuple):
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    role: str
+
+
+class UserCredentials(NamedTuple):
+    id: int
+    username: str
+    role: str
+    hashed_password: str
+    token_version: int
 
 
 # find user by username
-async def get_user(db: Session, username: Optional[str] = None) -> DBUsers:
+async def get_user(db: AsyncSession, username: Optional[str] = None) -> DBUsers:
     if username is not None:
-        user = db.query(DBUsers).filter(DBUsers.username == username).first()
+        result = await db.execute(select(DBUsers).where(DBUsers.username == username))
+        user = result.scalars().first()
         if user is None:
             raise user_not_found
         return user
@@ -23,66 +84,203 @@ async def get_user(db: Session, username: Optional[str] = None) -> DBUsers:
         raise user_not_found
 
 
-# create a new user
-async def create_user(db: Session, user: UserBody) -> DBUsers:
-    hashed_password = get_password_hash(user.password)
+# find user by username as a UserRow, for routes that only read the user
+async def get_user_row(db: AsyncSession, username: Optional[str] = None) -> UserRow:
+    connection = await db.connection()
+    result = await connection.execute(
+        select(*user_columns).where(DBUsers.username == username)
+    )
+    row = result.first()
+    if row is None:
+        raise user_not_found
+    return UserRow._make(row)
+
+
+# the id, role and password hash of a user, all that a login needs
+async def get_user_credentials(
+    db: AsyncSession, username: Optional[str] = None
+) -> UserCredentials:
+    connection = await db.connection()
+    result = await connection.execute(
+        select(
+            DBUsers.id,
+            DBUsers.username,
+            DBUsers.role,
+            DBUsers.hashed_password,
+            DBUsers.token_version,
+        ).where(DBUsers.username == username)
+    )
+    row = result.first()
+    if row is None:
+        raise user_not_found
+    return UserCredentials._make(row)
+
+
+async def username_exists(db: AsyncSession, username: str) -> bool:
+    connection = await db.connection()
+    result = await connection.execute(
+        select(DBUsers.id).where(DBUsers.username == username).limit(1)
+    )
+    return result.first() is not None
+
+
+# find user by username, served from the user cache when possible
+async def get_cached_user(db: AsyncSession, username: Optional[str] = None) -> DBUsers:
+    snapshot = user_cache.get(username)
+    if snapshot is None:
+        user = await get_user(db, username)
+        user_cache.set(username, _user_snapshot(user))
+        return user
+    # attach the cached row to the session without a query so it can still be
+    # updated or deleted through the usual paths
+    user = DBUsers(**snapshot)
+    make_transient_to_detached(user)
+    return await db.merge(user, load=False)
+
+
+# UserRow variant of get_cached_user for read-only routes. A user already in
+# user_cache is served from there, otherwise only user_columns are fetched
+async def get_cached_user_row(
+    db: AsyncSession, username: Optional[str] = None
+) -> UserRow:
+    row = user_row_cache.get(username)
+    if row is not None:
+        return row
+    snapshot = user_cache.get(username)
+    if snapshot is not None:
+        return UserRow(*(snapshot[column.key] for column in user_columns))
+    row = await get_user_row(db, username)
+    user_row_cache.set(username, row)
+    return row
+
+
+# fill the user cache on startup so the first requests skip the lookup
+async def preload_user_cache(db: AsyncSession, limit: int) -> int:
+    limit = min(limit, USER_CACHE_SIZE)
+    result = await db.execute(select(DBUsers).order_by(DBUsers.id.desc()).limit(limit))
+    users = result.scalars().all()
+    for user in users:
+        user_cache.set(user.username, _user_snapshot(user))
+    return len(users)
+
+
+# create a new user. The signup has no user in its log context for track_writes,
+# so the new user is noted here and reads its first pages from the primary
+async def create_user(db: AsyncSession, user: UserBody) -> DBUsers:
+    hashed_password = await get_password_hash_async(user.password)
     del user.password
     user = DBUsers(**user.model_dump(), hashed_password=hashed_password)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    # flushed first for the id of the audit event
+    await db.flush()
+    audit(db, "signup", user.id)
+    await db.commit()
+    replica_router.note_write(user.id)
+    await db.refresh(user)
     return user
 
 
-# delete a user
-async def delete_user(db: Session, user: DBUsers) -> None:
-    db.delete(user)
-    db.commit()
+# delete a user, the account is loaded first since deleting the user detaches it
+# and revoke all of the user's tokens in the same transaction
+async def delete_user(db: AsyncSession, user: DBUsers) -> None:
+    await db.refresh(user, attribute_names=["account"])
+    await db.delete(user)
+    token_revocations.revoke(db, user.id, REVOKED)
+    await db.commit()
+    _forget_user(user.username)
 
 
 # update a user
-async def update_user(db: Session, user: DBUsers):
+async def update_user(db: AsyncSession, user: DBUsers):
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    _forget_user(user.username)
 
 
-# patch a user but skip hashed_password
-async def patch_user(db: Session, user: DBUsers, user_update: PatchUserBody):
-    user_update = user_update.model_dump()
+# Set a new password and invalidate the tokens issued before it, in one transaction.
+# The version is bumped in SQL since the cached user may be stale. Returns the new
+# version for the user's new token.
+async def change_password(db: AsyncSession, user: DBUsers, hashed_password: str) -> int:
+    result = await db.execute(
+        update(DBUsers)
+        .where(DBUsers.id == user.id)
+        .values(
+            hashed_password=hashed_password, token_version=DBUsers.token_version + 1
+        )
+        .returning(DBUsers.token_version)
+        .execution_options(synchronize_session=False)
+    )
+    token_version = result.scalar_one()
+    token_revocations.revoke(db, user.id, token_version)
+    await db.commit()
+    _forget_user(user.username)
+    return token_version
+
+
+# patch a user but skip hashed_password, fields left out of the body (or sent as
+# null) keep their value
+async def patch_user(db: AsyncSession, user: DBUsers, user_update: PatchUserBody):
+    _forget_user(user.username)
+    user_update = user_update.model_dump(exclude_none=True)
     for key in user_update.keys():
         if key == "hashed_password":
             continue
         elif key == "username" and user.username != user_update[key]:
-            user_exists = await get_user(db, user_update[key])
-            if user_exists:
+            if await username_exists(db, user_update[key]):
                 raise HTTPException(
                     status_code=status.HTTP_409_CONFLICT,
                     detail="Username already exists",
                 )
         setattr(user, key, user_update[key])
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    _forget_user(user.username)
 
 
-# A route to get users from the backend, filterable via a search_filter that filters by
-# first_name, last_name even a partial match is good enough
+# Search users by first_name / last_name, even a partial match is good enough. Exact and
+# prefix matches come first, results are paginated with a (rank, id) keyset cursor.
 async def get_filtered_users(
-    db: Session,
+    db: AsyncSession,
     search_filter: Optional[str] = None,
-) -> list[DBUsers]:
+    limit: int = 50,
+    cursor: Optional[str] = None,
+) -> tuple[list[UserRow], Optional[str]]:
+    connection = await db.connection()
     if search_filter:
-        users = (
-            db.query(DBUsers)
-            .filter(
-                or_(
-                    DBUsers.first_name.ilike(f"%{search_filter}%"),
-                    DBUsers.last_name.ilike(f"%{search_filter}%"),
-                )
-            )
-            .all()
+        rank = search.search_rank(search_filter)
+        query = search.apply_search(
+            select(*user_columns, rank.label("rank")),
+            connection.dialect.name,
+            search_filter,
         )
     else:
-        users = db.query(DBUsers).all()
-    return users
+        rank = literal(0)
+        query = select(*user_columns, rank.label("rank"))
+    if cursor is not None:
+        after_rank, after_id = _decode_users_cursor(cursor)
+        if search_filter:
+            query = query.where(tuple_(rank, DBUsers.id) > (after_rank, after_id))
+        else:
+            query = query.where(DBUsers.id > after_id)
+    query = query.order_by(rank, DBUsers.id).limit(limit + 1)
+    rows = (await connection.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_users_cursor(rows[-1].rank, rows[-1].id)
+    return [UserRow._make(row[:-1]) for row in rows], next_cursor
+
+
+def _encode_users_cursor(rank: int, user_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{rank}|{user_id}".encode()).decode()
+
+
+def _decode_users_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        rank, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return int(rank), int(user_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise invalid_cursor
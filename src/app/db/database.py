@@ -1,23 +1,137 @@
 import os
 from dotenv import load_dotenv, find_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from src.app.core.metrics import count_db_query
+from src.app.db.pool import PoolStats, timed_async_pool_class
+from src.app.db import replicas
 
 
 _ = load_dotenv(find_dotenv())
 
+# async drivers used for each sync dialect in DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+SYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite",
+    "postgresql+asyncpg": "postgresql",
+}
+
+
+def to_async_url(url: str) -> URL:
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    if drivername == "postgresql+asyncpg" and "sslmode" in url.query:
+        # asyncpg does not understand libpq's sslmode, it takes ssl instead
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+    return url.set(drivername=drivername)
+
+
+def to_sync_url(url: str) -> URL:
+    url = make_url(url)
+    return url.set(drivername=SYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# seconds after which a connection is replaced, -1 keeps connections forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+# LIFO reuses the most recent connections and lets idle ones time out server side
+DB_POOL_USE_LIFO = env_flag("DB_POOL_USE_LIFO", False)
+
+# SQLite connection settings, applied on every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+pool_stats = PoolStats()
+
+
+def engine_options(url: URL) -> dict:
+    # in memory SQLite lives in a single connection, it can not have a real pool
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_use_lifo": DB_POOL_USE_LIFO,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
+
+def create_app_engine(url: str, stats: PoolStats = pool_stats):
+    async_url = to_async_url(url)
+    options = engine_options(async_url)
+    if options:
+        options["poolclass"] = timed_async_pool_class(stats)
+    async_engine = create_async_engine(async_url, **options)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_db_query)
+    if async_url.get_backend_name() == "sqlite":
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return async_engine
+
+
+# The app runs on the async engine, the sync engine is kept for alembic and scripts
+async_engine = create_app_engine(SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+# Read-only dependencies go through the replica router, see get_read_db
+replica_router = replicas.ReplicaRouter(
+    AsyncSessionLocal,
+    [
+        replicas.Replica(create_app_engine(url.strip(), PoolStats()))
+        for url in replicas.DATABASE_REPLICA_URLS.split(",")
+        if url.strip()
+    ],
+    strategy=replicas.DB_REPLICA_STRATEGY,
+    staleness=replicas.DB_REPLICA_STALENESS,
+    down_seconds=replicas.DB_REPLICA_DOWN_SECONDS,
+    secret=os.getenv("JWT_SECRET", ""),
+)
+if replica_router.replicas:
+    replicas.track_writes(replica_router)
+
+engine = create_engine(to_sync_url(SQLALCHEMY_DATABASE_URL))
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
 # Database connection
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,98 @@
+import time
+from collections import deque
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from src.app.core.metrics import metrics
+
+
+class PoolStats:
+    """Connection checkout wait times of a pool, recent ones kept for percentiles."""
+
+    def __init__(self, window: int = 1024):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.recent_waits: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        self.recent_waits.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, int(q * len(waits)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "wait_seconds_p50": self.percentile(0.50),
+            "wait_seconds_p99": self.percentile(0.99),
+        }
+
+
+# A pool class that measures how long each checkout waited for a connection. The stats
+# live on the class so they survive the pool being recreated by engine.dispose()
+def timed_pool_class(base: type[QueuePool], stats: PoolStats) -> type[QueuePool]:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        stats.record(time.perf_counter() - start)
+        return connection
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get, "stats": stats})
+
+
+def timed_async_pool_class(stats: PoolStats) -> type[QueuePool]:
+    return timed_pool_class(AsyncAdaptedQueuePool, stats)
+
+
+# checked out / overflow counters of the engine's pool plus its wait time stats
+def pool_status(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "max_overflow": pool._max_overflow,
+                "timeout": pool.timeout(),
+            }
+        )
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status["waits"] = stats.as_dict()
+    return status
+
+
+metrics.gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+metrics.gauge("db_pool_overflow", "Overflow connections currently open")
+metrics.counter("db_pool_checkouts_total", "Connection checkouts")
+metrics.counter("db_pool_timeouts_total", "Connection checkouts that timed out")
+metrics.counter("db_pool_wait_seconds_total", "Time spent waiting for a connection")
+
+
+def pool_metric_samples(engine: AsyncEngine):
+    status = pool_status(engine)
+    if "checked_out" in status:
+        yield "db_pool_checked_out", {}, status["checked_out"]
+        yield "db_pool_overflow", {}, max(0, status["overflow"])
+    if "waits" in status:
+        yield "db_pool_checkouts_total", {}, status["waits"]["checkouts"]
+        yield "db_pool_timeouts_total", {}, status["waits"]["timeouts"]
+        yield "db_pool_wait_seconds_total", {}, status["waits"]["wait_seconds_total"]
@@ -0,0 +1,99 @@
+# Recompute the materialized account balances from the transactions ledger.
+#
+#   python -m src.app.db.rebuild_balances [--chunk-size 1000] [--dry-run]
+#
+# Accounts are walked in id order in chunks, each chunk is locked and compared against
+# one grouped SUM over the ledger and committed on its own, so memory stays flat and
+# live transfers are only blocked for one chunk at a time.
+#
+# Accounts that predate the ledger have no opening entry, and may have had balance
+# changes recorded since. They get an opening entry for the part of their balance the
+# ledger does not explain (balance - ledger sum), dated before their first entry, and
+# are never overwritten with the sum of the later changes.
+import argparse
+import asyncio
+import json
+from datetime import timedelta
+from sqlalchemy import case, func, select, update
+from src.app.db.access_layers.db_accounts import record_transactions
+from src.app.db.database import AsyncSessionLocal
+from src.app.models.models import DBAccounts, DBTransactions
+
+
+async def rebuild_balances(chunk_size: int = 1000, dry_run: bool = False) -> dict:
+    stats = {"accounts": 0, "mismatched": 0, "backfilled": 0}
+    last_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = await db.execute(
+                select(DBAccounts.id, DBAccounts.account_balance)
+                .where(DBAccounts.id > last_id)
+                .order_by(DBAccounts.id)
+                .limit(chunk_size)
+                .with_for_update()
+            )
+            accounts = rows.all()
+            if not accounts:
+                break
+            last_id = accounts[-1].id
+
+            ledger = await db.execute(
+                select(
+                    DBTransactions.account_id,
+                    func.sum(DBTransactions.amount),
+                    func.min(DBTransactions.created_at),
+                    func.sum(case((DBTransactions.kind == "opening", 1), else_=0)),
+                )
+                .where(DBTransactions.account_id.in_([a.id for a in accounts]))
+                .group_by(DBTransactions.account_id)
+            )
+            ledger_rows = {row[0]: row[1:] for row in ledger.all()}
+
+            backfill = []
+            for account_id, balance in accounts:
+                stats["accounts"] += 1
+                balance = balance or 0
+                ledger_balance, first_entry_at, openings = ledger_rows.get(
+                    account_id, (0, None, 0)
+                )
+                if not openings:
+                    stats["backfilled"] += 1
+                    opening = balance - ledger_balance
+                    entry = {
+                        "account_id": account_id,
+                        "kind": "opening",
+                        "amount": opening,
+                        "balance_after": opening,
+                    }
+                    if first_entry_at is not None:
+                        entry["created_at"] = first_entry_at - timedelta(microseconds=1)
+                    backfill.append(entry)
+                elif ledger_balance != balance:
+                    stats["mismatched"] += 1
+                    if not dry_run:
+                        await db.execute(
+                            update(DBAccounts)
+                            .where(DBAccounts.id == account_id)
+                            .values(account_balance=ledger_balance)
+                            .execution_options(synchronize_session=False)
+                        )
+
+            if dry_run:
+                await db.rollback()
+            else:
+                if backfill:
+                    await record_transactions(db, backfill)
+                await db.commit()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute account balances from the transactions ledger"
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only report, do not write anything"
+    )
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(rebuild_balances(args.chunk_size, args.dry_run))))
@@ -0,0 +1,184 @@
+import hashlib
+import hmac
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import Session
+from src.app.core.cache import TTLCache
+from src.app.core.logger import log_context
+
+# comma separated urls of read replicas of DATABASE_URL, empty sends all reads to it
+DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "")
+# round_robin | least_connections
+DB_REPLICA_STRATEGY = os.getenv("DB_REPLICA_STRATEGY", "round_robin")
+# a user who wrote within this many seconds reads from the primary, this should
+# be above the replication lag of the replicas
+DB_REPLICA_STALENESS = float(os.getenv("DB_REPLICA_STALENESS", 5))
+# how long a replica that failed to connect is skipped
+DB_REPLICA_DOWN_SECONDS = float(os.getenv("DB_REPLICA_DOWN_SECONDS", 30))
+# carries the time of the user's last write to whichever worker serves the next
+# read, the staleness window of recent_writers only covers this worker
+LAST_WRITE_COOKIE = "last_write"
+
+logger = logging.getLogger(__name__)
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(
+            bind=engine, autoflush=False, expire_on_commit=False
+        )
+        self.in_use = 0
+        self.down_until = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+    def is_up(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def status(self) -> dict:
+        return {
+            "replica": self.name,
+            "up": self.is_up(time.monotonic()),
+            "in_use": self.in_use,
+        }
+
+
+class ReplicaRouter:
+    """Picks the session a read-only dependency runs on.
+
+    Reads go to the replicas unless the user wrote recently, in which case they go
+    to the primary so the user sees their own writes. Writes are remembered by this
+    worker, and by the others through a signed ``last_write`` cookie. A replica that
+    fails to connect is skipped for ``down_seconds`` and the read moves to the next
+    one, and to the primary when none is left.
+    """
+
+    def __init__(
+        self,
+        primary: async_sessionmaker,
+        replicas: list[Replica],
+        strategy: str = "round_robin",
+        staleness: float = 5,
+        down_seconds: float = 30,
+        secret: str = "",
+    ):
+        if strategy not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown replica strategy: {strategy}")
+        self.primary = primary
+        self.replicas = replicas
+        self.strategy = strategy
+        self.staleness = staleness
+        self.down_seconds = down_seconds
+        self.secret = secret.encode()
+        self.recent_writers = TTLCache(maxsize=100000, ttl=staleness)
+        self._next = itertools.count()
+
+    # The cookie goes out with the response of the request that wrote, but only for
+    # the user making it, the other side of a transfer is left to recent_writers
+    def note_write(self, user_id: int) -> None:
+        self.recent_writers.set(user_id, True)
+        context = log_context.get()
+        if not self.replicas or context is None:
+            return
+        if context.get("user_id") not in (None, user_id):
+            return
+        cookies = context.setdefault("set_cookie", {})
+        cookies[LAST_WRITE_COOKIE] = (
+            f"{LAST_WRITE_COOKIE}={self.sign_write(user_id, time.time())}; "
+            f"Max-Age={math.ceil(self.staleness)}; Path=/; HttpOnly; SameSite=Lax"
+        )
+
+    def _signature(self, message: str) -> str:
+        return hmac.new(self.secret, message.encode(), hashlib.sha256).hexdigest()
+
+    def sign_write(self, user_id: int, written_at: float) -> str:
+        message = f"{user_id}.{written_at:.3f}"
+        return f"{message}.{self._signature(message)}"
+
+    # whether a last_write cookie says the user wrote within the staleness window
+    def wrote_recently(self, user_id: int, cookie: Optional[str]) -> bool:
+        if self.recent_writers.get(user_id) is not None:
+            return True
+        if not cookie:
+            return False
+        try:
+            cookie_user_id, seconds, millis, signature = cookie.split(".")
+            written_at = float(f"{seconds}.{millis}")
+        except ValueError:
+            return False
+        message = f"{cookie_user_id}.{seconds}.{millis}"
+        if not hmac.compare_digest(signature, self._signature(message)):
+            return False
+        return (
+            cookie_user_id == str(user_id) and time.time() - written_at < self.staleness
+        )
+
+    # replicas that are up, in the order they should be tried
+    def candidates(self) -> list[Replica]:
+        now = time.monotonic()
+        replicas = [replica for replica in self.replicas if replica.is_up(now)]
+        if self.strategy == "least_connections":
+            return sorted(replicas, key=lambda replica: replica.in_use)
+        if not replicas:
+            return replicas
+        start = next(self._next) % len(replicas)
+        return replicas[start:] + replicas[:start]
+
+    def mark_down(self, replica: Replica, error: Exception) -> None:
+        replica.down_until = time.monotonic() + self.down_seconds
+        logger.warning("Replica %s is down: %s", replica.name, error)
+
+    @asynccontextmanager
+    async def session(
+        self, user_id: Optional[int] = None, last_write: Optional[str] = None
+    ):
+        if user_id is None or not self.wrote_recently(user_id, last_write):
+            for replica in self.candidates():
+                db = replica.sessionmaker()
+                try:
+                    # connect now so a dead replica fails here and not in the route
+                    await db.connection()
+                except Exception as e:
+                    await db.close()
+                    self.mark_down(replica, e)
+                    continue
+                replica.in_use += 1
+                try:
+                    yield db
+                finally:
+                    replica.in_use -= 1
+                    await db.close()
+                return
+        async with self.primary() as db:
+            yield db
+
+
+# Remember who committed a write, for the staleness window. Session level events
+# catch both flushed ORM changes and UPDATE/INSERT/DELETE statements run through
+# session.execute, the user comes from the request's log context.
+def track_writes(router: ReplicaRouter) -> None:
+    @event.listens_for(Session, "after_flush")
+    def after_flush(session, flush_context):
+        session.info["wrote"] = True
+
+    @event.listens_for(Session, "do_orm_execute")
+    def do_orm_execute(orm_execute_state):
+        if not orm_execute_state.is_select:
+            orm_execute_state.session.info["wrote"] = True
+
+    @event.listens_for(Session, "after_commit")
+    def after_commit(session):
+        if session.info.pop("wrote", False):
+            context = log_context.get()
+            if context is not None and context.get("user_id") is not None:
+                router.note_write(context["user_id"])
@@ -0,0 +1,113 @@
+# User search by first_name / last_name.
+#
+# A plain ILIKE '%term%' can not use a btree index, so each dialect gets its own index:
+# Postgres uses pg_trgm GIN indexes, which serve ILIKE '%term%' directly, and SQLite
+# uses an external content FTS5 table with the trigram tokenizer, kept in sync with
+# the users table by triggers. Both need terms of at least 3 characters, shorter terms
+# fall back to a prefix match.
+#
+# Migrated databases get the indexes from the ac5b5df41a30 alembic revision, the
+# statements below are used by create_schema for databases created from the models.
+from sqlalchemy import Connection, case, column, func, or_, table, text
+from src.app.models.models import DBUsers
+
+MIN_TRIGRAM_TERM_LENGTH = 3
+
+users_fts = table("users_fts", column("rowid"))
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_first_name_trgm "
+    "ON users USING gin (first_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_last_name_trgm "
+    "ON users USING gin (last_name gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE users_fts USING fts5("
+    "first_name, last_name, content='users', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER users_fts_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_fts(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); END",
+    "CREATE TRIGGER users_fts_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); END",
+    "CREATE TRIGGER users_fts_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); "
+    "INSERT INTO users_fts(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); END",
+    # index the rows that existed before the fts table
+    "INSERT INTO users_fts(users_fts) VALUES ('rebuild')",
+]
+
+
+# create the search indexes if they are missing, safe to run on every startup
+def install_search_indexes(connection: Connection) -> None:
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        for statement in POSTGRES_DDL:
+            connection.execute(text(statement))
+    elif dialect == "sqlite":
+        exists = connection.execute(
+            text(
+                "SELECT 1 FROM sqlite_master"
+                " WHERE type = 'table' AND name = 'users_fts'"
+            )
+        ).first()
+        if exists is None:
+            for statement in SQLITE_DDL:
+                connection.execute(text(statement))
+
+
+# alembic include_object hook, the search tables are not in the models so autogenerate
+# must not drop them
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    return not (type_ == "table" and name.startswith(users_fts.name))
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# Rank exact matches first, then prefix matches, then any other substring match
+def search_rank(term: str):
+    term = term.lower()
+    prefix = _escape_like(term) + "%"
+    first_name = func.lower(DBUsers.first_name)
+    last_name = func.lower(DBUsers.last_name)
+    return case(
+        (or_(first_name == term, last_name == term), 0),
+        (
+            or_(
+                first_name.like(prefix, escape="\\"),
+                last_name.like(prefix, escape="\\"),
+            ),
+            1,
+        ),
+        else_=2,
+    )
+
+
+# restrict a users query to the rows matching term, using the dialect's index
+def apply_search(query, dialect: str, term: str):
+    if len(term) < MIN_TRIGRAM_TERM_LENGTH:
+        prefix = _escape_like(term) + "%"
+        return query.where(
+            or_(
+                DBUsers.first_name.ilike(prefix, escape="\\"),
+                DBUsers.last_name.ilike(prefix, escape="\\"),
+            )
+        )
+    if dialect == "sqlite":
+        phrase = '"' + term.replace('"', '""') + '"'
+        return query.join(users_fts, users_fts.c.rowid == DBUsers.id).where(
+            text("users_fts MATCH :phrase").bindparams(phrase=phrase)
+        )
+    pattern = "%" + _escape_like(term) + "%"
+    return query.where(
+        or_(
+            DBUsers.first_name.ilike(pattern, escape="\\"),
+            DBUsers.last_name.ilike(pattern, escape="\\"),
+        )
+    )
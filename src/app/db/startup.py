@@ -0,0 +1,70 @@
+import asyncio
+import os
+from sqlalchemy import Connection, inspect, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from src.app.db.database import DB_POOL_SIZE, env_flag
+from src.app.db.search import install_search_indexes
+from src.app.models import models
+
+# Create the tables and search indexes on startup. Meant for local SQLite and tests,
+# real databases are migrated with alembic so workers never run DDL on boot.
+DB_CREATE_ALL = env_flag("DB_CREATE_ALL", False)
+# fail startup when the database is not at the alembic head revision
+DB_VERIFY_SCHEMA = env_flag("DB_VERIFY_SCHEMA", False)
+# connections opened before the first request is accepted
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", min(DB_POOL_SIZE, 4)))
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "migrations"
+)
+
+
+class SchemaRevisionMismatch(RuntimeError):
+    pass
+
+
+# A new database is stamped with the head revision, so alembic can upgrade it later.
+# Tables missing from an existing database are created but it is not stamped, run
+# alembic upgrade head on those instead.
+def create_schema(connection: Connection) -> None:
+    new_database = not inspect(connection).get_table_names()
+    models.Base.metadata.create_all(bind=connection)
+    install_search_indexes(connection)
+    if new_database:
+        from alembic.runtime.migration import MigrationContext
+
+        MigrationContext.configure(connection).stamp(migrations(), "head")
+
+
+# alembic is only imported when it is needed, it is slow to import
+def migrations():
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    return ScriptDirectory.from_config(config)
+
+
+# compare the revision stamped in the database with the heads of src/migrations
+def verify_schema_revision(connection: Connection) -> None:
+    from alembic.runtime.migration import MigrationContext
+
+    heads = set(migrations().get_heads())
+    if not heads:
+        raise SchemaRevisionMismatch(f"No migrations found in {MIGRATIONS_DIR}")
+    current = set(MigrationContext.configure(connection).get_current_heads())
+    if current != heads:
+        raise SchemaRevisionMismatch(
+            f"Database is at revision {sorted(current) or 'none'}, "
+            f"migrations are at {sorted(heads) or 'none'}, run alembic upgrade head"
+        )
+
+
+# open the first connections now instead of on the first requests
+async def warm_pool(engine: AsyncEngine, size: int) -> None:
+    async def connect():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(connect() for _ in range(max(size, 1))))
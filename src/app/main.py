@@ -1,27 +1,107 @@
+import time
+
+# worker start, before the imports below, for app_startup_seconds{phase="total"}
+STARTED = time.perf_counter()
+
+import logging
+from contextlib import asynccontextmanager, contextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
-from src.app.middleware import time_middleware, cors_middleware
-from src.app.models import models
-from src.app.db.database import engine
-from src.app.api import router as api_router
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, RedirectResponse
+from src.app.core.balance_cache import balance_cache
+from src.app.core.hash import hashing_service
+from src.app.core.http_client import http_client
+from src.app.core.jobs import job_queue
+from src.app.core.logger import setup_logging
+from src.app.core.metrics import metrics
+from src.app.core.revocations import token_revocations
+from src.app.middleware import cors_middleware
+from src.app.middleware.metrics_middleware import MetricsMiddleware
+from src.app.middleware.rate_limit_middleware import RateLimitMiddleware
+from src.app.middleware.request_context_middleware import RequestContextMiddleware
+from src.app.db.database import AsyncSessionLocal, async_engine, env_flag
+from src.app.db.pool import pool_metric_samples
+from src.app.db import startup
 
 
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# import and mount the routers in the lifespan instead of at import time
+LAZY_ROUTERS = env_flag("LAZY_ROUTERS", False)
+
+metrics.gauge("app_startup_seconds", "Time spent in each startup phase", mode="max")
+
+
+@contextmanager
+def startup_phase(name: str):
+    start = time.perf_counter()
+    yield
+    metrics.set("app_startup_seconds", (("phase", name),), time.perf_counter() - start)
+
 
-app = FastAPI()
+def include_routers(app: FastAPI):
+    if getattr(app.state, "routers_included", False):
+        return
+    from src.app.api import router as api_router
+    from src.app.api.internal import router as internal_router
 
-# Connect to the database
-models.Base.metadata.create_all(bind=engine)
+    app.include_router(api_router)
+    app.include_router(internal_router)
+    app.state.routers_included = True
 
-# Middleware
-app.add_middleware(cors_middleware.get_cors_config())
-# this has different syntax
-app.middleware("http")(time_middleware.middleware)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup_phase("routers"):
+        include_routers(app)
+    if startup.DB_CREATE_ALL:
+        with startup_phase("create_all"):
+            async with async_engine.begin() as connection:
+                await connection.run_sync(startup.create_schema)
+    if startup.DB_VERIFY_SCHEMA:
+        with startup_phase("verify_schema"):
+            async with async_engine.connect() as connection:
+                await connection.run_sync(startup.verify_schema_revision)
+    with startup_phase("pool"):
+        await startup.warm_pool(async_engine, startup.DB_POOL_WARM)
+    with startup_phase("caches"):
+        from src.app.db.access_layers import db_users
+
+        if db_users.USER_CACHE_PRELOAD:
+            async with AsyncSessionLocal() as db:
+                await db_users.preload_user_cache(db, db_users.USER_CACHE_PRELOAD)
+        hashing_service.warm_up()
+        await http_client.start()
+        await token_revocations.start(AsyncSessionLocal)
+        await job_queue.start(AsyncSessionLocal)
+    ready = time.perf_counter() - STARTED
+    metrics.set("app_startup_seconds", (("phase", "total"),), ready)
+    logger.info("Worker ready in %.3fs", ready)
+    yield
+    await job_queue.close()
+    await token_revocations.close()
+    await http_client.close()
+    await balance_cache.close()
+    hashing_service.shutdown()
+    metrics.remove_snapshot()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Middleware, the last one added is the outermost
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(CORSMiddleware, **cors_middleware.get_cors_config())
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(MetricsMiddleware)
+metrics.register_collector(lambda: pool_metric_samples(async_engine))
 
 
 # Routes
-app.include_router(api_router)
+if not LAZY_ROUTERS:
+    include_routers(app)
 
 
 @app.get("/")
@@ -29,6 +109,12 @@ async def redirect_root_to_docs():
     return RedirectResponse("/docs")
 
 
+# Prometheus scrape endpoint, merges all workers when METRICS_MULTIPROC_DIR is set
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(metrics.collect()))
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -1,10 +1,10 @@
 # cors.py
-from fastapi.middleware.cors import CORSMiddleware
 
 
+# options for app.add_middleware(CORSMiddleware, **get_cors_config())
 def get_cors_config():
     origins = ["http://localhost:3000"]
-    return CORSMiddleware(
+    return dict(
         allow_origins=origins,
         allow_credentials=True,
         allow_methods=["*"],
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.app.core.metrics import db_query_count, metrics
+from src.app.core.query_budget import get_query_budget, report_over_budget
+
+metrics.counter(
+    "db_query_budget_exceeded_total", "Requests that ran more statements than allowed"
+)
+
+
+# Records latency, status and db statement counts per route. Written as a plain ASGI
+# middleware so it adds no extra task or response buffering to the request.
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+        query_count = [0]
+        token = db_query_count.set(query_count)
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                duration = time.perf_counter() - start_time
+                headers = list(message.get("headers", []))
+                headers.append((b"x-response-time", f"{duration:.6f}".encode()))
+                message["headers"] = headers
+            await send(message)
+
+        metrics.add("http_requests_in_flight")
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start_time
+            db_query_count.reset(token)
+            metrics.add("http_requests_in_flight", value=-1)
+            # label by route template, not raw path, to keep the series count bounded
+            route = scope.get("route")
+            labels = (
+                ("method", scope["method"]),
+                ("route", getattr(route, "path", "unmatched")),
+            )
+            metrics.inc("http_requests_total", labels + (("status", str(status_code)),))
+            metrics.observe("http_request_duration_seconds", labels, duration)
+            metrics.inc("db_queries_total", labels, query_count[0])
+            metrics.observe("db_queries_per_request", labels, query_count[0])
+            if metrics.flush_due():
+                asyncio.get_running_loop().run_in_executor(
+                    None, metrics.write_snapshot, metrics.flush()
+                )
+        # routes declare their budget with @query_budget, raises in strict mode
+        budget = get_query_budget(getattr(route, "endpoint", None))
+        if budget is not None and query_count[0] > budget:
+            metrics.inc("db_query_budget_exceeded_total", labels)
+            report_over_budget(route.path, query_count[0], budget)
@@ -0,0 +1,90 @@
+import math
+from fastapi.responses import JSONResponse
+from jose import JWTError
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
+from src.app.core import rate_limit
+from src.app.core.auth import decode_access_token
+from src.app.core.metrics import metrics
+
+metrics.counter("http_requests_rejected_total", "Requests shed by admission control")
+
+
+# Admission control in front of the routes: a global in-flight gate that sheds load
+# with 503, then per ip, per user and per route limits that answer 429. Rejected
+# requests never reach a route, so they never take a db connection.
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.backend = rate_limit.MemoryRateLimitBackend(rate_limit.RATE_LIMIT_MAX_KEYS)
+        self.admission = rate_limit.AdmissionState(rate_limit.MAX_IN_FLIGHT)
+        self.route_limits = rate_limit.parse_route_limits(rate_limit.RATE_LIMIT_ROUTES)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not rate_limit.RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        if not self.admission.try_enter():
+            await self.reject(scope, receive, send, "in_flight", 1.0)
+            return
+        try:
+            reason, retry_after = self.check_limits(scope)
+            if reason is not None:
+                await self.reject(scope, receive, send, reason, retry_after)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.leave()
+
+    def check_limits(self, scope: Scope) -> tuple:
+        ip = rate_limit.client_ip(scope)
+        user_id = self.user_id(scope)
+        if ip is not None:
+            retry_after = self.backend.take(
+                f"ip:{ip}",
+                rate_limit.RATE_LIMIT_IP_RATE,
+                rate_limit.RATE_LIMIT_IP_BURST,
+            )
+            if retry_after:
+                return "ip", retry_after
+        if user_id is not None:
+            retry_after = self.backend.take(
+                f"user:{user_id}",
+                rate_limit.RATE_LIMIT_USER_RATE,
+                rate_limit.RATE_LIMIT_USER_BURST,
+            )
+            if retry_after:
+                return "user", retry_after
+        route_limit = self.route_limits.get((scope["method"], scope["path"]))
+        if route_limit is not None:
+            client = f"user:{user_id}" if user_id is not None else f"ip:{ip}"
+            retry_after = self.backend.hit(
+                f"route:{scope['method']} {scope['path']}:{client}", *route_limit
+            )
+            if retry_after:
+                return "route", retry_after
+        return None, 0.0
+
+    # the verified token cache makes this a dict lookup for known cookies
+    def user_id(self, scope: Scope):
+        token = HTTPConnection(scope).cookies.get("access_token")
+        if token is None:
+            return None
+        try:
+            return decode_access_token(token).get("id")
+        except JWTError:
+            return None
+
+    async def reject(self, scope, receive, send, reason: str, retry_after: float):
+        metrics.inc("http_requests_rejected_total", (("reason", reason),))
+        if reason == "in_flight":
+            status_code, detail = 503, "Server is busy, try again later"
+        else:
+            status_code, detail = 429, "Too many requests, try again later"
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,40 @@
+import uuid
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.app.core.logger import log_context
+
+
+# Gives every request an id (the caller's X-Request-ID if it sent one) and makes it
+# available to log records through the log context, then echoes it in the response
+# along with the cookies that were put in the context, see ReplicaRouter.note_write
+class RequestContextMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        context = {"request_id": request_id, "scope": scope}
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                for cookie in context.get("set_cookie", {}).values():
+                    headers.append((b"set-cookie", cookie.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        token = log_context.set(context)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            log_context.reset(token)
@@ -1,10 +1,24 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from datetime import datetime
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    JSON,
+    LargeBinary,
+    String,
+    event,
+)
 from sqlalchemy.orm import relationship
 from src.app.db.database import Base
 
 
 class DBUsers(Base):
     __tablename__ = "users"
+    # ids are never reused on SQLite either, revocations and idempotency keys of a
+    # deleted user must not apply to a new one
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True)
@@ -12,15 +26,93 @@ class DBUsers(Base):
     last_name = Column(String)
     hashed_password = Column(String)
     role = Column(String, default="user")
+    # copied into the "ver" claim of new tokens, bumped to invalidate the old ones
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
-    account = relationship("DBAccounts", uselist=False, back_populates="user")
+    # Relationships never load implicitly, queries ask for them with loader options
+    # so a forgotten one fails loudly instead of turning into an N+1
+    account = relationship(
+        "DBAccounts", uselist=False, back_populates="user", lazy="raise"
+    )
 
 
 class DBAccounts(Base):
     __tablename__ = "accounts"
 
     id = Column(Integer, primary_key=True, index=True)
+    # materialized sum of the account's transactions, kept in the same db transaction
     account_balance = Column(Integer, default=0)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
 
-    user = relationship("DBUsers", back_populates="account")
+    user = relationship("DBUsers", back_populates="account", lazy="raise")
+
+
+# Append only ledger of every balance change, rows are never updated or deleted
+class DBTransactions(Base):
+    __tablename__ = "transactions"
+    __table_args__ = (
+        Index(
+            "ix_transactions_account_id_created_at", "account_id", "created_at", "id"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    counterparty_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    # opening, deposit, withdrawal, transfer_in or transfer_out
+    kind = Column(String, nullable=False)
+    # signed, credits are positive and debits negative
+    amount = Column(Integer, nullable=False)
+    balance_after = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+@event.listens_for(DBTransactions, "before_update")
+@event.listens_for(DBTransactions, "before_delete")
+def _reject_ledger_changes(mapper, connection, target):
+    raise ValueError("The transactions ledger is append only")
+
+
+# Outcome of requests sent with an Idempotency-Key, shared by all workers
+class DBIdempotencyKeys(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True)
+    # "<user id>:<Idempotency-Key header>"
+    key = Column(String, unique=True, nullable=False)
+    fingerprint = Column(String, nullable=False)
+    # null while the first request is still being processed
+    status_code = Column(Integer, nullable=True)
+    media_type = Column(String, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Lowest token version still accepted for a user, one row per revocation. Rows older
+# than the token lifetime only cover expired tokens and are pruned.
+class DBTokenRevocations(Base):
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    token_version = Column(Integer, nullable=False)
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+# Background jobs staged in the transaction of the change that triggered them, see
+# core/jobs.py. A row is deleted once its job succeeded.
+class DBOutbox(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_status_run_after", "status", "run_after"),)
+
+    id = Column(Integer, primary_key=True)
+    job = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    # pending or failed, failed rows ran out of attempts and are kept for inspection
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # set by the worker running the job, other workers skip the row until then
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
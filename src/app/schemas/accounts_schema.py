@@ -1,4 +1,7 @@
-from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import TypedDict
 
 from src.app.schemas.user_schema import UserResponse
 
@@ -8,6 +11,37 @@ class TransferRequest(BaseModel):
     to_account_id: int = Field(..., gt=0)
 
 
+class TransferResult(BaseModel):
+    from_account_id: int
+    to_account_id: int
+    amount: int
+    from_balance: int
+    to_balance: int
+
+
+class TransferBatchRequest(BaseModel):
+    transfers: List[TransferRequest] = Field(..., min_length=1, max_length=1000)
+    # all_or_nothing rolls back the whole batch on the first failing transfer,
+    # best_effort applies every transfer that can be applied and skips the rest
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+
+
+class TransferBatchItemResult(BaseModel):
+    index: int
+    to_account_id: int
+    amount: int
+    success: bool
+    detail: Optional[str] = None
+
+
+class TransferBatchResponse(BaseModel):
+    mode: Literal["all_or_nothing", "best_effort"]
+    committed: bool
+    succeeded: int
+    failed: int
+    results: List[TransferBatchItemResult]
+
+
 class AccountsResponse(BaseModel):
     id: int
     account_balance: int
@@ -15,3 +49,41 @@ class AccountsResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class TransactionResponse(BaseModel):
+    id: int
+    kind: str
+    amount: int
+    balance_after: int
+    counterparty_account_id: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class StatementResponse(BaseModel):
+    account_id: int
+    transactions: List[TransactionResponse]
+    # pass back as cursor to get the next (older) page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+# StatementResponse for rows that are serialized straight to JSON
+class TransactionRecord(TypedDict):
+    id: int
+    kind: str
+    amount: int
+    balance_after: int
+    counterparty_account_id: Optional[int]
+    created_at: datetime
+
+
+class StatementRecord(TypedDict):
+    account_id: int
+    transactions: List[TransactionRecord]
+    next_cursor: Optional[str]
+
+
+statement_json = TypeAdapter(StatementRecord)
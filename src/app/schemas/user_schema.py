@@ -1,5 +1,6 @@
-from typing import Optional
-from pydantic import BaseModel, Field
+from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import TypedDict
 
 
 class PatchUserBody(BaseModel):
@@ -47,6 +48,19 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+# Same fields as UserResponse for rows that are serialized straight to JSON, without
+# building ORM objects or validating models first
+class UserRecord(TypedDict):
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    role: str
+
+
+user_list_json = TypeAdapter(List[UserRecord])
+
+
 class ChangePasswordBody(BaseModel):
     password: str
     new_password: str = Field(..., min_length=6, max_length=50)
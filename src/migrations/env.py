@@ -6,14 +6,26 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from src.app.models import models
+from src.app.db.database import SQLALCHEMY_DATABASE_URL, to_sync_url
+from src.app.db.search import include_object
 from alembic import context
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-fileConfig(config.config_file_name)
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
 target_metadata = models.Base.metadata
 
+# The app connects through an async driver, alembic keeps running on the sync one
+if SQLALCHEMY_DATABASE_URL:
+    config.set_main_option(
+        "sqlalchemy.url",
+        to_sync_url(SQLALCHEMY_DATABASE_URL)
+        .render_as_string(hide_password=False)
+        .replace("%", "%%"),
+    )
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 # if config.config_file_name is not None:
@@ -47,6 +59,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -55,6 +68,17 @@ def run_migrations_offline() -> None:
         context.run_migrations()
 
 
+def do_run_migrations(connection) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
 def run_migrations_online() -> None:
     """Run migrations in 'online' mode.
 
@@ -62,6 +86,12 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # tests pass in an open connection instead of a url
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        do_run_migrations(connection)
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -69,10 +99,7 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
-
-        with context.begin_transaction():
-            context.run_migrations()
+        do_run_migrations(connection)
 
 
 if context.is_offline_mode():
@@ -0,0 +1,48 @@
+"""transactions ledger
+
+Revision ID: 4fec0ab9a7f3
+Revises: e28ff340091c
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4fec0ab9a7f3"
+down_revision: Union[str, None] = "e28ff340091c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "transactions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("account_id", sa.Integer(), nullable=False),
+        sa.Column("counterparty_account_id", sa.Integer(), nullable=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("balance_after", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["account_id"], ["accounts.id"]),
+        sa.ForeignKeyConstraint(["counterparty_account_id"], ["accounts.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_transactions_account_id_created_at",
+        "transactions",
+        ["account_id", "created_at", "id"],
+        unique=False,
+    )
+    # accounts opened before the ledger get their opening entry from
+    # python -m src.app.db.rebuild_balances
+
+
+def downgrade() -> None:
+    op.drop_index("ix_transactions_account_id_created_at", table_name="transactions")
+    op.drop_table("transactions")
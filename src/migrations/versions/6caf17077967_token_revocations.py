@@ -0,0 +1,87 @@
+"""token versions and revocations
+
+Revision ID: 6caf17077967
+Revises: ac5b5df41a30
+Create Date: 2026-10-18 10:50:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6caf17077967"
+down_revision: Union[str, None] = "ac5b5df41a30"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# SQLite rebuilds the users table, which drops the search triggers of ac5b5df41a30
+SQLITE_SEARCH_TRIGGERS = {
+    "users_fts_ai": "CREATE TRIGGER users_fts_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_fts(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); END",
+    "users_fts_ad": "CREATE TRIGGER users_fts_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); END",
+    "users_fts_au": "CREATE TRIGGER users_fts_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); "
+    "INSERT INTO users_fts(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); END",
+}
+
+
+def token_version_column() -> sa.Column:
+    return sa.Column("token_version", sa.Integer(), server_default="0", nullable=False)
+
+
+# SQLite reuses the highest id after a delete unless the table is AUTOINCREMENT, and
+# a table only gets that when it is created, so users is rebuilt with it
+def rebuild_users(autoincrement: bool, change) -> None:
+    for name in SQLITE_SEARCH_TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    with op.batch_alter_table(
+        "users",
+        recreate="always",
+        table_kwargs={"sqlite_autoincrement": autoincrement},
+    ) as batch_op:
+        change(batch_op)
+    for statement in SQLITE_SEARCH_TRIGGERS.values():
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        rebuild_users(
+            True, lambda batch_op: batch_op.add_column(token_version_column())
+        )
+    else:
+        op.add_column("users", token_version_column())
+    op.create_table(
+        "token_revocations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("token_version", sa.Integer(), nullable=False),
+        sa.Column("revoked_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_token_revocations_revoked_at"),
+        "token_revocations",
+        ["revoked_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_token_revocations_revoked_at"), table_name="token_revocations"
+    )
+    op.drop_table("token_revocations")
+    if op.get_bind().dialect.name == "sqlite":
+        rebuild_users(False, lambda batch_op: batch_op.drop_column("token_version"))
+    else:
+        op.drop_column("users", "token_version")
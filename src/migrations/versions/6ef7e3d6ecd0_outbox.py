@@ -0,0 +1,43 @@
+"""outbox for background jobs
+
+Revision ID: 6ef7e3d6ecd0
+Revises: 6caf17077967
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6ef7e3d6ecd0"
+down_revision: Union[str, None] = "6caf17077967"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("job", sa.String(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("run_after", sa.DateTime(), nullable=False),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_outbox_status_run_after", "outbox", ["status", "run_after"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_outbox_status_run_after", table_name="outbox")
+    op.drop_table("outbox")
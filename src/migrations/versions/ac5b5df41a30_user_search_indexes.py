@@ -0,0 +1,68 @@
+"""user search indexes, pg_trgm on Postgres and an FTS5 table on SQLite
+
+Revision ID: ac5b5df41a30
+Revises: 864e7bb307c4
+Create Date: 2026-10-18 10:40:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "ac5b5df41a30"
+down_revision: Union[str, None] = "864e7bb307c4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# same DDL as src/app/db/search.py at the time of this revision
+POSTGRES_UPGRADE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_first_name_trgm "
+    "ON users USING gin (first_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_last_name_trgm "
+    "ON users USING gin (last_name gin_trgm_ops)",
+]
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_users_last_name_trgm",
+    "DROP INDEX IF EXISTS ix_users_first_name_trgm",
+]
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE users_fts USING fts5("
+    "first_name, last_name, content='users', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER users_fts_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_fts(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); END",
+    "CREATE TRIGGER users_fts_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); END",
+    "CREATE TRIGGER users_fts_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); "
+    "INSERT INTO users_fts(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); END",
+    # index the existing users
+    "INSERT INTO users_fts(users_fts) VALUES ('rebuild')",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS users_fts_au",
+    "DROP TRIGGER IF EXISTS users_fts_ad",
+    "DROP TRIGGER IF EXISTS users_fts_ai",
+    "DROP TABLE IF EXISTS users_fts",
+]
+
+
+def upgrade() -> None:
+    statements = {"postgresql": POSTGRES_UPGRADE, "sqlite": SQLITE_UPGRADE}
+    for statement in statements.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    statements = {"postgresql": POSTGRES_DOWNGRADE, "sqlite": SQLITE_DOWNGRADE}
+    for statement in statements.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
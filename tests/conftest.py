@@ -0,0 +1,86 @@
+import os
+import tempfile
+import uuid
+from typing import NamedTuple
+
+# the app reads its settings at import time, so they are set before any import
+_tmp = tempfile.mkdtemp(prefix="paytm-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ["JWT_SECRET"] = "test-secret"
+os.environ["DB_CREATE_ALL"] = "true"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["QUERY_BUDGET_STRICT"] = "true"
+os.environ["LOG_LEVEL"] = "WARNING"
+
+import httpx
+import pytest
+
+PASSWORD = "password123"
+
+
+class User(NamedTuple):
+    client: httpx.AsyncClient
+    username: str
+    account: dict
+
+    async def balance(self) -> int:
+        response = await self.client.get("/api/v1/accounts/get_account")
+        assert response.status_code == 200, response.text
+        return response.json()["account_balance"]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# the app with its lifespan running, every test gets a fresh event loop so the
+# engine's connections are dropped afterwards
+@pytest.fixture
+async def app():
+    from src.app.db.database import async_engine
+    from src.app.main import app, lifespan
+
+    async with lifespan(app):
+        yield app
+    await async_engine.dispose()
+
+
+@pytest.fixture
+async def make_client(app):
+    clients = []
+
+    async def make() -> httpx.AsyncClient:
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        )
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        await client.aclose()
+
+
+# a signed up user with an account, logged in through the cookie of its client.
+# New accounts start with a random balance, see db_accounts.create_account
+@pytest.fixture
+async def make_user(make_client):
+    async def make() -> User:
+        client = await make_client()
+        username = f"user_{uuid.uuid4().hex[:12]}"
+        response = await client.post(
+            "/api/v1/auth_with_cookie/signup",
+            json={
+                "username": username,
+                "first_name": "Test",
+                "last_name": "User",
+                "password": PASSWORD,
+            },
+        )
+        assert response.status_code == 201, response.text
+        response = await client.post("/api/v1/accounts/create_account")
+        assert response.status_code == 201, response.text
+        return User(client, username, response.json())
+
+    return make
@@ -0,0 +1,189 @@
+import asyncio
+from contextvars import Context
+from typing import Optional
+import pytest
+from src.app.core.balance_cache import BalanceCache, MemoryBalanceCache
+from src.app.db.access_layers import db_accounts
+from src.app.db.database import AsyncSessionLocal
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeBalanceCache(BalanceCache):
+    """Never expires and remembers every invalidation."""
+
+    def __init__(self):
+        self.entries: dict[int, dict] = {}
+        self.invalidated: list[int] = []
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        return self.entries.get(user_id)
+
+    async def generation(self, user_id: int) -> int:
+        return self.invalidated.count(user_id)
+
+    async def set(self, user_id: int, value: dict, generation: int) -> None:
+        if generation == await self.generation(user_id):
+            self.entries[user_id] = value
+
+    async def invalidate(self, *user_ids: int) -> None:
+        for user_id in user_ids:
+            self.entries.pop(user_id, None)
+            self.invalidated.append(user_id)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = FakeBalanceCache()
+    monkeypatch.setattr(db_accounts, "balance_cache", cache)
+    return cache
+
+
+def user_id(user) -> int:
+    return user.account["user"]["id"]
+
+
+async def test_get_account_fills_the_cache(make_user, cache):
+    user = await make_user()
+
+    balance = await user.balance()
+
+    assert cache.entries[user_id(user)] == {
+        "id": user.account["id"],
+        "account_balance": balance,
+    }
+
+
+async def test_create_account_invalidates(make_user, cache):
+    user = await make_user()
+
+    assert cache.invalidated == [user_id(user)]
+
+
+async def test_transfer_invalidates_both_users(make_user, cache):
+    sender, receiver = await make_user(), await make_user()
+    balances = await sender.balance(), await receiver.balance()
+    cache.invalidated.clear()
+
+    response = await sender.client.patch(
+        "/api/v1/accounts/transfer_money",
+        json={"to_account_id": receiver.account["id"], "amount": 4},
+    )
+
+    assert response.status_code == 204
+    assert sorted(cache.invalidated) == sorted([user_id(sender), user_id(receiver)])
+    assert cache.entries == {}
+    assert await sender.balance() == balances[0] - 4
+    assert await receiver.balance() == balances[1] + 4
+
+
+async def test_batch_invalidates_every_user(make_user, cache):
+    sender, first, second = [await make_user() for _ in range(3)]
+    cache.invalidated.clear()
+
+    response = await sender.client.post(
+        "/api/v1/accounts/transfer_batch",
+        json={
+            "transfers": [
+                {"to_account_id": first.account["id"], "amount": 1},
+                {"to_account_id": second.account["id"], "amount": 1},
+            ]
+        },
+    )
+
+    assert response.status_code == 200
+    assert sorted(cache.invalidated) == sorted(
+        [user_id(sender), user_id(first), user_id(second)]
+    )
+
+
+@pytest.mark.parametrize("route", ["withdraw_money", "deposit_money"])
+async def test_balance_change_invalidates(make_user, cache, route):
+    user = await make_user()
+    balance = await user.balance()
+    cache.invalidated.clear()
+
+    response = await user.client.patch(
+        f"/api/v1/accounts/{route}", params={"amount": 3}
+    )
+
+    assert response.status_code == 204
+    assert cache.invalidated == [user_id(user)]
+    # the next read goes to the database instead of serving the old balance
+    expected = balance - 3 if route == "withdraw_money" else balance + 3
+    assert await user.balance() == expected
+
+
+async def test_failed_write_keeps_the_entry(make_user, cache):
+    user = await make_user()
+    balance = await user.balance()
+    cache.invalidated.clear()
+
+    response = await user.client.patch(
+        "/api/v1/accounts/withdraw_money", params={"amount": balance + 1}
+    )
+
+    assert response.status_code == 400
+    assert cache.invalidated == []
+    assert user_id(user) in cache.entries
+
+
+# a deposit that commits and invalidates between the reader's SELECT and its set
+class OvertakenBalanceCache(MemoryBalanceCache):
+    def __init__(self, user_id: int, amount: int):
+        super().__init__(maxsize=100, ttl=60)
+        self.overtaken_by = (user_id, amount)
+
+    async def set(self, user_id: int, value: dict, generation: int) -> None:
+        if self.overtaken_by is not None:
+            writer, amount = self.overtaken_by
+            self.overtaken_by = None
+            # in a context of its own, like another request
+            await asyncio.create_task(deposit(writer, amount), context=Context())
+        await super().set(user_id, value, generation)
+
+
+async def deposit(user_id: int, amount: int) -> None:
+    async with AsyncSessionLocal() as db:
+        await db_accounts.deposit_money(db, user_id, amount)
+
+
+async def test_a_read_overtaken_by_a_write_is_not_cached(make_user, monkeypatch):
+    user = await make_user()
+    balance = await user.balance()
+    cache = OvertakenBalanceCache(user_id(user), 7)
+    monkeypatch.setattr(db_accounts, "balance_cache", cache)
+
+    # this read loaded the balance from before the deposit
+    assert await user.balance() == balance
+
+    assert await cache.get(user_id(user)) is None
+    assert await user.balance() == balance + 7
+    assert await cache.get(user_id(user)) is not None
+
+
+async def test_memory_cache_skips_a_set_after_an_invalidation():
+    cache = MemoryBalanceCache(maxsize=100, ttl=60)
+    generation = await cache.generation(1)
+
+    await cache.invalidate(1)
+    await cache.set(1, {"id": 1, "account_balance": 100}, generation)
+
+    assert await cache.get(1) is None
+    await cache.set(1, {"id": 1, "account_balance": 90}, await cache.generation(1))
+    assert await cache.get(1) == {"id": 1, "account_balance": 90}
+
+
+def test_a_cache_must_implement_generation():
+    class Incomplete(BalanceCache):
+        async def get(self, user_id):
+            return None
+
+        async def set(self, user_id, value, generation):
+            pass
+
+        async def invalidate(self, *user_ids):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from src.app.db.access_layers import db_accounts
+from src.app.db.access_layers.db_accounts import DepositCoalescer
+from src.app.db.database import AsyncSessionLocal
+from src.app.models.models import DBTransactions
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def coalescer(monkeypatch):
+    coalescer = DepositCoalescer(window=0.05, max_batch=100)
+    batches = []
+    apply = coalescer._apply
+
+    async def counted_apply(user_id, batch):
+        batches.append(len(batch))
+        await apply(user_id, batch)
+
+    coalescer._apply = counted_apply
+    coalescer.batches = batches
+    monkeypatch.setattr(db_accounts, "DEPOSIT_COALESCING", True)
+    monkeypatch.setattr(db_accounts, "deposit_coalescer", coalescer)
+    return coalescer
+
+
+async def deposit(user_id: int, amount: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db_accounts.deposit_money(db, user_id, amount)
+
+
+async def test_concurrent_deposits_share_one_update(make_user, coalescer):
+    user = await make_user()
+    user_id = user.account["user"]["id"]
+    balance = await user.balance()
+    amounts = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+    balances = await asyncio.gather(*(deposit(user_id, amount) for amount in amounts))
+
+    assert coalescer.batches == [len(amounts)]
+    # every caller gets the balance right after its own deposit
+    running = balance
+    for amount, returned in zip(amounts, balances):
+        running += amount
+        assert returned == running
+    assert await user.balance() == balance + sum(amounts)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(DBTransactions.amount, DBTransactions.balance_after)
+            .where(
+                DBTransactions.account_id == user.account["id"],
+                DBTransactions.kind == "deposit",
+            )
+            .order_by(DBTransactions.id)
+        )
+    assert result.all() == list(zip(amounts, balances))
+
+
+async def test_a_full_batch_is_applied_without_waiting(make_user, coalescer):
+    user = await make_user()
+    user_id = user.account["user"]["id"]
+    coalescer.window = 60
+    coalescer.max_batch = 3
+
+    balances = await asyncio.wait_for(
+        asyncio.gather(*(deposit(user_id, 1) for _ in range(3))), timeout=5
+    )
+
+    assert coalescer.batches == [3]
+    assert balances[2] == balances[0] + 2
+
+
+async def test_every_caller_gets_the_batch_error(app, coalescer):
+    results = await asyncio.gather(
+        *(deposit(10**9, 1) for _ in range(3)), return_exceptions=True
+    )
+
+    assert coalescer.batches == [3]
+    for result in results:
+        assert isinstance(result, HTTPException)
+        assert result.detail == "Account not found"
@@ -0,0 +1,129 @@
+import asyncio
+import httpx
+import pytest
+from src.app.core import http_client as http_client_module
+from src.app.core.http_client import HTTP_CLIENT_RETRIES, OutboundHTTPClient
+
+pytestmark = pytest.mark.anyio
+
+URL = "https://example.test/todos"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(http_client_module, "HTTP_CLIENT_BACKOFF", 0)
+
+
+async def started(handler) -> OutboundHTTPClient:
+    client = OutboundHTTPClient()
+    await client.start(transport=httpx.MockTransport(handler))
+    return client
+
+
+async def test_concurrent_gets_share_one_request_and_are_cached():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url)
+        # keep the first request in flight while the others arrive
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"todos": len(calls)})
+
+    client = await started(handler)
+    try:
+        responses = await asyncio.gather(
+            *(client.get(URL, cache_ttl=10) for _ in range(10))
+        )
+        assert len(calls) == 1
+        assert [response.json() for response in responses] == [{"todos": 1}] * 10
+
+        cached = await client.get(URL, cache_ttl=10)
+        assert cached.json() == {"todos": 1}
+        assert len(calls) == 1
+
+        # without a ttl the cache is skipped
+        fresh = await client.get(URL)
+        assert fresh.json() == {"todos": 2}
+    finally:
+        await client.close()
+
+
+async def test_failed_responses_are_not_cached():
+    statuses = [500, 200]
+
+    def handler(request):
+        return httpx.Response(statuses.pop(0))
+
+    client = await started(handler)
+    try:
+        assert (await client.get(URL, cache_ttl=10)).status_code == 500
+        assert (await client.get(URL, cache_ttl=10)).status_code == 200
+    finally:
+        await client.close()
+
+
+async def test_retries_on_503():
+    statuses = [503, 503, 200]
+
+    def handler(request):
+        return httpx.Response(statuses.pop(0))
+
+    client = await started(handler)
+    try:
+        response = await client.get(URL)
+        assert response.status_code == 200
+        assert statuses == []
+    finally:
+        await client.close()
+
+
+async def test_returns_the_last_503_when_retries_run_out():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    client = await started(handler)
+    try:
+        response = await client.get(URL)
+        assert response.status_code == 503
+        assert len(calls) == HTTP_CLIENT_RETRIES + 1
+    finally:
+        await client.close()
+
+
+async def test_timeouts_are_retried_then_raised():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    client = await started(handler)
+    try:
+        with pytest.raises(httpx.ReadTimeout):
+            await client.get(URL)
+        assert len(calls) == HTTP_CLIENT_RETRIES + 1
+        # the failed fetch is not left behind for later callers to join
+        assert client.in_flight == {}
+    finally:
+        await client.close()
+
+
+async def test_timeout_then_success():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectTimeout("timed out", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    client = await started(handler)
+    try:
+        response = await client.get(URL)
+        assert response.json() == {"ok": True}
+        assert len(calls) == 2
+    finally:
+        await client.close()
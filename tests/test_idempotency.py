@@ -0,0 +1,109 @@
+import pytest
+from src.app.core import idempotency
+from src.app.core.idempotency import (
+    IDEMPOTENCY_CACHE_SIZE,
+    IDEMPOTENCY_TTL,
+    DBIdempotencyStore,
+    MemoryIdempotencyStore,
+)
+
+pytestmark = pytest.mark.anyio
+
+TRANSFER_URL = "/api/v1/accounts/transfer_money"
+
+
+@pytest.fixture(params=["memory", "db"], autouse=True)
+def store(request, monkeypatch):
+    if request.param == "db":
+        store = DBIdempotencyStore(IDEMPOTENCY_TTL)
+    else:
+        store = MemoryIdempotencyStore(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+    monkeypatch.setattr(idempotency, "store", store)
+    return store
+
+
+async def test_retry_replays_the_response_without_moving_money_again(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balance = await sender.balance()
+    transfer = {"to_account_id": receiver.account["id"], "amount": 7}
+    headers = {"Idempotency-Key": "transfer-1"}
+
+    first = await sender.client.patch(TRANSFER_URL, json=transfer, headers=headers)
+    retry = await sender.client.patch(TRANSFER_URL, json=transfer, headers=headers)
+
+    assert first.status_code == retry.status_code == 204
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert await sender.balance() == balance - 7
+
+
+async def test_batch_retry_replays_the_same_body(make_user):
+    sender, receiver = await make_user(), await make_user()
+    batch = {"transfers": [{"to_account_id": receiver.account["id"], "amount": 3}]}
+    headers = {"Idempotency-Key": "batch-1"}
+
+    first = await sender.client.post(
+        "/api/v1/accounts/transfer_batch", json=batch, headers=headers
+    )
+    balance = await sender.balance()
+    retry = await sender.client.post(
+        "/api/v1/accounts/transfer_batch", json=batch, headers=headers
+    )
+
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert await sender.balance() == balance
+
+
+async def test_key_reused_for_a_different_request_is_rejected(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balance = await sender.balance()
+    headers = {"Idempotency-Key": "transfer-2"}
+
+    await sender.client.patch(
+        TRANSFER_URL,
+        json={"to_account_id": receiver.account["id"], "amount": 5},
+        headers=headers,
+    )
+    reused = await sender.client.patch(
+        TRANSFER_URL,
+        json={"to_account_id": receiver.account["id"], "amount": 50},
+        headers=headers,
+    )
+
+    assert reused.status_code == 422
+    assert reused.json()["detail"] == (
+        "Idempotency-Key was already used for a different request"
+    )
+    assert await sender.balance() == balance - 5
+
+
+async def test_client_errors_are_replayed(make_user):
+    sender, receiver = await make_user(), await make_user()
+    transfer = {"to_account_id": receiver.account["id"], "amount": 10**9}
+    headers = {"Idempotency-Key": "transfer-3"}
+
+    first = await sender.client.patch(TRANSFER_URL, json=transfer, headers=headers)
+    retry = await sender.client.patch(TRANSFER_URL, json=transfer, headers=headers)
+
+    assert first.status_code == retry.status_code == 400
+    assert retry.json() == {"detail": "Insufficient funds"}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+
+async def test_keys_are_scoped_to_the_user(make_user):
+    first, second = await make_user(), await make_user()
+    balances = await first.balance(), await second.balance()
+    headers = {"Idempotency-Key": "same-key"}
+
+    for user in (first, second):
+        response = await user.client.patch(
+            "/api/v1/accounts/withdraw_money", params={"amount": 1}, headers=headers
+        )
+        assert response.status_code == 204
+        assert "Idempotent-Replayed" not in response.headers
+
+    assert (await first.balance(), await second.balance()) == (
+        balances[0] - 1,
+        balances[1] - 1,
+    )
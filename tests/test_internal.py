@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import update
+from src.app.db.database import AsyncSessionLocal
+from src.app.models.models import DBUsers
+from tests.conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+POOL_URL = "/internal/pool"
+
+
+async def test_pool_needs_a_token(app, make_client):
+    client = await make_client()
+
+    assert (await client.get(POOL_URL)).status_code == 401
+
+
+async def test_pool_is_refused_to_users(make_user):
+    user = await make_user()
+
+    response = await user.client.get(POOL_URL)
+
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Not enough permissions"
+
+
+async def test_signup_cannot_pick_its_role(make_client, app):
+    client = await make_client()
+
+    response = await client.post(
+        "/api/v1/auth_with_cookie/signup",
+        json={
+            "username": "would_be_admin",
+            "first_name": "Would",
+            "last_name": "Admin",
+            "password": PASSWORD,
+            "role": "admin",
+        },
+    )
+
+    assert response.status_code == 201
+    assert (await client.get("/api/v1/users/me")).json()["role"] == "user"
+    assert (await client.get(POOL_URL)).status_code == 403
+
+
+async def test_pool_is_served_to_admins(make_user):
+    user = await make_user()
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(DBUsers)
+            .where(DBUsers.username == user.username)
+            .values(role="admin")
+        )
+        await db.commit()
+    # the role is a claim of the token, so it takes a new login
+    response = await user.client.post(
+        "/api/v1/auth_with_cookie/login",
+        data={"username": user.username, "password": PASSWORD},
+    )
+    assert response.status_code == 200
+
+    response = await user.client.get(POOL_URL)
+
+    assert response.status_code == 200
+    assert "replicas" in response.json()
@@ -0,0 +1,30 @@
+import logging
+from src.app.core.audit import audit_logger
+from src.app.core.logger import SamplingFilter
+
+
+def record(name: str, level: int = logging.INFO, **extra) -> logging.LogRecord:
+    return logging.makeLogRecord(dict(name=name, levelno=level, **extra))
+
+
+def test_sampling_drops_info_records():
+    sampling = SamplingFilter(0.0)
+
+    assert not sampling.filter(record("src.app.api"))
+    assert not sampling.filter(record("src.app.api", logging.DEBUG))
+    assert sampling.filter(record("src.app.api", logging.WARNING))
+
+
+def test_audit_records_are_never_sampled():
+    sampling = SamplingFilter(0.0)
+
+    assert sampling.filter(record(audit_logger.name))
+    assert sampling.filter(record(f"{audit_logger.name}.transfers"))
+    assert not sampling.filter(record("auditing"))
+
+
+def test_records_can_opt_out_of_sampling():
+    sampling = SamplingFilter(0.0)
+
+    assert sampling.filter(record("src.app.api", sampled=False))
+    assert not sampling.filter(record("src.app.api", sampled=True))
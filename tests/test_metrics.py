@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+import httpx
+import pytest
+from src.app.core import metrics as metrics_module
+from src.app.core.metrics import Metrics
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def multiproc_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_module, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    return tmp_path
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def write(directory, pid: int, metrics: Metrics) -> None:
+    (directory / f"{pid}.json").write_text(json.dumps(metrics.snapshot()))
+
+
+def make_metrics() -> Metrics:
+    metrics = Metrics()
+    metrics.counter("requests_total", "Requests")
+    metrics.gauge("in_flight", "Requests in flight")
+    metrics.gauge("startup_seconds", "Startup time", mode="max")
+    return metrics
+
+
+def test_collect_skips_the_snapshots_of_dead_workers(multiproc_dir):
+    metrics, dead = make_metrics(), make_metrics()
+    metrics.inc("requests_total", value=2)
+    dead.inc("requests_total", value=5)
+    dead.add("in_flight", value=3)
+    write(multiproc_dir, dead_pid(), dead)
+
+    text = metrics.render(metrics.collect())
+
+    assert "requests_total 2\n" in text
+    assert "in_flight" not in text
+
+
+def test_gauges_are_merged_by_their_mode(multiproc_dir):
+    metrics, other = make_metrics(), make_metrics()
+    metrics.set("startup_seconds", (("phase", "total"),), 1.5)
+    metrics.add("in_flight", value=2)
+    other.set("startup_seconds", (("phase", "total"),), 2.5)
+    other.add("in_flight", value=1)
+    other.inc("requests_total")
+    # the parent of the tests is as alive as a sibling worker would be
+    write(multiproc_dir, os.getppid(), other)
+
+    text = metrics.render(metrics.collect())
+
+    assert 'startup_seconds{phase="total"} 2.5\n' in text
+    assert "in_flight 3\n" in text
+    assert "requests_total 1\n" in text
+
+
+def test_remove_snapshot(multiproc_dir):
+    metrics = make_metrics()
+    metrics.collect()
+    assert (multiproc_dir / f"{os.getpid()}.json").exists()
+
+    metrics.remove_snapshot()
+    metrics.remove_snapshot()
+
+    assert list(multiproc_dir.iterdir()) == []
+
+
+def test_unknown_gauge_mode_is_rejected():
+    with pytest.raises(ValueError, match="Unknown gauge mode"):
+        Metrics().gauge("in_flight", "Requests in flight", mode="min")
+
+
+async def test_shutdown_removes_the_snapshot(multiproc_dir):
+    from src.app.db.database import async_engine
+    from src.app.main import app, lifespan
+
+    async with lifespan(app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            assert (await client.get("/metrics")).status_code == 200
+        assert (multiproc_dir / f"{os.getpid()}.json").exists()
+    await async_engine.dispose()
+
+    assert list(multiproc_dir.iterdir()) == []
@@ -0,0 +1,99 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from src.app.db import search, startup
+from src.app.models import models
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+
+def run(connection, action, revision):
+    config = Config()
+    config.set_main_option("script_location", startup.MIGRATIONS_DIR)
+    config.attributes["connection"] = connection
+    action(config, revision)
+
+
+def test_migrations_have_a_single_head():
+    assert len(startup.migrations().get_heads()) == 1
+
+
+def test_upgrade_and_downgrade(engine):
+    with engine.begin() as connection:
+        run(connection, command.upgrade, "head")
+        tables = set(inspect(connection).get_table_names())
+        assert {
+            "users",
+            "accounts",
+            "transactions",
+            "idempotency_keys",
+            "token_revocations",
+            "outbox",
+        } <= tables
+        startup.verify_schema_revision(connection)
+
+        run(connection, command.downgrade, "base")
+        assert inspect(connection).get_table_names() == ["alembic_version"]
+
+
+def test_migrations_match_the_models(engine):
+    with engine.begin() as connection:
+        run(connection, command.upgrade, "head")
+        context = MigrationContext.configure(
+            connection, opts={"include_object": search.include_object}
+        )
+        assert compare_metadata(context, models.Base.metadata) == []
+
+
+def test_upgrade_installs_the_search_index(engine):
+    with engine.begin() as connection:
+        run(connection, command.upgrade, "864e7bb307c4")
+        connection.execute(
+            text("INSERT INTO users (username, first_name) VALUES ('old', 'Margaret')")
+        )
+        run(connection, command.upgrade, "head")
+        connection.execute(
+            text(
+                "INSERT INTO users (username, first_name) VALUES ('new', 'Marguerite')"
+            )
+        )
+
+        matches = connection.execute(
+            text("SELECT rowid FROM users_fts WHERE users_fts MATCH '\"arg\"'")
+        )
+        assert len(matches.all()) == 2
+
+
+def test_user_ids_are_not_reused(engine):
+    with engine.begin() as connection:
+        run(connection, command.upgrade, "ac5b5df41a30")
+        connection.execute(text("INSERT INTO users (username) VALUES ('first')"))
+        connection.execute(text("INSERT INTO users (username) VALUES ('second')"))
+        run(connection, command.upgrade, "head")
+        connection.execute(text("DELETE FROM users WHERE username = 'second'"))
+        connection.execute(text("INSERT INTO users (username) VALUES ('third')"))
+
+        users = connection.execute(
+            text("SELECT id, username, token_version FROM users ORDER BY id")
+        )
+        assert users.all() == [(1, "first", 0), (3, "third", 0)]
+
+
+def test_create_schema_stamps_new_databases(engine):
+    with engine.begin() as connection:
+        startup.create_schema(connection)
+        startup.verify_schema_revision(connection)
+
+
+def test_verify_schema_revision_rejects_unmigrated_databases(engine):
+    with engine.begin() as connection:
+        with pytest.raises(startup.SchemaRevisionMismatch):
+            startup.verify_schema_revision(connection)
@@ -0,0 +1,44 @@
+import pytest
+from tests.conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+PATCH_URL = "/api/v1/users/patch_user"
+ME_URL = "/api/v1/users/me"
+
+
+async def test_patching_one_field_keeps_the_others(make_user, make_client):
+    user = await make_user()
+    before = (await user.client.get(ME_URL)).json()
+
+    response = await user.client.patch(PATCH_URL, json={"first_name": "Alicia"})
+
+    assert response.status_code == 204
+    assert (await user.client.get(ME_URL)).json() == dict(before, first_name="Alicia")
+    other = await make_client()
+    login = await other.post(
+        "/api/v1/auth_with_cookie/login",
+        data={"username": user.username, "password": PASSWORD},
+    )
+    assert login.status_code == 200
+
+
+async def test_null_fields_are_ignored(make_user):
+    user = await make_user()
+    before = (await user.client.get(ME_URL)).json()
+
+    response = await user.client.patch(
+        PATCH_URL, json={"username": None, "last_name": "Renamed"}
+    )
+
+    assert response.status_code == 204
+    assert (await user.client.get(ME_URL)).json() == dict(before, last_name="Renamed")
+
+
+async def test_taken_username_is_rejected(make_user):
+    user, other = await make_user(), await make_user()
+
+    response = await user.client.patch(PATCH_URL, json={"username": other.username})
+
+    assert response.status_code == 409
+    assert (await user.client.get(ME_URL)).json()["username"] == user.username
@@ -0,0 +1,128 @@
+import pytest
+from src.app.api.v1 import users
+from src.app.core import query_budget
+from src.app.core.query_budget import QueryBudgetExceeded, get_query_budget
+from tests.conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+# calls out to the internet and runs no statements
+SKIPPED_ROUTES = {"/api/v1/accounts/get_random_todos"}
+
+
+def budgeted_routes(app) -> set[str]:
+    return {
+        route.path
+        for route in app.routes
+        if get_query_budget(getattr(route, "endpoint", None)) is not None
+    } - SKIPPED_ROUTES
+
+
+# QUERY_BUDGET_STRICT is set for the tests, so any route that runs more statements
+# than its budget fails its request here
+async def test_every_route_stays_within_its_budget(app, make_client):
+    assert query_budget.QUERY_BUDGET_STRICT
+    sender, receiver = await make_client(), await make_client()
+    visited = set()
+
+    async def call(client, method, path, status_code, **kwargs):
+        response = await client.request(method, "/api/v1" + path, **kwargs)
+        assert response.status_code == status_code, (path, response.text)
+        visited.add("/api/v1" + path)
+        return response
+
+    for name, client in (("sender", sender), ("receiver", receiver)):
+        signup = {
+            "username": f"budget_{name}_{id(client)}",
+            "first_name": "Budget",
+            "last_name": name.title(),
+            "password": PASSWORD,
+        }
+        await call(client, "POST", "/auth_with_cookie/signup", 201, json=signup)
+        await call(
+            client,
+            "POST",
+            "/auth_with_cookie/login",
+            200,
+            data={"username": signup["username"], "password": PASSWORD},
+        )
+        await call(client, "POST", "/accounts/create_account", 201)
+    username = f"budget_sender_{id(sender)}"
+    receiver_account = (
+        await call(receiver, "GET", "/accounts/get_account", 200)
+    ).json()["id"]
+
+    await call(sender, "GET", "/users/me", 200)
+    await call(sender, "GET", "/users/get_users", 200)
+    await call(sender, "GET", "/users/get_users", 200, params={"search_filter": "Bud"})
+    await call(
+        sender,
+        "PATCH",
+        "/users/patch_user",
+        204,
+        json={"username": username, "first_name": "Other", "last_name": "Sender"},
+    )
+    await call(sender, "GET", "/accounts/get_account", 200)
+    await call(sender, "PATCH", "/accounts/deposit_money", 204, params={"amount": 100})
+    await call(sender, "PATCH", "/accounts/withdraw_money", 204, params={"amount": 10})
+    await call(
+        sender,
+        "PATCH",
+        "/accounts/transfer_money",
+        204,
+        json={"to_account_id": receiver_account, "amount": 5},
+    )
+    await call(
+        sender,
+        "PATCH",
+        "/accounts/transfer_money",
+        204,
+        json={"to_account_id": receiver_account, "amount": 5},
+        headers={"Idempotency-Key": "budget-transfer"},
+    )
+    await call(
+        sender,
+        "POST",
+        "/accounts/transfer_batch",
+        200,
+        json={"transfers": [{"to_account_id": receiver_account, "amount": 1}] * 3},
+    )
+    await call(sender, "GET", "/accounts/statement", 200, params={"limit": 2})
+    await call(sender, "GET", "/accounts/statement/export", 200)
+    await call(
+        sender,
+        "PATCH",
+        "/users/me/change_password",
+        204,
+        json={"password": PASSWORD, "new_password": "new-password"},
+    )
+    await call(
+        sender,
+        "DELETE",
+        "/auth_with_cookie/remove_user",
+        204,
+        data={"username": username, "password": "new-password"},
+    )
+
+    assert visited == budgeted_routes(app)
+
+
+async def test_over_budget_route_raises(make_user, monkeypatch):
+    user = await make_user()
+    monkeypatch.setattr(users.get_users, "__query_budget__", 0)
+
+    with pytest.raises(QueryBudgetExceeded, match="/api/v1/users/get_users ran"):
+        await user.client.get("/api/v1/users/get_users")
+
+
+async def test_over_budget_route_only_logs_when_not_strict(
+    make_user, monkeypatch, caplog
+):
+    user = await make_user()
+    monkeypatch.setattr(users.get_users, "__query_budget__", 0)
+    monkeypatch.setattr(query_budget, "QUERY_BUDGET_STRICT", False)
+
+    response = await user.client.get("/api/v1/users/get_users")
+
+    assert response.status_code == 200
+    assert "its query budget is 0" in caplog.text
@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy import event
+from src.app.core import rate_limit
+from src.app.core.logger import log_context
+from src.app.core.rate_limit import (
+    AdmissionState,
+    MemoryRateLimitBackend,
+    parse_route_limits,
+)
+from src.app.db.database import async_engine
+from src.app.middleware.rate_limit_middleware import RateLimitMiddleware
+from tests.conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+LOGIN_URL = "/api/v1/auth_with_cookie/login"
+ACCOUNT_URL = "/api/v1/accounts/get_account"
+
+
+# RATE_LIMIT_ENABLED is off for the other tests, this turns on the app's own
+# middleware with fresh state once the users of a test are set up
+@pytest.fixture
+def enable_limiter(app, monkeypatch):
+    def enable(
+        routes: str = "", max_in_flight: int = 0, **limits
+    ) -> RateLimitMiddleware:
+        if app.middleware_stack is None:
+            app.middleware_stack = app.build_middleware_stack()
+        limiter = app.middleware_stack
+        while not isinstance(limiter, RateLimitMiddleware):
+            limiter = limiter.app
+        monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+        for name, value in limits.items():
+            monkeypatch.setattr(rate_limit, name, value)
+        monkeypatch.setattr(limiter, "backend", MemoryRateLimitBackend(1000))
+        monkeypatch.setattr(limiter, "admission", AdmissionState(max_in_flight))
+        monkeypatch.setattr(limiter, "route_limits", parse_route_limits(routes))
+        return limiter
+
+    return enable
+
+
+# connections checked out while serving a request, the job poller and the
+# revocation refresh run outside of any request
+@pytest.fixture
+def request_checkouts():
+    checkouts = []
+
+    def on_checkout(*args):
+        if log_context.get() is not None:
+            checkouts.append(log_context.get()["request_id"])
+
+    event.listen(async_engine.sync_engine, "checkout", on_checkout)
+    yield checkouts
+    event.remove(async_engine.sync_engine, "checkout", on_checkout)
+
+
+async def test_login_burst_past_the_route_limit_is_rejected(
+    make_user, enable_limiter, request_checkouts
+):
+    user = await make_user()
+    enable_limiter(routes=f"POST {LOGIN_URL}=3/60")
+    login = {"username": user.username, "password": PASSWORD}
+
+    for _ in range(3):
+        assert (await user.client.post(LOGIN_URL, data=login)).status_code == 200
+    assert request_checkouts
+    request_checkouts.clear()
+    response = await user.client.post(LOGIN_URL, data=login)
+
+    assert response.status_code == 429
+    assert response.json()["detail"] == "Too many requests, try again later"
+    assert 1 <= int(response.headers["Retry-After"]) <= 60
+    # rejected before the route, so without a connection
+    assert request_checkouts == []
+
+
+async def test_user_buckets_are_keyed_by_the_token_not_the_ip(
+    make_user, enable_limiter
+):
+    first, second = await make_user(), await make_user()
+    limiter = enable_limiter(RATE_LIMIT_USER_RATE=0.001, RATE_LIMIT_USER_BURST=2)
+
+    statuses = [(await first.client.get(ACCOUNT_URL)).status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+    # same ip, a bucket of its own
+    assert (await second.client.get(ACCOUNT_URL)).status_code == 200
+    user_ids = {first.account["user"]["id"], second.account["user"]["id"]}
+    assert {key for key in limiter.backend.buckets if key.startswith("user:")} == {
+        f"user:{user_id}" for user_id in user_ids
+    }
+
+
+async def test_the_ip_bucket_covers_anonymous_requests(make_client, enable_limiter):
+    client = await make_client()
+    enable_limiter(RATE_LIMIT_IP_RATE=0.001, RATE_LIMIT_IP_BURST=2)
+
+    statuses = [(await client.get("/metrics")).status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+
+
+async def test_requests_past_max_in_flight_get_503(
+    make_user, enable_limiter, request_checkouts
+):
+    user = await make_user()
+    limiter = enable_limiter(max_in_flight=1)
+    assert limiter.admission.try_enter()
+    request_checkouts.clear()
+
+    response = await user.client.get(ACCOUNT_URL)
+
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Server is busy, try again later"
+    assert response.headers["Retry-After"] == "1"
+    assert request_checkouts == []
+
+    limiter.admission.leave()
+    assert (await user.client.get(ACCOUNT_URL)).status_code == 200
+    assert limiter.admission.in_flight == 0
+
+
+def test_least_recently_used_keys_are_evicted():
+    backend = MemoryRateLimitBackend(max_keys=2)
+
+    for key in ("a", "b", "a", "c"):
+        backend.take(key, rate=1, burst=5)
+
+    assert list(backend.buckets) == ["a", "c"]
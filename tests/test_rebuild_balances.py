@@ -0,0 +1,97 @@
+import uuid
+import pytest
+from sqlalchemy import select, update
+from src.app.db.access_layers import db_accounts
+from src.app.db.database import AsyncSessionLocal
+from src.app.db.rebuild_balances import rebuild_balances
+from src.app.models.models import DBAccounts, DBTransactions, DBUsers
+
+pytestmark = pytest.mark.anyio
+
+
+async def ledger(account_id: int) -> list[tuple[str, int, int]]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(
+                DBTransactions.kind, DBTransactions.amount, DBTransactions.balance_after
+            )
+            .where(DBTransactions.account_id == account_id)
+            .order_by(DBTransactions.created_at, DBTransactions.id)
+        )
+        return [tuple(row) for row in result]
+
+
+async def balance(account_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(DBAccounts.account_balance).where(DBAccounts.id == account_id)
+        )
+
+
+# an account created before the ledger existed, with no opening entry
+async def legacy_account(balance: int) -> tuple[int, int]:
+    async with AsyncSessionLocal() as db:
+        user = DBUsers(
+            username=f"legacy_{uuid.uuid4().hex[:12]}",
+            first_name="Legacy",
+            last_name="User",
+            hashed_password="x",
+        )
+        db.add(user)
+        await db.flush()
+        account = DBAccounts(user_id=user.id, account_balance=balance)
+        db.add(account)
+        await db.commit()
+        return user.id, account.id
+
+
+async def test_keeps_the_balance_of_accounts_that_predate_the_ledger(app):
+    user_id, account_id = await legacy_account(500)
+    async with AsyncSessionLocal() as db:
+        await db_accounts.deposit_money(db, user_id, 10)
+
+    stats = await rebuild_balances()
+
+    assert await balance(account_id) == 510
+    assert await ledger(account_id) == [("opening", 500, 500), ("deposit", 10, 510)]
+    assert stats["backfilled"] >= 1
+
+    # the ledger explains the balance now, a second run has nothing to do
+    stats = await rebuild_balances()
+    assert stats["backfilled"] == stats["mismatched"] == 0
+    assert await balance(account_id) == 510
+
+
+async def test_legacy_account_without_changes_gets_its_balance_as_opening(app):
+    _, account_id = await legacy_account(300)
+
+    await rebuild_balances()
+
+    assert await balance(account_id) == 300
+    assert await ledger(account_id) == [("opening", 300, 300)]
+
+
+async def test_restores_a_balance_that_drifted_from_the_ledger(app, make_user):
+    user = await make_user()
+    account_id = user.account["id"]
+    expected = await balance(account_id)
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(DBAccounts)
+            .where(DBAccounts.id == account_id)
+            .values(account_balance=expected + 1000)
+        )
+        await db.commit()
+
+    await rebuild_balances()
+
+    assert await balance(account_id) == expected
+
+
+async def test_dry_run_writes_nothing(app):
+    _, account_id = await legacy_account(200)
+
+    stats = await rebuild_balances(dry_run=True)
+
+    assert stats["backfilled"] >= 1
+    assert await ledger(account_id) == []
@@ -0,0 +1,106 @@
+import os
+import time
+import uuid
+import pytest
+from src.app.core.cache import TTLCache
+from src.app.db.database import create_app_engine, replica_router
+from src.app.db.pool import PoolStats
+from src.app.db.replicas import LAST_WRITE_COOKIE, Replica, ReplicaRouter
+from tests.conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+
+# a new user reads from the primary for the staleness window, a replica may not
+# have the row yet
+async def test_signup_pins_the_new_user_to_the_primary(make_client):
+    client = await make_client()
+
+    response = await client.post(
+        "/api/v1/auth_with_cookie/signup",
+        json={
+            "username": f"user_{uuid.uuid4().hex[:12]}",
+            "first_name": "Test",
+            "last_name": "User",
+            "password": PASSWORD,
+        },
+    )
+
+    assert response.status_code == 201
+    user_id = (await client.get("/api/v1/users/me")).json()["id"]
+    assert replica_router.recent_writers.get(user_id) is True
+
+
+@pytest.fixture
+async def replica(app, monkeypatch):
+    replica = Replica(create_app_engine(os.environ["DATABASE_URL"], PoolStats()))
+    sessionmaker = replica.sessionmaker
+    replica.sessions = 0
+
+    def counted_sessionmaker():
+        replica.sessions += 1
+        return sessionmaker()
+
+    replica.sessionmaker = counted_sessionmaker
+    monkeypatch.setattr(replica_router, "replicas", [replica])
+    yield replica
+    await replica.engine.dispose()
+
+
+# another worker has not seen the write, only the cookie tells it
+def forget_writes(monkeypatch):
+    monkeypatch.setattr(replica_router, "recent_writers", TTLCache(ttl=60))
+
+
+async def test_the_last_write_cookie_pins_reads_on_other_workers(
+    make_user, replica, monkeypatch
+):
+    user = await make_user()
+    balance = await user.balance()
+
+    response = await user.client.patch(
+        "/api/v1/accounts/deposit_money", params={"amount": 5}
+    )
+
+    assert response.status_code == 204
+    assert LAST_WRITE_COOKIE in response.cookies
+    forget_writes(monkeypatch)
+    replica.sessions = 0
+    assert await user.balance() == balance + 5
+    assert replica.sessions == 0
+
+    # without the cookie the read goes to the replica
+    user.client.cookies.delete(LAST_WRITE_COOKIE)
+    await user.balance()
+    assert replica.sessions == 1
+
+
+async def test_the_cookie_is_only_set_for_the_requesting_user(
+    make_user, replica, monkeypatch
+):
+    sender, receiver = await make_user(), await make_user()
+    forget_writes(monkeypatch)
+
+    response = await sender.client.patch(
+        "/api/v1/accounts/transfer_money",
+        json={"to_account_id": receiver.account["id"], "amount": 1},
+    )
+
+    assert response.status_code == 204
+    sender_id = sender.account["user"]["id"]
+    assert response.cookies[LAST_WRITE_COOKIE].startswith(f"{sender_id}.")
+
+
+def test_only_fresh_cookies_signed_for_the_user_count():
+    router = ReplicaRouter(None, [], staleness=5, secret="secret")
+    now = time.time()
+    cookie = router.sign_write(1, now)
+
+    assert router.wrote_recently(1, cookie)
+    assert not router.wrote_recently(2, cookie)
+    assert not router.wrote_recently(1, router.sign_write(1, now - 6))
+    tampered = cookie[:-1] + ("1" if cookie.endswith("0") else "0")
+    assert not router.wrote_recently(1, tampered)
+    assert not router.wrote_recently(1, ReplicaRouter(None, []).sign_write(1, now))
+    assert not router.wrote_recently(1, "garbage")
+    assert not router.wrote_recently(1, None)
@@ -0,0 +1,63 @@
+import pytest
+from tests.conftest import PASSWORD
+from src.app.core.revocations import token_revocations
+from src.app.db.database import AsyncSessionLocal
+
+pytestmark = pytest.mark.anyio
+
+ME_URL = "/api/v1/users/me"
+
+
+async def test_change_password_revokes_the_old_token(make_user, make_client):
+    user = await make_user()
+    old_token = user.client.cookies["access_token"]
+
+    response = await user.client.patch(
+        "/api/v1/users/me/change_password",
+        json={"password": PASSWORD, "new_password": "new-password"},
+    )
+
+    assert response.status_code == 204, response.text
+    # the response carried a new token for this session
+    assert user.client.cookies["access_token"] != old_token
+    assert (await user.client.get(ME_URL)).status_code == 200
+
+    other = await make_client()
+    other.cookies.set("access_token", old_token)
+    assert (await other.get(ME_URL)).status_code == 401
+
+    login = await other.post(
+        "/api/v1/auth_with_cookie/login",
+        data={"username": user.username, "password": "new-password"},
+    )
+    assert login.status_code == 200
+
+
+async def test_deleting_a_user_revokes_its_tokens(make_user, make_client):
+    user = await make_user()
+    token = user.client.cookies["access_token"]
+
+    response = await user.client.request(
+        "DELETE",
+        "/api/v1/auth_with_cookie/remove_user",
+        data={"username": user.username, "password": PASSWORD},
+    )
+    assert response.status_code == 204, response.text
+
+    other = await make_client()
+    other.cookies.set("access_token", token)
+    assert (await other.get(ME_URL)).status_code == 401
+
+
+async def test_revocations_apply_only_once_committed(app):
+    async with AsyncSessionLocal() as db:
+        token_revocations.revoke(db, 10**9, 5)
+        await db.rollback()
+    assert not token_revocations.is_revoked(10**9, 0)
+
+    async with AsyncSessionLocal() as db:
+        token_revocations.revoke(db, 10**9 + 1, 5)
+        assert not token_revocations.is_revoked(10**9 + 1, 0)
+        await db.commit()
+    assert token_revocations.is_revoked(10**9 + 1, 4)
+    assert not token_revocations.is_revoked(10**9 + 1, 5)
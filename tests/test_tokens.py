@@ -0,0 +1,114 @@
+import hashlib
+import hmac
+import json
+import time
+import pytest
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+from src.app.core import tokens
+from src.app.core.tokens import TokenVerifier, _b64encode
+
+SECRET = "secret"
+HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+def segment(data) -> str:
+    return _b64encode(json.dumps(data).encode()).decode()
+
+
+def signed(signing_input: str) -> str:
+    mac = hmac.new(SECRET.encode(), signing_input.encode(), hashlib.sha256)
+    return f"{signing_input}.{_b64encode(mac.digest()).decode()}"
+
+
+def token(payload, header=HEADER) -> str:
+    return signed(f"{segment(header)}.{segment(payload)}")
+
+
+def soon() -> int:
+    return int(time.time()) + 60
+
+
+# the verifier has to fail exactly like the jwt.decode it replaced
+def assert_rejected_like_jose(value: str, error: type) -> None:
+    with pytest.raises(error) as jose_error:
+        jwt.decode(value, SECRET, algorithms=["HS256"])
+    with pytest.raises(error) as verifier_error:
+        TokenVerifier(SECRET).decode(value)
+    assert type(verifier_error.value) is type(jose_error.value)
+
+
+@pytest.mark.parametrize(
+    "make_token, error",
+    [
+        (lambda: f"{segment({'alg': 'none'})}.{segment({'exp': soon()})}.", JWTError),
+        (lambda: jwt.encode({"exp": soon()}, SECRET, algorithm="HS512"), JWTError),
+        (lambda: token({"exp": soon()}, {"typ": "JWT"}), JWTError),
+        (lambda: token({"exp": "tomorrow"}), JWTClaimsError),
+        (lambda: token({"exp": soon(), "nbf": "today"}), JWTClaimsError),
+        (lambda: token({"exp": soon() + 60, "nbf": soon()}), JWTClaimsError),
+        (lambda: token({"exp": int(time.time()) - 1}), ExpiredSignatureError),
+        (lambda: "header.payload", JWTError),
+        (lambda: "a.b.c.d", JWTError),
+        (lambda: f"!!!.{segment({'exp': soon()})}.signature", JWTError),
+        (lambda: signed(f"{segment(HEADER)}.!!!"), JWTError),
+        (lambda: token([1, 2]), JWTError),
+        (lambda: token({"exp": soon()})[:-4] + "AAAA", JWTError),
+    ],
+    ids=[
+        "alg_none",
+        "alg_hs512",
+        "alg_missing",
+        "exp_not_a_number",
+        "nbf_not_a_number",
+        "nbf_in_the_future",
+        "expired",
+        "two_segments",
+        "four_segments",
+        "header_not_base64",
+        "payload_not_base64",
+        "payload_not_an_object",
+        "wrong_signature",
+    ],
+)
+def test_invalid_tokens_are_rejected_like_jose(make_token, error):
+    assert_rejected_like_jose(make_token(), error)
+
+
+def test_valid_token_matches_jose():
+    payload = {"id": 1, "sub": "user", "exp": soon()}
+    value = jwt.encode(payload, SECRET, algorithm="HS256")
+
+    assert TokenVerifier(SECRET).decode(value) == jwt.decode(
+        value, SECRET, algorithms=["HS256"]
+    )
+
+
+def test_memo_hit_with_a_different_payload_is_rejected():
+    verifier = TokenVerifier(SECRET)
+    value = token({"id": 1, "role": "user", "exp": soon()})
+    verifier.decode(value)
+    header, _, signature = value.split(".")
+    assert verifier.memo.get(signature) is not None
+
+    tampered = f"{header}.{segment({'id': 1, 'role': 'admin', 'exp': soon()})}"
+    with pytest.raises(JWTError, match="Signature verification failed"):
+        verifier.decode(f"{tampered}.{signature}")
+
+
+def test_memoized_token_expires_with_its_exp(monkeypatch):
+    verifier = TokenVerifier(SECRET)
+    exp = soon()
+    value = token({"id": 1, "exp": exp})
+    verifier.decode(value)
+    assert verifier.memo.get(value.rsplit(".", 1)[1]) is not None
+
+    monkeypatch.setattr(tokens.time, "time", lambda: exp + 1)
+
+    with pytest.raises(ExpiredSignatureError):
+        verifier.decode(value)
+
+
+def test_missing_secret_rejects_every_token():
+    with pytest.raises(JWTError):
+        TokenVerifier(None).decode(token({"exp": soon()}))
@@ -0,0 +1,146 @@
+import asyncio
+import pytest
+from sqlalchemy import func, select
+from src.app.db.database import AsyncSessionLocal
+from src.app.models.models import DBTransactions
+
+pytestmark = pytest.mark.anyio
+
+BATCH_URL = "/api/v1/accounts/transfer_batch"
+
+
+async def ledger_balance(account_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(func.sum(DBTransactions.amount)).where(
+                DBTransactions.account_id == account_id
+            )
+        )
+
+
+async def last_balance_after(account_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(DBTransactions.balance_after)
+            .where(DBTransactions.account_id == account_id)
+            .order_by(DBTransactions.created_at.desc(), DBTransactions.id.desc())
+            .limit(1)
+        )
+
+
+async def test_all_or_nothing_applies_every_transfer(make_user):
+    sender, first, second = [await make_user() for _ in range(3)]
+    balances = [await user.balance() for user in (sender, first, second)]
+
+    response = await sender.client.post(
+        BATCH_URL,
+        json={
+            "transfers": [
+                {"to_account_id": first.account["id"], "amount": 10},
+                {"to_account_id": second.account["id"], "amount": 20},
+                {"to_account_id": first.account["id"], "amount": 5},
+            ]
+        },
+    )
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["committed"] is True
+    assert (body["succeeded"], body["failed"]) == (3, 0)
+    assert await sender.balance() == balances[0] - 35
+    assert await first.balance() == balances[1] + 15
+    assert await second.balance() == balances[2] + 20
+    for user in (sender, first, second):
+        account_id = user.account["id"]
+        assert await ledger_balance(account_id) == await user.balance()
+        assert await last_balance_after(account_id) == await user.balance()
+
+
+async def test_all_or_nothing_rolls_back_on_a_failing_transfer(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balance = await sender.balance()
+
+    response = await sender.client.post(
+        BATCH_URL,
+        json={
+            "transfers": [
+                {"to_account_id": receiver.account["id"], "amount": 1},
+                {"to_account_id": receiver.account["id"], "amount": balance},
+                {"to_account_id": receiver.account["id"], "amount": 1},
+            ],
+            "mode": "all_or_nothing",
+        },
+    )
+
+    body = response.json()
+    assert body["committed"] is False
+    assert body["succeeded"] == 0
+    assert [item["detail"] for item in body["results"]] == [
+        "Rolled back, another transfer in the batch failed",
+        "Insufficient funds",
+        "Not applied, an earlier transfer in the batch failed",
+    ]
+    assert await sender.balance() == balance
+
+
+async def test_best_effort_skips_the_failing_transfers(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balance = await sender.balance()
+    received = await receiver.balance()
+
+    response = await sender.client.post(
+        BATCH_URL,
+        json={
+            "transfers": [
+                {"to_account_id": receiver.account["id"], "amount": 1},
+                {"to_account_id": sender.account["id"], "amount": 1},
+                {"to_account_id": receiver.account["id"], "amount": balance},
+                {"to_account_id": 10**9, "amount": 1},
+                {"to_account_id": receiver.account["id"], "amount": 2},
+            ],
+            "mode": "best_effort",
+        },
+    )
+
+    body = response.json()
+    assert body["committed"] is True
+    assert [item["success"] for item in body["results"]] == [
+        True,
+        False,
+        False,
+        False,
+        True,
+    ]
+    assert [item["detail"] for item in body["results"]][1:4] == [
+        "Cannot transfer money to the same account",
+        "Insufficient funds",
+        "Account not found",
+    ]
+    assert await sender.balance() == balance - 3
+    assert await receiver.balance() == received + 3
+
+
+async def test_concurrent_batches_never_overdraw(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balance = await sender.balance()
+    amount = balance // 3 + 1
+
+    responses = await asyncio.gather(
+        *(
+            sender.client.post(
+                BATCH_URL,
+                json={
+                    "transfers": [
+                        {"to_account_id": receiver.account["id"], "amount": amount}
+                    ]
+                },
+            )
+            for _ in range(10)
+        )
+    )
+
+    assert all(response.status_code == 200 for response in responses)
+    committed = sum(response.json()["committed"] for response in responses)
+    assert committed == 2
+    assert await sender.balance() == balance - committed * amount >= 0
+    assert await ledger_balance(sender.account["id"]) == await sender.balance()
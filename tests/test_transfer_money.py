@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+TRANSFER_URL = "/api/v1/accounts/transfer_money"
+
+
+async def test_transfer_moves_the_amount(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balances = await sender.balance(), await receiver.balance()
+
+    response = await sender.client.patch(
+        TRANSFER_URL, json={"to_account_id": receiver.account["id"], "amount": 25}
+    )
+
+    assert response.status_code == 204, response.text
+    assert await sender.balance() == balances[0] - 25
+    assert await receiver.balance() == balances[1] + 25
+
+
+async def test_transfer_to_the_same_account_is_rejected(make_user):
+    user = await make_user()
+    balance = await user.balance()
+
+    response = await user.client.patch(
+        TRANSFER_URL, json={"to_account_id": user.account["id"], "amount": 1}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cannot transfer money to the same account"
+    assert await user.balance() == balance
+
+
+async def test_transfer_over_the_balance_is_rejected(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balances = await sender.balance(), await receiver.balance()
+
+    response = await sender.client.patch(
+        TRANSFER_URL,
+        json={"to_account_id": receiver.account["id"], "amount": balances[0] + 1},
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient funds"
+    assert (await sender.balance(), await receiver.balance()) == balances
+
+
+async def test_transfer_to_a_missing_account_is_rejected(make_user):
+    user = await make_user()
+
+    response = await user.client.patch(
+        TRANSFER_URL, json={"to_account_id": 10**9, "amount": 1}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Account not found"
+
+
+async def test_concurrent_transfers_never_overdraw(make_user):
+    sender, receiver = await make_user(), await make_user()
+    balance = await sender.balance()
+    amount = balance // 3 + 1
+
+    responses = await asyncio.gather(
+        *(
+            sender.client.patch(
+                TRANSFER_URL,
+                json={"to_account_id": receiver.account["id"], "amount": amount},
+            )
+            for _ in range(10)
+        )
+    )
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [204] * 2 + [400] * 8
+    assert await sender.balance() == balance - 2 * amount
+
+
+async def test_withdraw_over_the_balance_is_rejected(make_user):
+    user = await make_user()
+    balance = await user.balance()
+
+    response = await user.client.patch(
+        "/api/v1/accounts/withdraw_money", params={"amount": balance + 1}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient funds"
+    assert await user.balance() == balance
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import event
+from src.app.db.access_layers.db_users import UserRow, user_cache, user_row_cache
+from src.app.db.database import async_engine
+from tests.conftest import PASSWORD
+
+pytestmark = pytest.mark.anyio
+
+ME_URL = "/api/v1/users/me"
+
+
+@pytest.fixture
+def statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(
+        async_engine.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
+    yield statements
+    event.remove(
+        async_engine.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
+
+
+# a read-only route with neither cache filled
+async def cold_me(user):
+    user_cache.pop(user.username)
+    user_row_cache.pop(user.username)
+    return await user.client.get(ME_URL)
+
+
+async def test_read_routes_never_fetch_the_password_hash(make_user, statements):
+    user = await make_user()
+    statements.clear()
+
+    response = await cold_me(user)
+
+    assert response.status_code == 200
+    assert statements and not any("hashed_password" in s for s in statements)
+    assert isinstance(user_row_cache.get(user.username), UserRow)
+    assert user_cache.get(user.username) is None
+
+
+async def test_patch_user_invalidates_the_row_cache(make_user):
+    user = await make_user()
+    await cold_me(user)
+
+    response = await user.client.patch(
+        "/api/v1/users/patch_user",
+        json={"username": user.username, "first_name": "Renamed", "last_name": "User"},
+    )
+
+    assert response.status_code == 204
+    assert user_row_cache.get(user.username) is None
+    assert (await user.client.get(ME_URL)).json()["first_name"] == "Renamed"
+
+
+async def test_change_password_invalidates_the_row_cache(make_user):
+    user = await make_user()
+    await cold_me(user)
+
+    response = await user.client.patch(
+        "/api/v1/users/me/change_password",
+        json={"password": PASSWORD, "new_password": "new-password"},
+    )
+
+    assert response.status_code == 204
+    assert user_row_cache.get(user.username) is None
+
+
+async def test_remove_user_invalidates_the_row_cache(make_user):
+    user = await make_user()
+    await cold_me(user)
+
+    response = await user.client.request(
+        "DELETE",
+        "/api/v1/auth_with_cookie/remove_user",
+        data={"username": user.username, "password": PASSWORD},
+    )
+
+    assert response.status_code == 204
+    assert user_row_cache.get(user.username) is None